@@ -0,0 +1,247 @@
+# batch_reports.py
+#
+# Exporta em lote os Excel do Campaign Flow e do Performance Index, sem abrir o app:
+#
+#     python batch_reports.py relatorios.json --base data/crowley.parquet --saida exports --workers 4
+#
+# O spec (JSON, ou YAML se o PyYAML estiver instalado) é uma lista de relatórios — ou
+# {"relatorios": [...]} — com os mesmos filtros da tela:
+#
+#     [
+#       {"pagina": "campaign_flow", "pracas": ["SAO PAULO", "RIO DE JANEIRO"], "veiculo": "NOVABRASIL FM",
+#        "concorrentes": [], "tipos": [], "dias": 7},
+#       {"pagina": "performance_index", "pracas": "todas", "veiculo": "Consolidado", "anunciantes": []},
+#       {"pagina": "performance_index", "escopo": "nacional", "inicio": "2025-01-01", "fim": "2025-01-31",
+#        "ref_inicio": "2024-12-01", "ref_fim": "2024-12-31"}
+#     ]
+#
+# Datas em AAAA-MM-DD. Sem datas, vale o padrão das páginas: os últimos `dias` (30) até a
+# última data da base e, no Performance Index, o mesmo intervalo imediatamente anterior.
+# "pracas" aceita uma lista ou "todas" (um arquivo por praça). `arquivo` troca o nome padrão
+# e aceita {praca}, {veiculo} e {data}.
+#
+# A base é lida uma vez (mesma otimização de tipos do app) e gravada num snapshot temporário
+# (utils.shared_frame) que os workers mapeiam em memória: a RAM não cresce com --workers. Os
+# relatórios saem das funções de utils.reports, as mesmas das páginas: o Excel sai igual ao
+# exportado pela tela (sem as seções opcionais do Performance Index).
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+from utils.export_crowley import generate_campaign_flow_excel, generate_performance_index_excel
+from utils.loaders import PATH_CROWLEY, read_crowley_file
+from utils.shared_frame import write_frame, map_frame
+from utils.reports import (
+    campaign_flow_tables, campaign_flow_filters, performance_index_tables, performance_index_filters,
+    MODO_PRACA, MODO_NACIONAL, TOTAL_NACIONAL, VEICULO_CONSOLIDADO
+)
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+PAGINAS = ("campaign_flow", "performance_index")
+MIN_DATE = date(2024, 1, 1)
+DIAS_PADRAO = 30
+
+# Base do worker (mapeada uma vez por processo em `_init_worker`)
+_worker_df = None
+
+
+class SpecError(ValueError):
+    pass
+
+
+def load_specs(path):
+    """Lista de relatórios do arquivo JSON/YAML."""
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise SpecError("Spec em YAML requer o pacote PyYAML (pip install pyyaml); use JSON.")
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    if isinstance(specs, dict):
+        specs = specs.get("relatorios")
+    if not isinstance(specs, list) or not all(isinstance(s, dict) for s in specs):
+        raise SpecError("O spec deve ser uma lista de relatórios (ou {\"relatorios\": [...]}).")
+    return specs
+
+
+def _parse_date(spec, key, default):
+    val = spec.get(key)
+    if not val:
+        return default
+    try:
+        return date.fromisoformat(str(val))
+    except ValueError:
+        raise SpecError(f"Data inválida em '{key}': {val} (use AAAA-MM-DD).")
+
+
+def _file_part(val):
+    return re.sub(r'[\\/:*?"<>|]+', "-", str(val)).strip()
+
+
+def expand_specs(specs, pracas_base, max_date):
+    """
+    Um relatório por (spec, praça), com datas resolvidas e nome do arquivo de saída.
+    Os padrões repetem os das páginas (datas, veículo consolidado, nome do arquivo).
+    """
+    hoje = datetime.now().strftime('%d%m')
+    tasks = []
+    for n, spec in enumerate(specs, start=1):
+        pagina = spec.get("pagina")
+        if pagina not in PAGINAS:
+            raise SpecError(f"Relatório {n}: 'pagina' deve ser um de {', '.join(PAGINAS)}.")
+
+        dias = int(spec.get("dias", DIAS_PADRAO))
+        dt_fim = _parse_date(spec, "fim", max_date)
+        dt_ini = _parse_date(spec, "inicio", max(MIN_DATE, dt_fim - timedelta(days=dias)))
+        ref_fim = _parse_date(spec, "ref_fim", max(MIN_DATE, dt_ini - timedelta(days=1)))
+        ref_ini = _parse_date(spec, "ref_inicio", max(MIN_DATE, ref_fim - timedelta(days=dias)))
+        if dt_ini > dt_fim or ref_ini > ref_fim:
+            raise SpecError(f"Relatório {n}: início posterior ao fim.")
+
+        modo = MODO_NACIONAL if pagina == "performance_index" and spec.get("escopo") == "nacional" else MODO_PRACA
+        if modo == MODO_NACIONAL:
+            pracas = [TOTAL_NACIONAL]
+        else:
+            pracas = spec.get("pracas", spec.get("praca"))
+            if pracas == "todas":
+                pracas = pracas_base
+            elif isinstance(pracas, str):
+                pracas = [pracas]
+            if not pracas:
+                raise SpecError(f"Relatório {n}: informe 'pracas' (lista ou \"todas\").")
+
+        veiculo = spec.get("veiculo")
+        if pagina == "campaign_flow":
+            if not veiculo:
+                raise SpecError(f"Relatório {n}: o Campaign Flow precisa de 'veiculo'.")
+            nome_padrao = "Campaign_Flow_{veiculo}_{praca}_{data}.xlsx" if len(pracas) > 1 else "Campaign_Flow_{veiculo}_{data}.xlsx"
+        else:
+            if modo == MODO_NACIONAL or not veiculo or veiculo == "Consolidado":
+                veiculo = VEICULO_CONSOLIDADO
+            nome_padrao = "Performance_Index_{praca}_{data}.xlsx"
+
+        for praca in pracas:
+            nome = spec.get("arquivo", nome_padrao).format(praca=_file_part(praca), veiculo=_file_part(veiculo), data=hoje)
+            tasks.append({
+                "pagina": pagina, "arquivo": nome, "modo": modo,
+                "dt_ini": dt_ini, "dt_fim": dt_fim, "ref_ini": ref_ini, "ref_fim": ref_fim,
+                "praca": praca, "veiculo": veiculo,
+                "concorrentes": list(spec.get("concorrentes") or []),
+                "anunciantes": list(spec.get("anunciantes") or []),
+                "tipos": list(spec.get("tipos") or []),
+            })
+
+    nomes = [t["arquivo"] for t in tasks]
+    repetidos = sorted({x for x in nomes if nomes.count(x) > 1})
+    if repetidos:
+        raise SpecError(f"Arquivos de saída repetidos: {', '.join(repetidos)} (use 'arquivo' com {{praca}}/{{veiculo}}).")
+    return tasks
+
+
+def _init_worker(snapshot_path):
+    global _worker_df
+    _worker_df = map_frame(snapshot_path)
+
+
+def build_report(df, task):
+    """Excel (BytesIO) de um relatório expandido, ou None se não houver dados com os filtros."""
+    if task["pagina"] == "campaign_flow":
+        args = (task["dt_ini"], task["dt_fim"], task["praca"], task["veiculo"], task["concorrentes"], task["tipos"])
+        resultado = campaign_flow_tables(df, *args)
+        if resultado is None:
+            return None
+        return generate_campaign_flow_excel(resultado[0], campaign_flow_filters(*args))
+
+    praca = None if task["modo"] == MODO_NACIONAL else task["praca"]
+    args = (task["dt_ini"], task["dt_fim"], task["ref_ini"], task["ref_fim"], task["modo"], praca,
+            task["veiculo"], task["anunciantes"], task["tipos"])
+    dfs_dict = performance_index_tables(df, *args)
+    if dfs_dict is None:
+        return None
+    return generate_performance_index_excel(dfs_dict, performance_index_filters(*args))
+
+
+def _run_task(task, output_dir):
+    inicio = time.time()
+    buffer = build_report(_worker_df, task)
+    if buffer is None:
+        return None, time.time() - inicio
+    path = os.path.join(output_dir, task["arquivo"])
+    with open(path, "wb") as f:
+        f.write(buffer.getbuffer())
+    return path, time.time() - inicio
+
+
+def _run_tasks(tasks, args, snapshot_path):
+    falhas = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker, initargs=(snapshot_path,)) as pool:
+        futures = {pool.submit(_run_task, task, args.saida): task for task in tasks}
+        for i, future in enumerate(as_completed(futures), start=1):
+            task = futures[future]
+            try:
+                path, segundos = future.result()
+            except Exception as exc:
+                falhas += 1
+                print(f"[{i}/{len(tasks)}] ERRO {task['arquivo']}: {exc}", file=sys.stderr)
+                continue
+            if path is None:
+                print(f"[{i}/{len(tasks)}] SEM DADOS {task['arquivo']}")
+            else:
+                print(f"[{i}/{len(tasks)}] OK {path} ({segundos:.1f}s)")
+
+    return 1 if falhas else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exportação em lote dos Excel do Campaign Flow e do Performance Index.")
+    parser.add_argument("spec", help="Arquivo JSON (ou YAML) com a lista de relatórios.")
+    parser.add_argument("--base", default=PATH_CROWLEY, help=f"Parquet da base Crowley (padrão: {PATH_CROWLEY}).")
+    parser.add_argument("--saida", default="exports", help="Pasta dos arquivos gerados (padrão: exports).")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Processos em paralelo (todos leem a mesma cópia da base, mapeada em memória).")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.base):
+        parser.error(f"Base não encontrada: {args.base}")
+
+    try:
+        specs = load_specs(args.spec)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+
+    df, ultima = read_crowley_file(args.base)
+    max_date = df["Data_Dt"].max().date() if "Data_Dt" in df.columns and df["Data_Dt"].notna().any() else date.today()
+    pracas_base = sorted(df["Praca"].dropna().unique())
+
+    try:
+        tasks = expand_specs(specs, pracas_base, max_date)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    os.makedirs(args.saida, exist_ok=True)
+    print(f"Base {args.base} (atualizada em {ultima}): {len(tasks)} relatório(s), {args.workers} worker(s).")
+
+    fd, snapshot_path = tempfile.mkstemp(prefix="crowley-", suffix=".arrow")
+    os.close(fd)
+    try:
+        write_frame(df, snapshot_path)
+        del df
+        return _run_tasks(tasks, args, snapshot_path)
+    finally:
+        os.remove(snapshot_path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,11 +2,15 @@
 import streamlit as st
 import pandas as pd
 import json
-import numpy as np
 from datetime import datetime, timedelta, date
 
 # Importação da função de exportação que criamos anteriormente
 from utils.export_crowley import generate_campaign_flow_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.loaders import dataset_version
+from utils.offload import run_aggregation, snapshot_id
+from utils.reports import campaign_flow_tables, campaign_flow_filters
 
 def render(df_crowley, cookies, data_atualizacao):
     # Aumenta limite de renderização para tabelas grandes
@@ -50,7 +54,7 @@ def render(df_crowley, cookies, data_atualizacao):
     # --- Botão Voltar ---
     if st.button("Voltar", key="btn_voltar_camp"):
         st.query_params["view"] = "menu"
-        keys_to_clear = ["camp_search_trigger", "camp_praca_key", "camp_veiculo_key", "camp_concorrentes_key", "camp_tipo_key", "camp_share_toggle", "show_camp_export"]
+        keys_to_clear = ["camp_search_trigger", "camp_praca_key", "camp_veiculo_key", "camp_concorrentes_key", "camp_tipo_key", "camp_share_toggle", "show_camp_export", "camp_export_job"]
         for k in keys_to_clear:
             st.session_state.pop(k, None)
         st.rerun()
@@ -64,7 +68,8 @@ def render(df_crowley, cookies, data_atualizacao):
         st.error("Base de dados não carregada.")
         st.stop()
 
-    df_crowley_copy = df_crowley.copy()
+    # Cópia rasa: a base é compartilhada (somente leitura); colunas novas ficam só na cópia
+    df_crowley_copy = df_crowley.copy(deep=False)
 
     # Garante Data
     if "Data_Dt" not in df_crowley_copy.columns:
@@ -243,101 +248,21 @@ def render(df_crowley, cookies, data_atualizacao):
     if st.session_state.get("camp_search_trigger"):
         
         # --- PROCESSAMENTO ---
-        df_base = df_context.copy()
-        
-        if sel_tipos:
-            df_base = df_base[df_base["Tipo"].isin(sel_tipos)]
-
-        df_target = df_base[df_base["Emissora"] == sel_veiculo]
-        
-        if sel_concorrentes: df_comp = df_base[df_base["Emissora"].isin(sel_concorrentes)]
-        else: df_comp = df_base[df_base["Emissora"] != sel_veiculo]
-
-        if df_target.empty and df_comp.empty:
+        # Pool de processos quando configurado (utils.offload); senão, aqui mesmo.
+        # A própria base (não a cópia) deixa o offload usar o snapshot compartilhado do loader
+        df_fonte = df_crowley if "Data_Dt" in df_crowley.columns else df_crowley_copy
+        resultado = run_aggregation(
+            campaign_flow_tables, df_fonte, dt_ini, dt_fim, sel_praca, sel_veiculo, sel_concorrentes, sel_tipos,
+            snapshot=snapshot_id("crowley", dataset_version(df_crowley)), mask=mask_context
+        )
+        if resultado is None:
              st.warning("Nenhum dado encontrado com os filtros selecionados.")
              return
-        
-        anunciantes_target = set(df_target["Anunciante"].unique()) if not df_target.empty else set()
-        anunciantes_comp = set(df_comp["Anunciante"].unique()) if not df_comp.empty else set()
-
-        exclusivos = anunciantes_target - anunciantes_comp
-        compartilhados = anunciantes_target & anunciantes_comp
-        ausentes = anunciantes_comp - anunciantes_target
-
-        # --- FUNÇÃO GERADORA DE TABELAS ---
-        def criar_tabela_resumo(df_src, lista_anunciantes, is_exclusive=False, calc_share=True):
-            if not lista_anunciantes: return pd.DataFrame()
-            
-            df_final = df_src[df_src["Anunciante"].isin(lista_anunciantes)].copy()
-            col_val = "Volume de Insercoes" if "Volume de Insercoes" in df_final.columns else "Contagem"
-            if col_val == "Contagem": df_final["Contagem"] = 1
-            
-            pivot_qty = pd.pivot_table(
-                df_final, index="Anunciante", columns="Emissora", values=col_val, 
-                aggfunc="sum", fill_value=0, observed=True
-            )
-            
-            total_por_anunciante = pivot_qty.sum(axis=1)
-            pivot_qty = pivot_qty.loc[total_por_anunciante.sort_values(ascending=False).index]
-            
-            # Se for exclusivo, Share é sempre 100%, retorna simples
-            if is_exclusive:
-                total_row = pivot_qty.sum(numeric_only=True)
-                pivot_qty.loc["TOTAL GERAL"] = total_row
-                return pivot_qty
-            
-            # Versão SEM Share
-            if not calc_share:
-                pivot_simple = pivot_qty.copy()
-                pivot_simple["TOTAL"] = total_por_anunciante
-                
-                total_row = pivot_simple.sum(numeric_only=True)
-                pivot_simple.loc["TOTAL GERAL"] = total_row
-                return pivot_simple
-
-            # Versão COM Share (Complexa: Coluna Dupla)
-            pivot_share = pivot_qty.div(total_por_anunciante.replace(0, 1), axis=0) * 100
-            
-            cols = []
-            for col in pivot_qty.columns:
-                cols.append((col, "Share %"))
-                cols.append((col, "Inserções"))
-            cols.append(("TOTAL", "Inserções"))
-            
-            df_multi = pd.DataFrame(index=pivot_qty.index, columns=pd.MultiIndex.from_tuples(cols))
-            
-            for col in pivot_qty.columns:
-                df_multi[(col, "Inserções")] = pivot_qty[col]
-                df_multi[(col, "Share %")] = pivot_share[col]
-            
-            df_multi[("TOTAL", "Inserções")] = total_por_anunciante
-            
-            # Totais
-            totals_qty = pivot_qty.sum(numeric_only=True)
-            grand_total = totals_qty.sum()
-            
-            total_geral_row = []
-            for col_tuple in df_multi.columns:
-                emissora, tipo = col_tuple
-                if tipo == "Inserções":
-                    if emissora == "TOTAL": val = grand_total
-                    else: val = totals_qty.get(emissora, 0)
-                    total_geral_row.append(val)
-                else:
-                    total_geral_row.append(np.nan)
-            
-            df_multi.loc["TOTAL GERAL"] = total_geral_row
-            return df_multi
 
-        # --- GERAÇÃO (Cache preventivo) ---
-        df1 = criar_tabela_resumo(df_target, exclusivos, is_exclusive=True)
-        
-        df_full_shared = pd.concat([df_target[df_target["Anunciante"].isin(compartilhados)], df_comp[df_comp["Anunciante"].isin(compartilhados)]])
-        df2_share = criar_tabela_resumo(df_full_shared, compartilhados, is_exclusive=False, calc_share=True)
-        df2_simple = criar_tabela_resumo(df_full_shared, compartilhados, is_exclusive=False, calc_share=False)
-        
-        df3_share = criar_tabela_resumo(df_comp, ausentes, is_exclusive=False, calc_share=True)
-        df3_simple = criar_tabela_resumo(df_comp, ausentes, is_exclusive=False, calc_share=False)
+        dfs_dict, (n_exclusivos, n_compartilhados, n_ausentes) = resultado
+        df1, df_exib = dfs_dict['exclusivos'], dfs_dict['detalhe']
+        df2_simple, df2_share = dfs_dict['comp_vol'], dfs_dict['comp_share']
+        df3_simple, df3_share = dfs_dict['ausentes_vol'], dfs_dict['ausentes_share']
 
         # --- ESTILIZAÇÃO ---
         def safe_fmt_int(x):
@@ -376,7 +301,7 @@ def render(df_crowley, cookies, data_atualizacao):
             return s
 
         # --- ABAS ---
-        t1, t2, t3 = st.tabs([f"Exclusivos ({len(exclusivos)})", f"Compartilhados ({len(compartilhados)})", f"Ausentes ({len(ausentes)})"])
+        t1, t2, t3 = st.tabs([f"Exclusivos ({n_exclusivos})", f"Compartilhados ({n_compartilhados})", f"Ausentes ({n_ausentes})"])
 
         with t1:
             if not df1.empty: st.dataframe(style_df(df1, is_exclusive=True), width="stretch", height=500)
@@ -395,23 +320,6 @@ def render(df_crowley, cookies, data_atualizacao):
         st.markdown("<br>", unsafe_allow_html=True)
 
         # --- DETALHAMENTO COM LINHA DE TOTAL (Visualização) ---
-        df_global_view = pd.concat([df_target, df_comp])
-        rename_map = {
-            "Praca": "Praça", "Anuncio": "Anúncio", "Duracao": "Duração",
-            "Emissora": "Veículo", "Volume de Insercoes": "Inserções", 
-            "Tipo": "Tipo de Veiculação", "DayPart": "DayPart"
-        }
-        df_detalhe = df_global_view.copy()
-        if "Data_Dt" in df_detalhe.columns:
-            df_detalhe["Data"] = df_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
-        
-        cols_originais = ["Data", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
-        cols_existentes = [c for c in cols_originais if c in df_detalhe.columns]
-        
-        # DF para Exportação (Original, Numérico, sem Total)
-        df_exib = df_detalhe[cols_existentes].rename(columns=rename_map)
-        df_exib.sort_values(by=["Anunciante", "Data"], inplace=True)
-        
         # DF para Visualização (Cópia para mexer à vontade)
         df_exib_view = df_exib.copy()
         
@@ -442,67 +350,34 @@ def render(df_crowley, cookies, data_atualizacao):
         
         # --- DEFINIÇÃO DO DIALOG ---
         if st.session_state.get("show_camp_export", False):
-            @st.dialog("Exportação")
+            @st.dialog("Exportação", on_dismiss=lambda: st.session_state.update(show_camp_export=False))
             def export_dialog_campaign():
-                st.write("Gerando arquivo Excel...")
-                
                 # Prepara os dados para enviar à função de exportação
-                tipos_export = ", ".join(sel_tipos) if sel_tipos else "Todos"
-                filters_info = {
-                    "Início": dt_ini.strftime("%d/%m/%Y"),
-                    "Fim": dt_fim.strftime("%d/%m/%Y"),
-                    "Praça": sel_praca,
-                    "Veículo": sel_veiculo,
-                    "Concorrentes": ", ".join(sel_concorrentes) if sel_concorrentes else "Todos",
-                    "Tipo de Veiculação": tipos_export
-                }
-
-                dfs_dict = {
-                    'exclusivos': df1,
-                    'comp_vol': df2_simple,
-                    'comp_share': df2_share,
-                    'ausentes_vol': df3_simple,
-                    'ausentes_share': df3_share,
-                    'detalhe': df_exib
-                }
-                
-                # Gera o arquivo
-                with st.spinner("Processando dados..."):
-                    excel_buffer = generate_campaign_flow_excel(dfs_dict, filters_info)
-                
-                st.success("Arquivo pronto!")
-                
-                # INJEÇÃO CSS PARA FORÇAR ESTILO DO BOTÃO DE DOWNLOAD
-                st.markdown("""
-                    <style>
-                    div[data-testid="stDialog"] button[kind="primary"] {
-                        background-color: #007bff !important;
-                        border-color: #007bff !important;
-                        color: white !important;
-                    }
-                    div[data-testid="stDialog"] button[kind="primary"]:hover {
-                        background-color: #0056b3 !important;
-                        border-color: #0056b3 !important;
-                        color: white !important;
-                    }
-                    /* Força a cor branca em qualquer elemento de texto dentro do botão */
-                    div[data-testid="stDialog"] button[kind="primary"] * {
-                        color: white !important;
-                    }
-                    </style>
-                """, unsafe_allow_html=True)
-                
-                # Botão de Download (Fecha o modal ao clicar)
-                st.download_button(
-                    label="Baixar Arquivo",
-                    data=excel_buffer,
+                filters_info = campaign_flow_filters(dt_ini, dt_fim, sel_praca, sel_veiculo, sel_concorrentes, sel_tipos)
+
+                signature = export_signature("campaign_flow", filters_info)
+                formato = export_format_radio("camp_export_formato")
+                if formato != FORMATO_EXCEL:
+                    columnar_export(
+                        {"Detalhamento": df_exib, "Exclusivos": df1, "Compartilhados (Volume)": df2_simple, "Ausentes (Volume)": df3_simple},
+                        filters_info, f"Campaign_Flow_{sel_veiculo}_{datetime.now().strftime('%d%m')}", formato,
+                        on_click=lambda: st.session_state.update(show_camp_export=False), key="camp_export",
+                        df_base=df_crowley, signature=signature
+                    )
+                    return
+
+                background_excel_export(
+                    df_crowley, signature, lambda: generate_campaign_flow_excel(dfs_dict, filters_info),
                     file_name=f"Campaign_Flow_{sel_veiculo}_{datetime.now().strftime('%d%m')}.xlsx",
-                    mime="application/vnd.ms-excel",
-                    type="primary",
-                    use_container_width=True,
-                    on_click=lambda: st.session_state.update(show_camp_export=False)
+                    mime="application/vnd.ms-excel", key="camp_export",
+                    on_done=lambda: st.session_state.update(show_camp_export=False)
                 )
                 
             export_dialog_campaign()
+        elif st.session_state.get("camp_export_job"):
+            # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+            _, c_job, _ = st.columns([1, 2, 1])
+            with c_job:
+                export_job_panel("camp_export")
         
         st.markdown(f"<div style='text-align:center;color:#666;font-size:0.8rem;margin-top:5px;'>Última atualização da base de dados: {data_atualizacao}</div>", unsafe_allow_html=True)
\ No newline at end of file
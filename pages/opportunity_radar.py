@@ -7,6 +7,10 @@ from datetime import datetime, timedelta, date
 
 # Nova importação
 from utils.export_crowley import generate_opportunity_radar_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.query_cache import cached_query
+from utils.reports import opportunity_radar_tables
 
 def render(df_crowley, cookies, data_atualizacao):
     # --- CONFIGURAÇÃO DE PERFORMANCE E VISUAL ---
@@ -51,7 +55,7 @@ def render(df_crowley, cookies, data_atualizacao):
     if st.button("Voltar", key="btn_voltar_opp"):
         st.query_params["view"] = "menu"
         # Limpa estados específicos do Opportunity Radar
-        keys_to_clear = ["opp_search_trigger", "opp_praca_key", "opp_veiculo_key", "opp_anunc_key", "opp_tipo_key", "show_opp_export"]
+        keys_to_clear = ["opp_search_trigger", "opp_praca_key", "opp_veiculo_key", "opp_anunc_key", "opp_tipo_key", "show_opp_export", "opp_export_job"]
         for k in keys_to_clear:
             st.session_state.pop(k, None)
         st.rerun()
@@ -64,7 +68,8 @@ def render(df_crowley, cookies, data_atualizacao):
         st.error("Base de dados não carregada.")
         st.stop()
 
-    df_crowley_copy = df_crowley.copy()
+    # Cópia rasa: a base é compartilhada (somente leitura); colunas novas ficam só na cópia
+    df_crowley_copy = df_crowley.copy(deep=False)
 
     if "Data_Dt" not in df_crowley_copy.columns:
         if "Data" in df_crowley_copy.columns:
@@ -260,56 +265,27 @@ def render(df_crowley, cookies, data_atualizacao):
 
     if st.session_state.get("opp_search_trigger"):
         
-        df_base = df_crowley_copy.copy()
-        
-        # Filtros Globais
-        mask_base = (df_base["Praca"] == sel_praca)
-        if sel_anunciante: mask_base = mask_base & (df_base["Anunciante"].isin(sel_anunciante))
-        if sel_tipos: mask_base = mask_base & (df_base["Tipo"].isin(sel_tipos))
-        if sel_veiculo != opcao_consolidado: mask_base = mask_base & (df_base["Emissora"] == sel_veiculo)
-
-        df_base = df_base[mask_base]
-
-        # Divisão Temporal
-        ts_ini = pd.Timestamp(dt_ini)
-        ts_fim = pd.Timestamp(dt_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-        ts_ref_ini = pd.Timestamp(ref_ini)
-        ts_ref_fim = pd.Timestamp(ref_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-
-        df_atual = df_base[(df_base["Data_Dt"] >= ts_ini) & (df_base["Data_Dt"] <= ts_fim)]
-        df_ref = df_base[(df_base["Data_Dt"] >= ts_ref_ini) & (df_base["Data_Dt"] <= ts_ref_fim)]
-
-        # Identificação dos Novos
-        anunciantes_atual = set(df_atual["Anunciante"].unique())
-        anunciantes_ref = set(df_ref["Anunciante"].unique())
-        
-        novos_anunciantes = anunciantes_atual - anunciantes_ref
+        # Resultado compartilhado entre sessões (mesma base + mesmos filtros = mesmo cálculo)
+        spec = {
+            "dt_ini": dt_ini, "dt_fim": dt_fim, "ref_ini": ref_ini, "ref_fim": ref_fim,
+            "praca": sel_praca, "veiculo": sel_veiculo,
+            "anunciantes": frozenset(sel_anunciante), "tipos": frozenset(sel_tipos)
+        }
+        with st.spinner("Buscando novos anunciantes..."):
+            resultado = cached_query(df_crowley, "opportunity_radar", spec, lambda: opportunity_radar_tables(
+                df_crowley_copy, dt_ini, dt_fim, ref_ini, ref_fim, sel_praca, sel_veiculo, sel_anunciante, sel_tipos
+            ))
 
-        if not novos_anunciantes:
+        if resultado is None:
             st.warning(f"Nenhum anunciante novo encontrado na **{sel_praca}** neste período comparativo.")
         else:
-            st.success(f"Encontrados **{len(novos_anunciantes)}** novos anunciantes em relação ao período anterior!")
-            
-            df_resultado = df_atual[df_atual["Anunciante"].isin(novos_anunciantes)].copy()
-            
-            # --- TABELA RESUMO (PIVOT) ---
-            val_col = "Volume de Insercoes" if "Volume de Insercoes" in df_resultado.columns else "Contagem"
-            if val_col == "Contagem": df_resultado["Contagem"] = 1
-            agg_func = "sum" if val_col == "Volume de Insercoes" else "count"
+            st.success(f"Encontrados **{resultado['novos']}** novos anunciantes em relação ao período anterior!")
 
-            pivot_table = pd.DataFrame()
-            try:
-                pivot_table = pd.pivot_table(
-                    df_resultado, index="Anunciante", columns="Emissora",
-                    values=val_col, aggfunc=agg_func, fill_value=0, observed=True 
-                )
-                pivot_table["TOTAL"] = pivot_table.sum(axis=1)
-                pivot_table = pivot_table.sort_values(by="TOTAL", ascending=False)
-                
-                # TOTALIZADOR (ROW)
-                total_row = pivot_table.sum(numeric_only=True)
-                pivot_table.loc["TOTAL GERAL"] = total_row
-                
+            # --- TABELA RESUMO (PIVOT) ---
+            pivot_table = resultado["overview"]
+            if resultado["erro"]:
+                st.error(f"Erro ao gerar tabela dinâmica: {resultado['erro']}")
+            else:
                 st.markdown("### Visão Geral por Emissora")
                 
                 def style_pivot(df):
@@ -330,28 +306,11 @@ def render(df_crowley, cookies, data_atualizacao):
                     height=min(450, len(pivot_table) * 35 + 40)
                 )
 
-            except Exception as e:
-                st.error(f"Erro ao gerar tabela dinâmica: {e}")
-
             st.markdown("<br>", unsafe_allow_html=True)
             
             # --- TABELA DETALHADA ---
-            rename_map = {
-                "Praca": "Praça", "Anuncio": "Anúncio", "Duracao": "Duração",
-                "Emissora": "Veículo", "Volume de Insercoes": "Inserções", 
-                "Tipo": "Tipo de Veiculação", "DayPart": "DayPart"
-            }
-            
-            df_detalhe = df_resultado.copy()
-            if "Data_Dt" in df_detalhe.columns:
-                df_detalhe["Data"] = df_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
-            
-            cols_originais = ["Data", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
-            cols_existentes = [c for c in cols_originais if c in df_detalhe.columns]
-            
             # DF para EXPORTAÇÃO (Original Numérico)
-            df_exib = df_detalhe[cols_existentes].rename(columns=rename_map)
-            df_exib.sort_values(by=["Anunciante", "Data"], inplace=True)
+            df_exib = resultado["detail"]
             
             # DF para VISUALIZAÇÃO (Com Total e String)
             df_exib_view = df_exib.copy()
@@ -384,10 +343,8 @@ def render(df_crowley, cookies, data_atualizacao):
 
             # --- DEFINIÇÃO DO DIALOG ---
             if st.session_state.get("show_opp_export", False):
-                @st.dialog("Exportação")
+                @st.dialog("Exportação", on_dismiss=lambda: st.session_state.update(show_opp_export=False))
                 def export_dialog_opp():
-                    st.write("Gerando arquivo Excel...")
-                    
                     # Prepara dados
                     tipos_export = ", ".join(sel_tipos) if sel_tipos else "Todos"
                     filters_info = {
@@ -406,41 +363,30 @@ def render(df_crowley, cookies, data_atualizacao):
                         'detail': df_exib
                     }
                     
-                    with st.spinner("Processando dados..."):
-                        excel_buffer = generate_opportunity_radar_excel(dfs_dict, filters_info)
-                    
-                    st.success("Arquivo pronto!")
-                    
-                    # INJEÇÃO CSS PARA BOTÃO
-                    st.markdown("""
-                        <style>
-                        div[data-testid="stDialog"] button[kind="primary"] {
-                            background-color: #007bff !important;
-                            border-color: #007bff !important;
-                            color: white !important;
-                        }
-                        div[data-testid="stDialog"] button[kind="primary"]:hover {
-                            background-color: #0056b3 !important;
-                            border-color: #0056b3 !important;
-                            color: white !important;
-                        }
-                        div[data-testid="stDialog"] button[kind="primary"] * {
-                            color: white !important;
-                        }
-                        </style>
-                    """, unsafe_allow_html=True)
-                    
-                    st.download_button(
-                        label="Baixar Arquivo", 
-                        data=excel_buffer,
+                    signature = export_signature("opportunity_radar", filters_info)
+                    formato = export_format_radio("opp_export_formato")
+                    if formato != FORMATO_EXCEL:
+                        columnar_export(
+                            {"Detalhamento": df_exib, "Visão Geral": pivot_table},
+                            filters_info, f"Opportunity_Radar_{sel_praca}_{datetime.now().strftime('%d%m')}", formato,
+                            on_click=lambda: st.session_state.update(show_opp_export=False), key="opp_export",
+                            df_base=df_crowley, signature=signature
+                        )
+                        return
+
+                    background_excel_export(
+                        df_crowley, signature, lambda: generate_opportunity_radar_excel(dfs_dict, filters_info),
                         file_name=f"Opportunity_Radar_{sel_praca}_{datetime.now().strftime('%d%m')}.xlsx",
-                        mime="application/vnd.ms-excel",
-                        type="primary", 
-                        use_container_width=True,
-                        on_click=lambda: st.session_state.update(show_opp_export=False)
+                        mime="application/vnd.ms-excel", key="opp_export",
+                        on_done=lambda: st.session_state.update(show_opp_export=False)
                     )
                 
                 export_dialog_opp()
+            elif st.session_state.get("opp_export_job"):
+                # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+                _, c_job, _ = st.columns([1, 2, 1])
+                with c_job:
+                    export_job_panel("opp_export")
             
             st.markdown(f"""
                 <div style="text-align: center; color: #666; font-size: 0.8rem; margin-top: 5px;">
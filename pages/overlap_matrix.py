@@ -0,0 +1,354 @@
+# pages/overlap_matrix.py
+import streamlit as st
+import pandas as pd
+import numpy as np
+import json
+from datetime import datetime, timedelta, date
+
+from utils.export_crowley import generate_overlap_matrix_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.loaders import dataset_version
+
+
+def build_overlap_matrix(df_slice, val_col):
+    """
+    Monta a matriz de incidência Anunciante × Emissora do recorte e obtém as
+    sobreposições de todos os pares de emissoras com um único produto matricial.
+    """
+    adv_codes, adv_labels = pd.factorize(df_slice["Anunciante"], sort=True)
+    em_codes, em_labels = pd.factorize(df_slice["Emissora"], sort=True)
+
+    valid = (adv_codes >= 0) & (em_codes >= 0)
+    n_adv, n_em = len(adv_labels), len(em_labels)
+    flat = adv_codes[valid].astype(np.int64) * n_em + em_codes[valid]
+
+    if val_col in df_slice.columns:
+        weights = df_slice[val_col].to_numpy()[valid].astype(np.float64)
+    else:
+        weights = np.ones(len(flat), dtype=np.float64)
+
+    # Volume por (anunciante, emissora) e presença (1 se houve qualquer registro)
+    vol = np.bincount(flat, weights=weights, minlength=n_adv * n_em).reshape(n_adv, n_em)
+    presence = (np.bincount(flat, minlength=n_adv * n_em) > 0).reshape(n_adv, n_em).astype(np.float64)
+
+    # [i, j] = anunciantes presentes em i e j
+    shared_adv = presence.T @ presence
+    # [i, j] = inserções da emissora i vindas de anunciantes também presentes em j
+    shared_ins = vol.T @ presence
+
+    n_by_station = np.diag(shared_adv)
+    union = n_by_station[:, None] + n_by_station[None, :] - shared_adv
+    jaccard = np.divide(shared_adv, union, out=np.zeros_like(shared_adv), where=union > 0)
+
+    stations = [str(e) for e in em_labels]
+    return {
+        "anunciantes": pd.DataFrame(shared_adv.astype(np.int64), index=stations, columns=stations),
+        "insercoes": pd.DataFrame(shared_ins.astype(np.int64), index=stations, columns=stations),
+        "jaccard": pd.DataFrame(jaccard, index=stations, columns=stations),
+        "volume": vol,
+        "presence": presence > 0,
+        "advertisers": [str(a) for a in adv_labels],
+        "stations": stations,
+    }
+
+
+def drill_down_pair(result, station_a, station_b):
+    """Lista os anunciantes compartilhados entre duas emissoras com as inserções em cada uma."""
+    stations = result["stations"]
+    ia, ib = stations.index(station_a), stations.index(station_b)
+    both = result["presence"][:, ia] & result["presence"][:, ib]
+    idx = np.flatnonzero(both)
+    if idx.size == 0:
+        return pd.DataFrame()
+
+    df_pair = pd.DataFrame({
+        "Anunciante": np.asarray(result["advertisers"], dtype=object)[idx],
+        f"Inserções {station_a}": result["volume"][idx, ia].astype(np.int64),
+        f"Inserções {station_b}": result["volume"][idx, ib].astype(np.int64),
+    })
+    df_pair["TOTAL"] = df_pair.iloc[:, 1] + df_pair.iloc[:, 2]
+    return df_pair.sort_values("TOTAL", ascending=False).reset_index(drop=True)
+
+
+def render(df_crowley, cookies, data_atualizacao):
+    # --- CSS GLOBAL E ESPECÍFICO ---
+    st.markdown("""
+        <style>
+        [data-testid="stDataFrame"] th {
+            text-align: center !important;
+            vertical-align: middle !important;
+        }
+        [data-testid="stDataFrame"] td {
+            text-align: center !important;
+            vertical-align: middle !important;
+        }
+        .page-title-centered {
+            text-align: center;
+            font-size: 2.5rem;
+            font-weight: 700;
+            color: #003366; /* Azul Novabrasil */
+            margin-bottom: 0.5rem;
+            margin-top: 1rem;
+        }
+        .page-subtitle-centered {
+            text-align: center;
+            color: #666;
+            font-size: 1rem;
+            margin-bottom: 2rem;
+        }
+        </style>
+    """, unsafe_allow_html=True)
+
+    # --- Botão Voltar ---
+    if st.button("Voltar", key="btn_voltar_ovl"):
+        st.query_params["view"] = "menu"
+        keys_to_clear = ["ovl_search_trigger", "ovl_praca_key", "ovl_veiculos_key", "ovl_tipo_key", "ovl_result", "show_ovl_export", "ovl_export_job"]
+        for k in keys_to_clear:
+            st.session_state.pop(k, None)
+        st.rerun()
+
+    # --- TÍTULOS ---
+    st.markdown('<div class="page-title-centered">Overlap Matrix</div>', unsafe_allow_html=True)
+    st.markdown('<div class="page-subtitle-centered">Anunciantes e inserções compartilhados entre todos os pares de emissoras da praça</div>', unsafe_allow_html=True)
+
+    # --- Validação da Base ---
+    if df_crowley is None or df_crowley.empty:
+        st.error("Base de dados não carregada.")
+        st.stop()
+
+    if "Data_Dt" not in df_crowley.columns:
+        st.error("Coluna de Data não encontrada na base.")
+        st.stop()
+
+    # --- CONFIGURAÇÃO DE DATAS ---
+    min_date_allowed = date(2024, 1, 1)
+    try: max_date_allowed = datetime.strptime(data_atualizacao, "%d/%m/%Y").date()
+    except: max_date_allowed = datetime.now().date()
+
+    tooltip_dates = f"Dados disponíveis para pesquisa:\nDe 01/01/2024 até {data_atualizacao}"
+
+    # --- COOKIES ---
+    saved_filters = {}
+    cookie_val = cookies.get("crowley_filters_overlap")
+    if cookie_val:
+        try: saved_filters = json.loads(cookie_val)
+        except: pass
+
+    def get_date_from_cookie(key, default_date):
+        val = saved_filters.get(key)
+        if val:
+            try:
+                d = datetime.strptime(val, "%Y-%m-%d").date()
+                if d < min_date_allowed: return min_date_allowed
+                if d > max_date_allowed: return max_date_allowed
+                return d
+            except: return default_date
+        return default_date
+
+    def get_cookie_val(key, default=None):
+        return saved_filters.get(key, default)
+
+    default_ini = max(min_date_allowed, max_date_allowed - timedelta(days=30))
+    val_dt_ini = get_date_from_cookie("dt_ini", default_ini)
+    val_dt_fim = get_date_from_cookie("dt_fim", max_date_allowed)
+
+    saved_praca = get_cookie_val("praca", None)
+    saved_tipos = get_cookie_val("tipo_veiculacao", [])
+    if "Consolidado" in saved_tipos: saved_tipos = []
+
+    # --- INTERFACE DE FILTROS ---
+    st.markdown("##### Configuração da Análise")
+
+    lista_pracas = sorted(df_crowley["Praca"].dropna().unique())
+
+    if saved_praca not in lista_pracas: saved_praca = lista_pracas[0] if lista_pracas else None
+    if "ovl_praca_key" not in st.session_state:
+        st.session_state.ovl_praca_key = saved_praca
+
+    def on_change_reset():
+        st.session_state["ovl_search_trigger"] = False
+
+    with st.container(border=True):
+        c1, c2, c3 = st.columns([1, 1, 1.5])
+        with c1: dt_ini = st.date_input("Início", value=val_dt_ini, min_value=min_date_allowed, max_value=max_date_allowed, format="DD/MM/YYYY", help=tooltip_dates)
+        with c2: dt_fim = st.date_input("Fim", value=val_dt_fim, min_value=min_date_allowed, max_value=max_date_allowed, format="DD/MM/YYYY")
+        with c3: sel_praca = st.selectbox("Praça", options=lista_pracas, key="ovl_praca_key", on_change=on_change_reset)
+
+        st.divider()
+
+        # --- CÁLCULO DO CONTEXTO ---
+        ts_ini_ctx = pd.Timestamp(dt_ini)
+        ts_fim_ctx = pd.Timestamp(dt_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+
+        mask_context = (
+            (df_crowley["Data_Dt"] >= ts_ini_ctx) &
+            (df_crowley["Data_Dt"] <= ts_fim_ctx) &
+            (df_crowley["Praca"] == sel_praca)
+        )
+        df_context = df_crowley[mask_context]
+
+        lista_veiculos_local = sorted(df_context["Emissora"].dropna().unique())
+        tipos_disponiveis = sorted(df_context["Tipo"].dropna().unique().tolist())
+
+        c4, c5 = st.columns(2)
+
+        if "ovl_veiculos_key" not in st.session_state:
+            st.session_state.ovl_veiculos_key = [v for v in get_cookie_val("veiculos", []) if v in lista_veiculos_local]
+        else:
+            st.session_state.ovl_veiculos_key = [v for v in st.session_state.ovl_veiculos_key if v in lista_veiculos_local]
+
+        with c4:
+            sel_veiculos = st.multiselect(
+                "Emissoras (Opc.)",
+                options=lista_veiculos_local,
+                key="ovl_veiculos_key",
+                placeholder="Se vazio, considera TODAS",
+                on_change=on_change_reset
+            )
+
+        if "ovl_tipo_key" not in st.session_state:
+            st.session_state.ovl_tipo_key = [t for t in saved_tipos if t in tipos_disponiveis]
+        else:
+            st.session_state.ovl_tipo_key = [t for t in st.session_state.ovl_tipo_key if t in tipos_disponiveis]
+
+        with c5:
+            sel_tipos = st.multiselect(
+                "Tipo de Veiculação (Opc.)",
+                options=tipos_disponiveis,
+                key="ovl_tipo_key",
+                placeholder="Todos",
+                on_change=on_change_reset
+            )
+
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        _, c_btn, _ = st.columns([1, 1, 1])
+        with c_btn:
+            submitted = st.button("Gerar Overlap Matrix", type="primary", use_container_width=True)
+
+    if submitted:
+        st.session_state["ovl_search_trigger"] = True
+
+        new_filters = {
+            "dt_ini": str(dt_ini),
+            "dt_fim": str(dt_fim),
+            "praca": sel_praca,
+            "veiculos": sel_veiculos,
+            "tipo_veiculacao": sel_tipos if sel_tipos else ["Consolidado"]
+        }
+        cookies["crowley_filters_overlap"] = json.dumps(new_filters)
+        cookies.save()
+
+    if st.session_state.get("ovl_search_trigger"):
+
+        # --- PROCESSAMENTO (Reaproveitado entre reruns do drill-down) ---
+        # Inclui a versão da base: após a atualização horária a matriz é recalculada
+        signature = (dataset_version(df_crowley), str(dt_ini), str(dt_fim), sel_praca, tuple(sel_veiculos), tuple(sel_tipos))
+        cached = st.session_state.get("ovl_result")
+
+        if cached is None or cached[0] != signature:
+            df_base = df_context
+            if sel_veiculos: df_base = df_base[df_base["Emissora"].isin(sel_veiculos)]
+            if sel_tipos: df_base = df_base[df_base["Tipo"].isin(sel_tipos)]
+
+            if df_base.empty:
+                st.warning("Nenhum dado encontrado com os filtros selecionados.")
+                return
+
+            result = build_overlap_matrix(df_base, "Volume de Insercoes")
+            st.session_state["ovl_result"] = (signature, result)
+        else:
+            result = cached[1]
+
+        stations = result["stations"]
+        if len(stations) < 2:
+            st.warning("São necessárias pelo menos duas emissoras para calcular a sobreposição.")
+            return
+
+        st.caption(f"{len(stations)} emissoras • {len(result['advertisers'])} anunciantes no período. A diagonal traz o total da própria emissora.")
+
+        def style_matrix(df, is_pct=False):
+            s = df.style.background_gradient(cmap="Blues", axis=None)
+            s = s.format("{:.1%}" if is_pct else "{:,.0f}")
+            s = s.set_properties(**{'text-align': 'center'})
+            return s
+
+        t1, t2, t3 = st.tabs(["Anunciantes Compartilhados", "Inserções Compartilhadas", "Similaridade (Jaccard)"])
+        with t1:
+            st.dataframe(style_matrix(result["anunciantes"]), width="stretch", height=500)
+        with t2:
+            st.caption("Linha = emissora de origem das inserções; coluna = emissora onde o anunciante também está presente.")
+            st.dataframe(style_matrix(result["insercoes"]), width="stretch", height=500)
+        with t3:
+            st.dataframe(style_matrix(result["jaccard"], is_pct=True), width="stretch", height=500)
+
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        # --- DRILL-DOWN DE UM PAR ---
+        st.markdown("##### Detalhe do Par")
+        d1, d2 = st.columns(2)
+        with d1: station_a = st.selectbox("Emissora A", options=stations, index=0, key="ovl_drill_a")
+        with d2: station_b = st.selectbox("Emissora B", options=stations, index=1, key="ovl_drill_b")
+
+        df_pair = drill_down_pair(result, station_a, station_b)
+        if df_pair.empty:
+            st.info("Nenhum anunciante compartilhado entre as emissoras selecionadas.")
+        else:
+            jac = result["jaccard"].loc[station_a, station_b]
+            st.caption(f"{len(df_pair)} anunciantes compartilhados • Jaccard {jac:.1%}")
+            st.dataframe(df_pair, width="stretch", hide_index=True, height=400)
+
+        st.markdown("---")
+
+        # ==================== EXPORTAÇÃO COM POP-UP ====================
+        _, _, c_btn_exp, _, _ = st.columns([1, 1, 1, 1, 1])
+        with c_btn_exp:
+            if st.button("Exportar Excel", type="secondary", use_container_width=True):
+                st.session_state.show_ovl_export = True
+
+        if st.session_state.get("show_ovl_export", False):
+            @st.dialog("Exportação", on_dismiss=lambda: st.session_state.update(show_ovl_export=False))
+            def export_dialog_overlap():
+                filters_info = {
+                    "Início": dt_ini.strftime("%d/%m/%Y"),
+                    "Fim": dt_fim.strftime("%d/%m/%Y"),
+                    "Praça": sel_praca,
+                    "Emissoras": ", ".join(sel_veiculos) if sel_veiculos else "Todas",
+                    "Tipo de Veiculação": ", ".join(sel_tipos) if sel_tipos else "Todos",
+                    "Par Detalhado": f"{station_a} × {station_b}"
+                }
+
+                dfs_dict = {
+                    'anunciantes': result["anunciantes"],
+                    'insercoes': result["insercoes"],
+                    'jaccard': result["jaccard"],
+                    'par': df_pair
+                }
+
+                signature = export_signature("overlap_matrix", filters_info)
+                formato = export_format_radio("ovl_export_formato")
+                if formato != FORMATO_EXCEL:
+                    columnar_export(
+                        {"Detalhe do Par": df_pair, "Anunciantes Compartilhados": result["anunciantes"], "Inserções Compartilhadas": result["insercoes"], "Jaccard": result["jaccard"]},
+                        filters_info, f"Overlap_Matrix_{sel_praca}_{datetime.now().strftime('%d%m')}", formato,
+                        on_click=lambda: st.session_state.update(show_ovl_export=False), key="ovl_export",
+                        df_base=df_crowley, signature=signature
+                    )
+                    return
+
+                background_excel_export(
+                    df_crowley, signature, lambda: generate_overlap_matrix_excel(dfs_dict, filters_info),
+                    file_name=f"Overlap_Matrix_{sel_praca}_{datetime.now().strftime('%d%m')}.xlsx",
+                    mime="application/vnd.ms-excel", key="ovl_export",
+                    on_done=lambda: st.session_state.update(show_ovl_export=False)
+                )
+
+            export_dialog_overlap()
+        elif st.session_state.get("ovl_export_job"):
+            # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+            _, c_job, _ = st.columns([1, 2, 1])
+            with c_job:
+                export_job_panel("ovl_export")
+
+        st.markdown(f"<div style='text-align:center;color:#666;font-size:0.8rem;margin-top:5px;'>Última atualização da base de dados: {data_atualizacao}</div>", unsafe_allow_html=True)
@@ -8,6 +8,20 @@ from datetime import datetime, timedelta, date
 
 # Nova importação
 from utils.export_crowley import generate_performance_index_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.loaders import dataset_version
+from utils.analytics import consistency_metrics, consistency_index, CONSISTENCY_COLS, week_windows, weekly_ranks
+from utils.analytics import period_matrix, compare_periods, month_periods, same_month_periods
+from utils.query_cache import cached_query, cached_query_batch
+from utils.reports import build_national_leaderboard, leaderboard_table, performance_mask, performance_leaderboard, performance_detail, performance_index_filters
+from utils.reports import MODO_PRACA, MODO_NACIONAL, TOTAL_NACIONAL, VEICULO_CONSOLIDADO
+
+# Opções da tela que mudam o conteúdo do Excel sem constar nos filtros (entram na assinatura do cache)
+PERF_EXPORT_OPTIONS = [
+    "perf_nat_view", "perf_chk_consist", "perf_chk_index", "perf_chk_traj",
+    "perf_chk_multi", "perf_multi_preset", "perf_multi_n", "perf_multi_a", "perf_multi_b",
+]
 
 def render(df_crowley, cookies, data_atualizacao):
     # --- CONFIGURAÇÃO DE VISUAL ---
@@ -53,7 +67,7 @@ def render(df_crowley, cookies, data_atualizacao):
     if st.button("Voltar", key="btn_voltar_perf"):
         st.query_params["view"] = "menu"
         # Limpa chaves específicas do Performance Index
-        keys_to_clear = ["perf_search_trigger", "perf_praca_key", "perf_veiculo_key", "perf_anunc_key", "perf_tipo_key", "show_perf_export"]
+        keys_to_clear = ["perf_search_trigger", "perf_praca_key", "perf_veiculo_key", "perf_anunc_key", "perf_tipo_key", "show_perf_export", "perf_export_job", "perf_modo", "perf_nat_view", "perf_chk_consist", "perf_chk_index", "perf_chk_traj", "perf_chk_multi"]
         for k in keys_to_clear:
             st.session_state.pop(k, None)
         st.rerun()
@@ -68,7 +82,8 @@ def render(df_crowley, cookies, data_atualizacao):
         st.stop()
 
     # Cópia para imutabilidade
-    df_crowley_copy = df_crowley.copy()
+    # Cópia rasa: a base é compartilhada (somente leitura); colunas novas ficam só na cópia
+    df_crowley_copy = df_crowley.copy(deep=False)
 
     # Garante coluna de data
     if "Data_Dt" not in df_crowley_copy.columns:
@@ -155,6 +170,15 @@ def render(df_crowley, cookies, data_atualizacao):
 
         st.divider()
 
+        # Escopo: uma praça ou ranking nacional (todas as praças de uma vez)
+        lista_modos = [MODO_PRACA, MODO_NACIONAL]
+        saved_modo = get_cookie_val("modo", MODO_PRACA)
+        sel_modo = st.radio(
+            "Escopo", options=lista_modos, index=lista_modos.index(saved_modo) if saved_modo in lista_modos else 0,
+            horizontal=True, key="perf_modo", on_change=on_change_reset
+        )
+        modo_nacional = (sel_modo == MODO_NACIONAL)
+
         # --- CÁLCULO DO CONTEXTO (CASCATA) ---
         ts_ini_ctx = pd.Timestamp(dt_ini)
         ts_fim_ctx = pd.Timestamp(dt_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
@@ -163,9 +187,10 @@ def render(df_crowley, cookies, data_atualizacao):
 
         mask_context = (
             (df_crowley_copy["Data_Dt"] >= ts_ini_ctx) &
-            (df_crowley_copy["Data_Dt"] <= ts_fim_ctx) &
-            (df_crowley_copy["Praca"] == sel_praca_ctx)
+            (df_crowley_copy["Data_Dt"] <= ts_fim_ctx)
         )
+        if not modo_nacional:
+            mask_context = mask_context & (df_crowley_copy["Praca"] == sel_praca_ctx)
         df_context = df_crowley_copy[mask_context]
         
         # Listas Disponíveis no Contexto
@@ -173,14 +198,17 @@ def render(df_crowley, cookies, data_atualizacao):
         lista_anunciantes_local = sorted(df_context["Anunciante"].dropna().unique())
         tipos_disponiveis = sorted(df_context["Tipo"].dropna().unique().tolist())
         
-        opcao_consolidado = "Consolidado (Todas as emissoras)"
+        opcao_consolidado = VEICULO_CONSOLIDADO
         lista_veiculos_local = [opcao_consolidado] + raw_veiculos_local
 
-        # 2. Filtros Categóricos - Linha 1
+        # 2. Filtros Categóricos - Linha 1 (Praça/Veículo não se aplicam ao ranking nacional)
         c3, c4 = st.columns(2)
 
-        with c3:
-            sel_praca = st.selectbox("Praça", options=lista_pracas, key="perf_praca_key", on_change=on_change_reset)
+        if not modo_nacional:
+            with c3:
+                sel_praca = st.selectbox("Praça", options=lista_pracas, key="perf_praca_key", on_change=on_change_reset)
+        else:
+            sel_praca = TOTAL_NACIONAL
 
         # Init Session State Veículo
         if "perf_veiculo_key" not in st.session_state:
@@ -190,14 +218,17 @@ def render(df_crowley, cookies, data_atualizacao):
              if st.session_state.perf_veiculo_key not in lista_veiculos_local:
                  st.session_state.perf_veiculo_key = opcao_consolidado
 
-        with c4:
-            sel_veiculo = st.selectbox(
-                "Veículo", 
-                options=lista_veiculos_local, 
-                key="perf_veiculo_key", 
-                help="Selecione 'Consolidado' para ver o total do mercado na praça.",
-                on_change=on_change_reset
-            )
+        if not modo_nacional:
+            with c4:
+                sel_veiculo = st.selectbox(
+                    "Veículo", 
+                    options=lista_veiculos_local, 
+                    key="perf_veiculo_key", 
+                    help="Selecione 'Consolidado' para ver o total do mercado na praça.",
+                    on_change=on_change_reset
+                )
+        else:
+            sel_veiculo = opcao_consolidado
 
         # 3. Filtros Categóricos - Linha 2
         c5, c6 = st.columns(2)
@@ -251,7 +282,9 @@ def render(df_crowley, cookies, data_atualizacao):
         new_filters = {
             "dt_ini": str(dt_ini), "dt_fim": str(dt_fim),
             "ref_ini": str(ref_ini), "ref_fim": str(ref_fim),
-            "praca": sel_praca, "veiculo": sel_veiculo,
+            "modo": sel_modo,
+            "praca": get_cookie_val("praca") if modo_nacional else sel_praca,
+            "veiculo": get_cookie_val("veiculo") if modo_nacional else sel_veiculo,
             "anunciantes": sel_anunciante,
             "tipo_veiculacao": tipos_para_cookie
         }
@@ -260,89 +293,99 @@ def render(df_crowley, cookies, data_atualizacao):
 
     if st.session_state.get("perf_search_trigger"):
         
-        # 1. Filtro Base (Comum)
-        mask_base = (df_crowley_copy["Praca"] == sel_praca)
-        if sel_anunciante: mask_base = mask_base & (df_crowley_copy["Anunciante"].isin(sel_anunciante))
-        if sel_tipos: mask_base = mask_base & (df_crowley_copy["Tipo"].isin(sel_tipos))
-        if sel_veiculo != opcao_consolidado: mask_base = mask_base & (df_crowley_copy["Emissora"] == sel_veiculo)
-            
-        df_base = df_crowley_copy[mask_base]
-
-        # 2. Divisão Temporal
         ts_ini, ts_fim = pd.Timestamp(dt_ini), pd.Timestamp(dt_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
         ts_ref_ini, ts_ref_fim = pd.Timestamp(ref_ini), pd.Timestamp(ref_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
 
-        df_atual = df_base[(df_base["Data_Dt"] >= ts_ini) & (df_base["Data_Dt"] <= ts_fim)]
-        df_ref = df_base[(df_base["Data_Dt"] >= ts_ref_ini) & (df_base["Data_Dt"] <= ts_ref_fim)]
-
-        if df_atual.empty and df_ref.empty:
-            st.warning("Nenhum dado encontrado para os períodos selecionados (com os filtros atuais).")
-            return
-
-        # 3. Agregação
-        val_col = "Volume de Insercoes" if "Volume de Insercoes" in df_base.columns else "Contagem"
-        if val_col == "Contagem": 
-            df_atual = df_atual.copy(); df_atual["Contagem"] = 1
-            df_ref = df_ref.copy(); df_ref["Contagem"] = 1
+        def base_mask(praca, veiculo):
+            """Máscara do filtro base da praça/veículo (praça None = todas)."""
+            return performance_mask(df_crowley_copy, praca, veiculo, sel_anunciante, sel_tipos)
+
+        def filter_base(praca, veiculo, ts_from=None, ts_to=None):
+            """Filtro base da praça/veículo, opcionalmente restrito a [ts_from, ts_to]."""
+            mask_base = base_mask(praca, veiculo)
+            if ts_from is not None: mask_base = mask_base & (df_crowley_copy["Data_Dt"] >= ts_from) & (df_crowley_copy["Data_Dt"] <= ts_to)
+            return df_crowley_copy[mask_base]
+
+        def split_periods(df_base):
+            """Filtro base dividido nos períodos atual e anterior."""
+            return (
+                df_base[(df_base["Data_Dt"] >= ts_ini) & (df_base["Data_Dt"] <= ts_fim)],
+                df_base[(df_base["Data_Dt"] >= ts_ref_ini) & (df_base["Data_Dt"] <= ts_ref_fim)]
+            )
 
-        grp_atual = df_atual.groupby("Anunciante", observed=True)[val_col].sum().reset_index().rename(columns={val_col: "Ins_Atual"})
-        grp_ref = df_ref.groupby("Anunciante", observed=True)[val_col].sum().reset_index().rename(columns={val_col: "Ins_Ref"})
+        # Recorte exibido (praça/veículo; praça None = nacional) — consistência, trajetória e detalhamento
+        if modo_nacional:
+            view_praca, view_veiculo = None, opcao_consolidado
+        else:
+            view_praca, view_veiculo = sel_praca, sel_veiculo
 
-        grp_atual["Anunciante"] = grp_atual["Anunciante"].astype(str)
-        grp_ref["Anunciante"] = grp_ref["Anunciante"].astype(str)
+        # Rankings compartilhados entre sessões (mesma base + mesmos filtros = mesmo cálculo)
+        spec = {
+            "periodos": ((dt_ini, dt_fim), (ref_ini, ref_fim)),
+            "anunciantes": frozenset(sel_anunciante), "tipos": frozenset(sel_tipos)
+        }
 
-        df_rank = pd.merge(grp_atual, grp_ref, on="Anunciante", how="outer").fillna(0)
+        if modo_nacional:
+            # Ranking de todas as praças + nacional, calculado uma vez por par de períodos
+            periods = ((str(dt_ini), str(dt_fim)), (str(ref_ini), str(ref_fim)))
+            with st.spinner("Calculando ranking nacional..."):
+                board = cached_query(df_crowley, "performance_index_nacional", spec, lambda: build_national_leaderboard(
+                    df_crowley, periods, tuple(sel_tipos), tuple(sel_anunciante)
+                ))
+            if board.empty:
+                st.warning("Nenhum dado encontrado para os períodos selecionados (com os filtros atuais).")
+                return
+
+            lista_views = board["Praca"].drop_duplicates().tolist()
+            if st.session_state.get("perf_nat_view") not in lista_views:
+                st.session_state.pop("perf_nat_view", None)
+            sel_view = st.selectbox("Praça exibida", options=lista_views, key="perf_nat_view")
+            if sel_view != TOTAL_NACIONAL: view_praca = sel_view
+
+            df_export_rank = leaderboard_table(board[board["Praca"] == sel_view])
+            rankings_export = {p: leaderboard_table(board[board["Praca"] == p]) for p in lista_views}
 
-        # 4. Cálculos
-        df_rank["Rank_Atual"] = df_rank["Ins_Atual"].rank(ascending=False, method='min')
-        df_rank["Rank_Anterior"] = df_rank["Ins_Ref"].rank(ascending=False, method='min')
+        else:
+            # Filtro base, divisão temporal, agregação única por (Anunciante, período) e ordenação
+            with st.spinner("Calculando ranking..."):
+                df_export_rank = cached_query(
+                    df_crowley, "performance_index", dict(spec, praca=sel_praca, veiculo=sel_veiculo),
+                    lambda: performance_leaderboard(df_crowley_copy, dt_ini, dt_fim, ref_ini, ref_fim, sel_praca, sel_veiculo, sel_anunciante, sel_tipos)
+                )
+            if df_export_rank is None:
+                st.warning("Nenhum dado encontrado para os períodos selecionados (com os filtros atuais).")
+                return
+            rankings_export = None
 
-        df_rank["Var %"] = np.where(
-            df_rank["Ins_Ref"] > 0,
-            (df_rank["Ins_Atual"] - df_rank["Ins_Ref"]) / df_rank["Ins_Ref"],
-            np.where(df_rank["Ins_Atual"] > 0, 1.0, 0.0) 
-        )
+        st.markdown("### Resultado Comparativo")
 
-        total_atual = df_rank["Ins_Atual"].sum()
-        df_rank["Share %"] = (df_rank["Ins_Atual"] / total_atual) if total_atual > 0 else 0.0
+        # --- MÉTRICAS DE CONSISTÊNCIA (Opcional) ---
+        c_chk1, c_chk2, _ = st.columns([1, 1, 2])
+        show_consist = c_chk1.checkbox("Métricas de Consistência", key="perf_chk_consist", help="Dias ativos, maior sequência, CV semanal e emissoras distintas por período.")
+        show_index = c_chk2.checkbox("Índice de Consistência", key="perf_chk_index", disabled=not show_consist, help="Média (0–100) de % dias ativos, sequência, estabilidade semanal e alcance em emissoras no período atual.")
 
-        # Ordenação
-        df_rank = df_rank.sort_values(by=["Ins_Atual", "Ins_Ref"], ascending=[False, False]).reset_index(drop=True)
-        df_rank["Posição"] = range(1, len(df_rank) + 1)
+        consist_cols = []
+        if show_consist:
+            df_cons_atual, df_cons_ref = split_periods(filter_base(view_praca, view_veiculo))
 
-        # --- PREPARAÇÃO PARA EXIBIÇÃO ---
-        df_rank = df_rank.rename(columns={
-            "Posição": "Ranking",
-            "Rank_Anterior": "Posição Anterior",
-            "Ins_Atual": "Inserções (Atual)",
-            "Ins_Ref": "Inserções (Anterior)"
-        })
+            m_atual = consistency_metrics(df_cons_atual, ts_ini, ts_fim)
+            m_ref = consistency_metrics(df_cons_ref, ts_ref_ini, ts_ref_fim)
+            if show_index:
+                n_dias = (pd.Timestamp(dt_fim) - pd.Timestamp(dt_ini)).days + 1
+                m_atual["Índice Consistência"] = consistency_index(m_atual, n_dias)
+            m_ref = m_ref.rename(columns={c: f"{c} (Ant.)" for c in CONSISTENCY_COLS})
 
-        total_ins_atual = df_rank["Inserções (Atual)"].sum()
-        total_ins_ref = df_rank["Inserções (Anterior)"].sum()
-        var_total = (total_ins_atual - total_ins_ref) / total_ins_ref if total_ins_ref > 0 else 0.0
-        
-        row_total = {
-            "Ranking": "",           
-            "Posição Anterior": "",  
-            "Anunciante": "TOTAL GERAL",
-            "Inserções (Atual)": total_ins_atual,
-            "Share %": "",           
-            "Var %": var_total,
-            "Inserções (Anterior)": total_ins_ref
-        }
-        
-        cols_show = ["Ranking", "Posição Anterior", "Anunciante", "Inserções (Atual)", "Share %", "Var %", "Inserções (Anterior)"]
-        df_final_data = df_rank[cols_show].copy()
-        
-        # DF Numérico (com total row) para Styler e Exportação (Ranking)
-        df_export_rank = pd.concat([df_final_data, pd.DataFrame([row_total])], ignore_index=True)
+            consist_cols = [c for c in m_atual.columns if c != "Anunciante"] + [f"{c} (Ant.)" for c in CONSISTENCY_COLS]
+            df_export_rank = df_export_rank.merge(m_atual, on="Anunciante", how="left").merge(m_ref, on="Anunciante", how="left")
 
         # DF Texto para Tela (Styler)
         df_screen = df_export_rank.copy()
         df_screen["Ranking"] = df_screen["Ranking"].astype(str).str.replace(r'\.0$', '', regex=True)
         df_screen["Posição Anterior"] = df_screen["Posição Anterior"].astype(str).str.replace(r'\.0$', '', regex=True)
         df_screen["Share %"] = df_screen["Share %"].astype(str)
+        is_total = df_screen["Anunciante"] == "TOTAL GERAL"
+        for c in consist_cols:
+            df_screen[c] = df_screen[c].astype(str).where(~is_total, "")
 
         def safe_fmt_share(val):
             if val == "": return ""
@@ -357,22 +400,35 @@ def render(df_crowley, cookies, data_atualizacao):
                 return f"{int(v)}"
             except: return str(val)
         
+        def safe_fmt_num(fmt):
+            def _fmt(val):
+                if val == "": return ""
+                try:
+                    v = float(val)
+                    return "-" if np.isnan(v) else fmt.format(v)
+                except: return str(val)
+            return _fmt
+        
         def highlight_var(val):
             if isinstance(val, (float, int)):
                 if val > 0: return 'color: #16a34a; font-weight: bold'
                 if val < 0: return 'color: #dc2626; font-weight: bold'
             return ""
 
-        st.markdown("### Resultado Comparativo")
+        fmt_map = {
+            "Inserções (Atual)": "{:,.0f}",
+            "Inserções (Anterior)": "{:,.0f}",
+            "Var %": "{:+.1%}",
+            "Share %": safe_fmt_share,
+            "Posição Anterior": safe_fmt_int_dash
+        }
+        for c in consist_cols:
+            if c.startswith("% Dias"): fmt_map[c] = safe_fmt_num("{:.0%}")
+            elif c.startswith("CV Semanal"): fmt_map[c] = safe_fmt_num("{:.2f}")
+            else: fmt_map[c] = safe_fmt_num("{:.0f}")
 
         styler = df_screen.style\
-            .format({
-                "Inserções (Atual)": "{:,.0f}",
-                "Inserções (Anterior)": "{:,.0f}",
-                "Var %": "{:+.1%}",
-                "Share %": safe_fmt_share,
-                "Posição Anterior": safe_fmt_int_dash
-            })\
+            .format(fmt_map)\
             .map(highlight_var, subset=["Var %"])\
             .apply(lambda x: ["background-color: #f0f2f6; font-weight: bold" if x["Anunciante"] == "TOTAL GERAL" else "" for i in x], axis=1)
         
@@ -393,48 +449,127 @@ def render(df_crowley, cookies, data_atualizacao):
 
         st.markdown("<br>", unsafe_allow_html=True)
 
+        # --- TRAJETÓRIA SEMANAL DO RANKING (Opcional) ---
+        df_trajetoria = None
+        if st.checkbox("Trajetória Semanal do Ranking", key="perf_chk_traj", help="Posição de cada anunciante semana a semana no período atual."):
+            # Uma entrada de cache por semana, compartilhada entre sessões: ampliar o período só calcula as semanas novas
+            windows = week_windows(ts_ini, ts_fim)
+            traj_spec = {
+                "praca": view_praca, "veiculo": view_veiculo,
+                "anunciantes": frozenset(sel_anunciante), "tipos": frozenset(sel_tipos)
+            }
+
+            def ranks_semanas(pendentes):
+                missing = [windows[i] for i in pendentes]
+                df_weeks = filter_base(view_praca, view_veiculo, missing[0][0], missing[-1][1] + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
+                long = weekly_ranks(df_weeks, missing)
+                ranks_by_week = {i: g.set_index("Anunciante")["Rank"] for i, g in long.groupby("Semana")}
+                return {pos: ranks_by_week.get(i, pd.Series(dtype=float)) for i, pos in enumerate(pendentes)}
+
+            week_ranks = cached_query_batch(
+                df_crowley, "performance_index_semana", [dict(traj_spec, semana=w) for w in windows], ranks_semanas
+            )
+
+            week_labels = [w[0].strftime("%d/%m") for w in windows]
+            anunciantes_rank = df_export_rank.loc[df_export_rank["Anunciante"] != "TOTAL GERAL", "Anunciante"].astype(str)
+            df_trajetoria = pd.DataFrame(
+                {lbl: ranks.rename(index=str).reindex(anunciantes_rank).to_numpy() for lbl, ranks in zip(week_labels, week_ranks)}
+            )
+            df_trajetoria.insert(0, "Anunciante", anunciantes_rank.to_numpy())
+
+            df_traj_view = df_trajetoria.copy()
+            df_traj_view.insert(1, "Trajetória", [
+                [None if np.isnan(v) else float(v) for v in row] for row in df_trajetoria[week_labels].to_numpy(dtype=float)
+            ])
+            max_rank = float(np.nanmax(df_trajetoria[week_labels].to_numpy(dtype=float))) if len(df_trajetoria) and week_labels else 1.0
+            col_config_traj = {
+                "Anunciante": st.column_config.TextColumn("Anunciante", width="large"),
+                "Trajetória": st.column_config.LineChartColumn("Trajetória", y_min=1, y_max=max_rank, width="medium")
+            }
+            for lbl in week_labels:
+                col_config_traj[lbl] = st.column_config.NumberColumn(lbl, format="%d", width="small")
+
+            st.caption("Posição por semana (segunda a domingo); quanto mais baixa a linha, melhor a posição.")
+            st.dataframe(df_traj_view, width="stretch", height=400, hide_index=True, column_config=col_config_traj)
+            st.markdown("<br>", unsafe_allow_html=True)
+
+        # --- COMPARAÇÃO MULTI-PERÍODO (Opcional) ---
+        df_multi = None
+        if st.checkbox("Comparação Multi-Período", key="perf_chk_multi", help="Volumes de N períodos numa única agregação, com comparação entre quaisquer dois deles."):
+            lista_presets = ["Últimos meses", "Mesmo mês em anos anteriores"]
+            c_m1, c_m2 = st.columns(2)
+            sel_preset = c_m1.selectbox("Períodos", options=lista_presets, key="perf_multi_preset")
+            n_periodos = c_m2.number_input("Quantidade", min_value=2, max_value=12 if sel_preset == lista_presets[0] else 5, value=3, step=1, key="perf_multi_n")
+
+            # Todos os períodos terminam na data final do período atual
+            if sel_preset == lista_presets[0]:
+                periods = month_periods(dt_fim, int(n_periodos))
+            else:
+                periods = same_month_periods(dt_fim, int(n_periodos))
+            labels_periodos = [p[0] for p in periods]
+
+            matriz_multi = period_matrix(filter_base(view_praca, view_veiculo), periods)
+
+            c_m3, c_m4 = st.columns(2)
+            per_a = c_m3.selectbox("Comparar", options=labels_periodos, index=len(labels_periodos) - 1, key="perf_multi_a")
+            per_b = c_m4.selectbox("Com", options=labels_periodos, index=len(labels_periodos) - 2, key="perf_multi_b")
+
+            if matriz_multi.empty:
+                st.info("Nenhuma inserção nos períodos escolhidos.")
+            else:
+                comp = compare_periods(matriz_multi, per_a, per_b)
+                df_multi = matriz_multi.loc[comp.index].copy()
+                df_multi[f"Posição {per_a}"] = comp["Rank_Atual"]
+                df_multi[f"Posição {per_b}"] = comp["Rank_Anterior"]
+                df_multi["Var %"] = comp["Var %"]
+                df_multi["Situação"] = comp["Status"]
+                df_multi = df_multi.sort_values(by=[per_a, per_b], ascending=[False, False]).reset_index()
+
+                contagem = comp["Status"].value_counts()
+                st.caption(
+                    f"{per_a} x {per_b}: {contagem.get('Novo', 0)} novos, {contagem.get('Perdido', 0)} perdidos, "
+                    f"{contagem.get('Mantido', 0)} mantidos."
+                )
+
+                col_config_multi = {"Anunciante": st.column_config.TextColumn("Anunciante", width="large")}
+                for lbl in labels_periodos:
+                    col_config_multi[lbl] = st.column_config.NumberColumn(lbl, format="%d")
+                for lbl in (f"Posição {per_a}", f"Posição {per_b}"):
+                    col_config_multi[lbl] = st.column_config.NumberColumn(lbl, format="%d")
+                col_config_multi["Var %"] = st.column_config.NumberColumn("Var %", format="percent")
+                st.dataframe(df_multi, width="stretch", height=400, hide_index=True, column_config=col_config_multi)
+            st.markdown("<br>", unsafe_allow_html=True)
+
         # --- DETALHAMENTO ---
         with st.expander("Fonte de Dados Completa (Detalhamento)", expanded=False):
-            df_full_detail = pd.concat([df_atual, df_ref]).drop_duplicates()
-            
-            rename_map = {
-                "Praca": "Praça", "Anuncio": "Anúncio", "Duracao": "Duração",
-                "Emissora": "Veículo", "Volume de Insercoes": "Inserções", 
-                "Tipo": "Tipo de Veiculação", "DayPart": "DayPart"
-            }
-            
-            cols_originais = ["Data_Dt", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
-            cols_existentes = [c for c in cols_originais if c in df_full_detail.columns]
-            
-            # DF Numérico Original (Exportação)
-            df_exib_detalhe = df_full_detail[cols_existentes].rename(columns=rename_map)
-            
-            if "Data_Dt" in df_exib_detalhe.columns:
-                df_exib_detalhe["Data"] = df_exib_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
-                df_exib_detalhe = df_exib_detalhe.drop(columns=["Data_Dt"])
-                cols = ["Data"] + [c for c in df_exib_detalhe.columns if c != "Data"]
-                df_exib_detalhe = df_exib_detalhe[cols]
-
-            df_exib_detalhe.sort_values(by=["Anunciante", "Data"], inplace=True)
-
-            # --- DF PARA VISUALIZAÇÃO (Com Total e String) ---
-            df_exib_view = df_exib_detalhe.copy()
-
-            if not df_exib_view.empty and "Inserções" in df_exib_view.columns:
-                total_ins = df_exib_view["Inserções"].sum()
+            # Detalhamento apenas para uma praça (o nacional equivale à base inteira)
+            if view_praca is None:
+                df_exib_detalhe = None
+                st.caption("Selecione uma praça em 'Praça exibida' para ver o detalhamento.")
+            else:
+                # DF Numérico Original (Exportação)
+                df_exib_detalhe = performance_detail(
+                    df_crowley_copy, base_mask(view_praca, view_veiculo), ((ts_ini, ts_fim), (ts_ref_ini, ts_ref_fim))
+                )
+
+                # --- DF PARA VISUALIZAÇÃO (Com Total e String) ---
+                df_exib_view = df_exib_detalhe.copy()
+
+                if not df_exib_view.empty and "Inserções" in df_exib_view.columns:
+                    total_ins = df_exib_view["Inserções"].sum()
                 
-                # Linha de Total com Espaços
-                row_total = {col: " " for col in df_exib_view.columns}
-                row_total["Anunciante"] = "TOTAL GERAL"
-                row_total["Inserções"] = total_ins
+                    # Linha de Total com Espaços
+                    row_total = {col: " " for col in df_exib_view.columns}
+                    row_total["Anunciante"] = "TOTAL GERAL"
+                    row_total["Inserções"] = total_ins
                 
-                # Append
-                df_exib_view = pd.concat([df_exib_view, pd.DataFrame([row_total])], ignore_index=True)
+                    # Append
+                    df_exib_view = pd.concat([df_exib_view, pd.DataFrame([row_total])], ignore_index=True)
                 
-                # CONVERSÃO PARA TEXTO (Evita erro do PyArrow)
-                df_exib_view = df_exib_view.astype(str)
+                    # CONVERSÃO PARA TEXTO (Evita erro do PyArrow)
+                    df_exib_view = df_exib_view.astype(str)
 
-            st.dataframe(df_exib_view, width="stretch", hide_index=True)
+                st.dataframe(df_exib_view, width="stretch", hide_index=True)
 
         st.markdown("---")
 
@@ -447,62 +582,50 @@ def render(df_crowley, cookies, data_atualizacao):
 
         # --- DEFINIÇÃO DO DIALOG ---
         if st.session_state.get("show_perf_export", False):
-            @st.dialog("Exportação")
+            @st.dialog("Exportação", on_dismiss=lambda: st.session_state.update(show_perf_export=False))
             def export_dialog_performance():
-                st.write("Gerando arquivo Excel...")
-
                 # Prepara dados
-                tipos_str = ", ".join(sel_tipos) if sel_tipos else "Todos"
-                anunciantes_str = ", ".join(sel_anunciante) if sel_anunciante else "Todos"
-
-                filters_info = {
-                    "Período Atual": f"{dt_ini.strftime('%d/%m/%Y')} a {dt_fim.strftime('%d/%m/%Y')}",
-                    "Período Comparativo": f"{ref_ini.strftime('%d/%m/%Y')} a {ref_fim.strftime('%d/%m/%Y')}",
-                    "Praça": sel_praca,
-                    "Veículo": sel_veiculo,
-                    "Anunciantes Filtro": anunciantes_str,
-                    "Tipo de Veiculação": tipos_str
-                }
+                filters_info = performance_index_filters(
+                    dt_ini, dt_fim, ref_ini, ref_fim, sel_modo, sel_praca, sel_veiculo, sel_anunciante, sel_tipos
+                )
 
                 dfs_dict = {
-                    'ranking': df_export_rank,
+                    'ranking': None if rankings_export else df_export_rank,
+                    'rankings': rankings_export,
+                    'trajectory': df_trajetoria,
+                    'multi_period': df_multi,
                     'detail': df_exib_detalhe
                 }
 
-                with st.spinner("Processando dados..."):
-                    excel_buffer = generate_performance_index_excel(dfs_dict, filters_info)
-
-                st.success("Arquivo pronto!")
-
-                # INJEÇÃO CSS PARA BOTÃO
-                st.markdown("""
-                    <style>
-                    div[data-testid="stDialog"] button[kind="primary"] {
-                        background-color: #007bff !important;
-                        border-color: #007bff !important;
-                        color: white !important;
-                    }
-                    div[data-testid="stDialog"] button[kind="primary"]:hover {
-                        background-color: #0056b3 !important;
-                        border-color: #0056b3 !important;
-                        color: white !important;
-                    }
-                    div[data-testid="stDialog"] button[kind="primary"] * {
-                        color: white !important;
-                    }
-                    </style>
-                """, unsafe_allow_html=True)
-
-                st.download_button(
-                    label="Baixar Arquivo",
-                    data=excel_buffer,
+                # Ranking nacional: uma tabela só, com a praça como coluna
+                ranking_tabela = df_export_rank
+                if rankings_export:
+                    ranking_tabela = pd.concat(
+                        rankings_export.values(), keys=rankings_export.keys(), names=["Praça", None]
+                    ).reset_index(level=0).reset_index(drop=True)
+                signature = export_signature("performance_index", filters_info, **{k: st.session_state.get(k) for k in PERF_EXPORT_OPTIONS})
+                formato = export_format_radio("perf_export_formato")
+                if formato != FORMATO_EXCEL:
+                    columnar_export(
+                        {"Detalhamento": df_exib_detalhe, "Ranking": ranking_tabela, "Trajetória Semanal": df_trajetoria, "Multi-Período": df_multi},
+                        filters_info, f"Performance_Index_{sel_praca}_{datetime.now().strftime('%d%m')}", formato,
+                        on_click=lambda: st.session_state.update(show_perf_export=False), key="perf_export",
+                        df_base=df_crowley, signature=signature
+                    )
+                    return
+
+                background_excel_export(
+                    df_crowley, signature, lambda: generate_performance_index_excel(dfs_dict, filters_info),
                     file_name=f"Performance_Index_{sel_praca}_{datetime.now().strftime('%d%m')}.xlsx",
-                    mime="application/vnd.ms-excel",
-                    type="primary",
-                    use_container_width=True,
-                    on_click=lambda: st.session_state.update(show_perf_export=False)
+                    mime="application/vnd.ms-excel", key="perf_export",
+                    on_done=lambda: st.session_state.update(show_perf_export=False)
                 )
 
             export_dialog_performance()
+        elif st.session_state.get("perf_export_job"):
+            # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+            _, c_job, _ = st.columns([1, 2, 1])
+            with c_job:
+                export_job_panel("perf_export")
         
         st.markdown(f"<div style='text-align:center;color:#666;font-size:0.8rem;margin-top:5px;'>Última atualização da base de dados: {data_atualizacao}</div>", unsafe_allow_html=True)
\ No newline at end of file
@@ -10,23 +10,27 @@ import io
 import math
 import json
 from datetime import datetime
-import calendar
 import xlsxwriter
 
 # Nova importação
 from utils.export_crowley import generate_presence_map_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.loaders import dataset_version
+from utils.presence_index import get_presence_index, period_buckets, PresenceGrid, GRANULARITIES
 
-# Configuração global do pandas para styler
-pd.set_option("styler.render.max_elements", 5_000_000)
+# Máximo de colunas (dias/semanas/meses) estilizadas por vez na grade
+MAX_VISIBLE_COLS = 31
+
+# Visões do mapa
+MODO_VEICULO = "Por Veículo"
+MODO_CRUZADO = "Anunciantes em todas as emissoras"
 
 # ==============================================================================
 # 2. FUNÇÃO PRINCIPAL `render`
 # ==============================================================================
 def render(df_crowley, cookies, data_atualizacao):
     
-    mes_map = {1: "Janeiro", 2: "Fevereiro", 3: "Março", 4: "Abril", 5: "Maio", 6: "Junho",
-               7: "Julho", 8: "Agosto", 9: "Setembro", 10: "Outubro", 11: "Novembro", 12: "Dezembro"}
-    
     # --- CSS GLOBAL (Carrega IMEDIATAMENTE ao abrir a página) ---
     st.markdown("""
         <style>
@@ -60,7 +64,7 @@ def render(df_crowley, cookies, data_atualizacao):
     # --- Header e Navegação ---
     if st.button("Voltar", key="btn_voltar_pres"):
         st.query_params["view"] = "menu"
-        keys_to_clear = ["pres_search_trigger", "pres_page_idx", "pres_praca_key", "pres_tipo_key", "show_pres_export"]
+        keys_to_clear = ["pres_search_trigger", "pres_page_idx", "pres_praca_key", "pres_tipo_key", "pres_col_window", "pres_grid_cache", "pres_praca_cache", "pres_chk_detail", "show_pres_export", "pres_export_job", "pres_modo", "pres_anunciantes_cross", "pres_veiculos_cross"]
         for k in keys_to_clear:
             st.session_state.pop(k, None)
         st.rerun()
@@ -74,18 +78,13 @@ def render(df_crowley, cookies, data_atualizacao):
         st.error("Base de dados não carregada.")
         st.stop()
     
-    df_crowley_copy = df_crowley.copy()
+    if "Data_Dt" not in df_crowley.columns:
+        st.error("Coluna de Data não encontrada na base.")
+        st.stop()
 
-    if "Data_Dt" not in df_crowley_copy.columns:
-        if "Data" in df_crowley_copy.columns:
-            df_crowley_copy["Data_Dt"] = pd.to_datetime(df_crowley_copy["Data"], dayfirst=True, errors="coerce")
-        else:
-            st.error("Coluna de Data não encontrada na base.")
-            st.stop()
-    
-    df_crowley_copy["Ano"] = df_crowley_copy["Data_Dt"].dt.year
-    df_crowley_copy["Mes"] = df_crowley_copy["Data_Dt"].dt.month
-    df_crowley_copy["Dia"] = df_crowley_copy["Data_Dt"].dt.day
+    # Índice de presença diária pré-calculado (compartilhado entre sessões)
+    pidx = get_presence_index(df_crowley)
+    active_dates = pidx.day0 + pd.to_timedelta(np.flatnonzero(pidx.days_with_data()), unit="D")
 
     # --- Cookies ---
     saved_filters = {}
@@ -107,7 +106,7 @@ def render(df_crowley, cookies, data_atualizacao):
     st.markdown("##### Configuração do Mapa")
     
     # Listas Globais Iniciais
-    lista_pracas_base = sorted(df_crowley_copy["Praca"].dropna().unique())
+    lista_pracas_base = pidx.values("Praca")
     
     # Recuperação de Defaults
     default_praca_val = get_cookie_val("praca")
@@ -117,74 +116,120 @@ def render(df_crowley, cookies, data_atualizacao):
     if "pres_praca_key" not in st.session_state:
         st.session_state.pres_praca_key = default_praca_val
 
+    # Limites de data a partir dos dias com registro no índice
+    min_date_allowed = active_dates.min().date()
+    try: max_date_allowed = min(datetime.strptime(data_atualizacao, "%d/%m/%Y").date(), active_dates.max().date())
+    except: max_date_allowed = active_dates.max().date()
+
+    def get_date_from_cookie(key, default_date):
+        val = get_cookie_val(key)
+        if val:
+            try:
+                d = datetime.strptime(val, "%Y-%m-%d").date()
+                return min(max(d, min_date_allowed), max_date_allowed)
+            except: return default_date
+        return default_date
+
+    default_ini = max(min_date_allowed, max_date_allowed.replace(day=1))
+    val_dt_ini = get_date_from_cookie("dt_ini", default_ini)
+    val_dt_fim = get_date_from_cookie("dt_fim", max_date_allowed)
+
+    lista_granularidades = list(GRANULARITIES.keys())
+    saved_gran = get_cookie_val("granularidade", "Dia")
+    idx_gran = lista_granularidades.index(saved_gran) if saved_gran in lista_granularidades else 0
+
     with st.container(border=True):
-        # LINHA 1: Ano (1), Mês (1), Dia (1), Praça (2)
+        # LINHA 1: Início (1), Fim (1), Granularidade (1), Praça (2)
         c1, c2, c3, c4 = st.columns([1, 1, 1, 2])
         
-        lista_anos = sorted(df_crowley_copy["Ano"].dropna().unique(), reverse=True)
-        default_ano = get_cookie_val("ano")
-        idx_ano = lista_anos.index(default_ano) if default_ano in lista_anos else 0
         with c1:
-            sel_ano = st.selectbox("1. Ano (*)", options=lista_anos, index=idx_ano, key="pres_ano", on_change=reset_pagination)
-        
-        df_ano = df_crowley_copy[df_crowley_copy["Ano"] == sel_ano]
-        lista_meses_num = sorted(df_ano["Mes"].dropna().unique())
-        lista_meses_fmt = [(m, mes_map.get(m, str(m))) for m in lista_meses_num]
-        saved_mes = get_cookie_val("mes")
-        idx_mes = next((i for i, (m_num, _) in enumerate(lista_meses_fmt) if m_num == saved_mes), 0)
-        
+            dt_ini = st.date_input("1. Início (*)", value=val_dt_ini, min_value=min_date_allowed, max_value=max_date_allowed, format="DD/MM/YYYY", key="pres_dt_ini", on_change=reset_pagination)
         with c2:
-            sel_mes_tuple = st.selectbox("2. Mês (*)", options=lista_meses_fmt, index=idx_mes, format_func=lambda x: x[1], key="pres_mes", on_change=reset_pagination)
-            sel_mes = sel_mes_tuple[0] if sel_mes_tuple else None
-
-        lista_dias = []
-        if sel_ano and sel_mes:
-            try:
-                _, last_day = calendar.monthrange(int(sel_ano), int(sel_mes))
-                lista_dias = list(range(1, last_day + 1))
-            except: pass
-        saved_dias = get_cookie_val("dias", [])
-        valid_dias = [d for d in saved_dias if d in lista_dias]
-        
+            dt_fim = st.date_input("2. Fim (*)", value=val_dt_fim, min_value=min_date_allowed, max_value=max_date_allowed, format="DD/MM/YYYY", key="pres_dt_fim", on_change=reset_pagination)
         with c3:
-            sel_dias = st.multiselect("3. Dias (Opc.)", options=lista_dias, default=valid_dias, placeholder="Todo o mês", key="pres_dias", on_change=reset_pagination)
+            sel_gran = st.selectbox("3. Granularidade", options=lista_granularidades, index=idx_gran, key="pres_gran", on_change=reset_pagination)
 
         with c4:
             sel_praca = st.selectbox("4. Praça (*)", options=lista_pracas_base, key="pres_praca_key", on_change=reset_pagination)
 
         st.divider()
         
-        # --- FILTRO EM CASCATA ---
-        df_context_nv1 = df_crowley_copy[
-            (df_crowley_copy["Ano"] == sel_ano) & 
-            (df_crowley_copy["Mes"] == sel_mes) & 
-            (df_crowley_copy["Praca"] == sel_praca)
-        ] if sel_ano and sel_mes and sel_praca else pd.DataFrame()
-        
+        # --- FILTRO EM CASCATA (Direto no índice, sem varrer a base) ---
+        periodo_valido = bool(dt_ini and dt_fim and dt_ini <= dt_fim)
+        if periodo_valido:
+            day_start = pidx.day_of(dt_ini)
+            day_end = pidx.day_of(dt_fim) + 1
+        else:
+            day_start = day_end = 0
+
+        # Chaves da praça ativas no período e seus rótulos: recalculadas só quando praça/período mudam
+        praca_signature = (dataset_version(df_crowley), sel_praca, day_start, day_end)
+        cached_praca = st.session_state.get("pres_praca_cache")
+        if cached_praca is None or cached_praca[0] != praca_signature:
+            rows_praca = pidx.select(praca=sel_praca) if sel_praca else np.empty(0, dtype=np.int64)
+            rows_praca = rows_praca[pidx.active_days(rows_praca, day_start, day_end) > 0]
+            cached_praca = (
+                praca_signature, pidx.labels(rows_praca, ["Emissora", "Anunciante", "Tipo"]), pidx.values("Emissora", rows_praca)
+            )
+            st.session_state["pres_praca_cache"] = cached_praca
+        _, labels_praca, veiculos_praca = cached_praca
+        
+        # Visão: um veículo (linhas = anunciantes) ou anunciantes cruzados (linhas = emissoras da praça)
+        lista_modos = [MODO_VEICULO, MODO_CRUZADO]
+        saved_modo = get_cookie_val("modo", MODO_VEICULO)
+        sel_modo = st.radio(
+            "Visão", options=lista_modos, index=lista_modos.index(saved_modo) if saved_modo in lista_modos else 0,
+            horizontal=True, key="pres_modo", on_change=reset_pagination
+        )
+        modo_cruzado = (sel_modo == MODO_CRUZADO)
+
         # LINHA 2: Veículo, Anunciante, Tipo
         c5, c6, c7 = st.columns(3)
-        
-        # 5. Veículo
-        lista_veiculos = sorted(df_context_nv1["Emissora"].dropna().unique())
-        saved_veiculo = get_cookie_val("veiculo")
-        idx_veiculo = lista_veiculos.index(saved_veiculo) if saved_veiculo in lista_veiculos else 0
-        
-        with c5:
-            sel_veiculo = st.selectbox("5. Veículo (*)", options=lista_veiculos, index=idx_veiculo, key="pres_veiculo", on_change=reset_pagination)
-            
-        # 2. Filtra base por Veículo para obter Anunciantes e TIPOS
-        df_context_nv2 = df_context_nv1[df_context_nv1["Emissora"] == sel_veiculo] if not df_context_nv1.empty else pd.DataFrame()
-        
-        # 6. Anunciante
-        lista_anunciantes = sorted(df_context_nv2["Anunciante"].dropna().unique())
-        saved_anunciantes = get_cookie_val("anunciantes", [])
-        valid_anunciantes = [a for a in saved_anunciantes if a in lista_anunciantes]
-        
-        with c6:
-            sel_anunciantes = st.multiselect("6. Anunciantes (Opc.)", options=lista_anunciantes, default=valid_anunciantes, placeholder="Todos", key="pres_anunciantes", on_change=reset_pagination)
+
+        if not modo_cruzado:
+            # 5. Veículo
+            lista_veiculos = veiculos_praca
+            saved_veiculo = get_cookie_val("veiculo")
+            idx_veiculo = lista_veiculos.index(saved_veiculo) if saved_veiculo in lista_veiculos else 0
+
+            with c5:
+                sel_veiculo = st.selectbox("5. Veículo (*)", options=lista_veiculos, index=idx_veiculo, key="pres_veiculo", on_change=reset_pagination)
+            sel_veiculos = [sel_veiculo] if sel_veiculo else []
+
+            # 2. Filtra chaves por Veículo para obter Anunciantes e TIPOS
+            labels_veiculo = labels_praca[labels_praca["Emissora"] == sel_veiculo]
+
+            # 6. Anunciante
+            lista_anunciantes = sorted(labels_veiculo["Anunciante"].unique())
+            saved_anunciantes = get_cookie_val("anunciantes", [])
+            valid_anunciantes = [a for a in saved_anunciantes if a in lista_anunciantes]
+
+            with c6:
+                sel_anunciantes = st.multiselect("6. Anunciantes (Opc.)", options=lista_anunciantes, default=valid_anunciantes, placeholder="Todos", key="pres_anunciantes", on_change=reset_pagination)
+        else:
+            # 5. Anunciantes (obrigatório): as linhas do mapa passam a ser as emissoras da praça
+            lista_anunciantes = sorted(labels_praca["Anunciante"].unique())
+            saved_anunciantes = get_cookie_val("anunciantes", [])
+            valid_anunciantes = [a for a in saved_anunciantes if a in lista_anunciantes]
+
+            with c5:
+                sel_anunciantes = st.multiselect("5. Anunciantes (*)", options=lista_anunciantes, default=valid_anunciantes, placeholder="Selecione...", key="pres_anunciantes_cross", on_change=reset_pagination)
+
+            labels_veiculo = labels_praca[labels_praca["Anunciante"].isin(sel_anunciantes)]
+
+            # 6. Veículos (Opc.)
+            lista_veiculos = sorted(labels_veiculo["Emissora"].unique())
+            saved_veiculos = get_cookie_val("veiculos", [])
+            valid_veiculos = [v for v in saved_veiculos if v in lista_veiculos]
+
+            with c6:
+                sel_veiculos = st.multiselect("6. Veículos (Opc.)", options=lista_veiculos, default=valid_veiculos, placeholder="Todos", key="pres_veiculos_cross", on_change=reset_pagination)
+            sel_veiculo = ", ".join(sel_veiculos) if sel_veiculos else "Todos"
+            if sel_veiculos:
+                labels_veiculo = labels_veiculo[labels_veiculo["Emissora"].isin(sel_veiculos)]
 
         # 7. Tipo de Veiculação
-        tipos_disponiveis = sorted(df_context_nv2["Tipo"].dropna().unique().tolist())
+        tipos_disponiveis = sorted(labels_veiculo["Tipo"].unique().tolist())
         
         saved_tipos = get_cookie_val("tipo_veiculacao", [])
         if "Consolidado" in saved_tipos: saved_tipos = []
@@ -212,17 +257,22 @@ def render(df_crowley, cookies, data_atualizacao):
         with c_btn:
             btn_gerar = st.button("Gerar Presence Map", type="primary", use_container_width=True)
 
+    if not periodo_valido:
+        st.warning("A data inicial não pode ser maior que a final.")
+
     if btn_gerar:
         st.session_state["pres_search_trigger"] = True
         reset_pagination()
         
         tipos_cookie = sel_tipos if sel_tipos else ["Consolidado"]
         new_cookie = {
-            "ano": int(sel_ano) if sel_ano else None,
-            "mes": int(sel_mes) if sel_mes else None,
-            "dias": sel_dias,
+            "dt_ini": str(dt_ini),
+            "dt_fim": str(dt_fim),
+            "granularidade": sel_gran,
+            "modo": sel_modo,
             "praca": sel_praca,
-            "veiculo": sel_veiculo,
+            "veiculo": get_cookie_val("veiculo") if modo_cruzado else sel_veiculo,
+            "veiculos": sel_veiculos if modo_cruzado else get_cookie_val("veiculos", []),
             "anunciantes": sel_anunciantes,
             "tipo_veiculacao": tipos_cookie
         }
@@ -230,69 +280,57 @@ def render(df_crowley, cookies, data_atualizacao):
         cookies.save()
 
     # --- PROCESSAMENTO E TABELA ---
-    if st.session_state.get("pres_search_trigger") and sel_ano and sel_mes and sel_praca and sel_veiculo:
+    if st.session_state.get("pres_search_trigger") and modo_cruzado and not sel_anunciantes:
+        st.info("Selecione ao menos um anunciante para a visão cruzada.")
+
+    if st.session_state.get("pres_search_trigger") and periodo_valido and sel_praca and (sel_anunciantes if modo_cruzado else sel_veiculo):
         
-        nome_mes_display = mes_map.get(sel_mes, str(sel_mes))
+        periodo_display = f"{dt_ini.strftime('%d/%m/%Y')} a {dt_fim.strftime('%d/%m/%Y')}"
         
-        # 1. Filtros
-        mask = (
-            (df_crowley_copy["Ano"] == sel_ano) &
-            (df_crowley_copy["Mes"] == sel_mes) &
-            (df_crowley_copy["Praca"] == sel_praca) &
-            (df_crowley_copy["Emissora"] == sel_veiculo)
+        # 1. Grade paginada sobre o índice de presença: ordenação, totais e escala de cor
+        #    são calculados uma vez por assinatura de filtro; trocar de página só monta as linhas visíveis
+        bucket_starts, cols_days = period_buckets(dt_ini, dt_fim, GRANULARITIES[sel_gran])
+        #    Na visão cruzada as mesmas chaves da praça são agrupadas por Emissora (e Anunciante, se vários)
+        if modo_cruzado:
+            group_cols = ["Emissora", "Anunciante"] if len(sel_anunciantes) > 1 else ["Emissora"]
+        else:
+            group_cols = ["Anunciante", "Tipo"]
+        grid_signature = (
+            dataset_version(df_crowley), sel_modo, sel_praca, tuple(sel_veiculos), tuple(sel_anunciantes),
+            tuple(sel_tipos), str(dt_ini), str(dt_fim), sel_gran
         )
-        if sel_anunciantes: mask = mask & (df_crowley_copy["Anunciante"].isin(sel_anunciantes))
-        if sel_dias: mask = mask & (df_crowley_copy["Dia"].isin(sel_dias))
-        if sel_tipos: mask = mask & (df_crowley_copy["Tipo"].isin(sel_tipos))
-        
-        df_final = df_crowley_copy[mask].copy()
-        
-        if df_final.empty:
+        cached_grid = st.session_state.get("pres_grid_cache")
+        if cached_grid is None or cached_grid["signature"] != grid_signature:
+            rows = pidx.select(praca=sel_praca, emissoras=sel_veiculos, anunciantes=sel_anunciantes, tipos=sel_tipos)
+            grid = PresenceGrid(pidx, rows, day_start, day_end, bucket_starts, group_cols)
+            # Detalhamento (exportação, visualização) só é montado quando alguém pede (ver get_detail)
+            cached_grid = {"signature": grid_signature, "grid": grid, "detail": None}
+            st.session_state["pres_grid_cache"] = cached_grid
+        grid = cached_grid["grid"]
+
+        if len(grid) == 0:
             st.warning("Nenhuma inserção encontrada com os filtros selecionados.")
             return
 
-        val_col = "Volume de Insercoes" if "Volume de Insercoes" in df_final.columns else "Contagem"
-        if val_col == "Contagem": df_final["Contagem"] = 1
-
-        # 2. PIVOT
-        pivot = pd.pivot_table(
-            df_final,
-            index=["Anunciante", "Tipo"], 
-            columns="Dia",
-            values=val_col,
-            aggfunc="sum",
-            fill_value=0,
-            observed=True
-        )
+        label_rename = {"Emissora": "Veículo", "Tipo": "Tipo de Veiculação"}
+        label_cols = [label_rename.get(c, c) for c in group_cols]
 
-        if sel_dias: days_range = sorted(sel_dias)
-        else:
-            _, last_day = calendar.monthrange(int(sel_ano), int(sel_mes))
-            days_range = list(range(1, last_day + 1))
-        
-        pivot = pivot.reindex(columns=days_range, fill_value=0)
-        
-        pivot["TOTAL"] = pivot.sum(axis=1)
-        pivot = pivot[pivot["TOTAL"] > 0]
-        pivot = pivot.sort_values("TOTAL", ascending=False)
-        
-        if pivot.empty:
-            st.warning("Nenhum dado para exibir.")
-            return
+        def build_map_frame(start, stop):
+            """Trecho [start, stop) do mapa já achatado: rótulos da linha, colunas do período e TOTAL."""
+            df_map = grid.labels(start, stop).rename(columns=label_rename)
+            df_map = pd.concat([df_map, pd.DataFrame(grid.page(start, stop), columns=cols_days)], axis=1)
+            df_map["TOTAL"] = grid.totals[start:stop]
+            return df_map
 
-        daily_totals = pivot.sum(numeric_only=True)
-        total_row = pd.DataFrame(daily_totals).T
-        total_row.index = ["TOTAL DIÁRIO"] 
-        pivot.columns = [f"{c:02d}" if isinstance(c, int) else c for c in pivot.columns]
-        total_row.columns = pivot.columns
+        # Linha de total: rótulo na primeira coluna, demais colunas de rótulo vazias
+        row_total_dict = {c: "" for c in label_cols}
+        row_total_dict[label_cols[0]] = "TOTAL DIÁRIO"
+        row_total_dict.update(zip(cols_days, grid.col_totals.tolist()))
+        row_total_dict["TOTAL"] = int(grid.totals.sum())
 
-        # --- FLATTENING ---
-        df_display_flat = pivot.reset_index() 
-        df_display_flat = df_display_flat.rename(columns={'Tipo': 'Tipo de Veiculação'})
-        
         # Paginação
         ROWS_PER_PAGE = 20
-        total_rows = len(df_display_flat)
+        total_rows = len(grid)
         total_pages = math.ceil(total_rows / ROWS_PER_PAGE)
         
         current_page = st.session_state.pres_page_idx
@@ -303,34 +341,47 @@ def render(df_crowley, cookies, data_atualizacao):
         start_idx = current_page * ROWS_PER_PAGE
         end_idx = start_idx + ROWS_PER_PAGE
         
-        df_page = df_display_flat.iloc[start_idx:end_idx].copy()
-        
-        row_total_dict = total_row.iloc[0].to_dict()
-        row_total_dict['Anunciante'] = "TOTAL DIÁRIO"
-        row_total_dict['Tipo de Veiculação'] = "" 
-        
+        df_page = build_map_frame(start_idx, end_idx)
         df_page = pd.concat([df_page, pd.DataFrame([row_total_dict])], ignore_index=True)
         
         # Visibilidade da Coluna
         should_hide_tipo = (len(sel_tipos) == 1)
+        label_cols_view = [c for c in label_cols if not (should_hide_tipo and c == "Tipo de Veiculação")]
         
-        cols_days = [c for c in pivot.columns if c != "TOTAL"]
-        
-        if should_hide_tipo:
-            cols_final = ["Anunciante"] + cols_days + ["TOTAL"]
+        if modo_cruzado:
+            st.subheader(f"Mapa: **{', '.join(sel_anunciantes)}** em {sel_praca} - {periodo_display}")
         else:
-            cols_final = ["Anunciante", "Tipo de Veiculação"] + cols_days + ["TOTAL"]
+            st.subheader(f"Mapa: **{sel_veiculo}** - {periodo_display}")
 
-        df_page_view = df_page[cols_final]
+        # Janela de colunas: períodos longos exibem apenas um trecho por vez
+        cols_visible = cols_days
+        if len(cols_days) > MAX_VISIBLE_COLS:
+            window_options = cols_days[:len(cols_days) - MAX_VISIBLE_COLS + 1]
+            if st.session_state.get("pres_col_window") not in window_options:
+                st.session_state.pop("pres_col_window", None)
+            win_label = st.select_slider("Colunas exibidas a partir de", options=window_options, key="pres_col_window")
+            win_start = cols_days.index(win_label)
+            cols_visible = cols_days[win_start:win_start + MAX_VISIBLE_COLS]
+            st.caption(f"Exibindo {len(cols_visible)} de {len(cols_days)} colunas. O TOTAL considera o período inteiro.")
 
-        st.subheader(f"Mapa: **{sel_veiculo}** - {nome_mes_display}/{sel_ano}")
+        cols_final = label_cols_view + cols_visible + ["TOTAL"]
+
+        df_page_view = df_page[cols_final]
         
         # --- CSS DINÂMICO (Específico para Colunas da Tabela) ---
-        # Injeta o CSS de largura de coluna apenas agora que sabemos se 'Tipo' está visível
-        idx_anunciante = 1 if should_hide_tipo else 2
+        # Injeta o CSS de largura de coluna apenas agora que sabemos quais rótulos estão visíveis
+        idx_anunciante = 1 if len(label_cols_view) == 1 else 2
+        css_tipo = "" if len(label_cols_view) == 1 else """
+            [data-testid="stDataFrame"] td:nth-child(2) {
+                text-align: center !important;
+                font-weight: normal;
+                color: #444;
+                min-width: 140px !important;
+            }
+            """
         css_table_dynamic = f"""
             <style>
-            /* 1ª COLUNA VISUAL: ANUNCIANTE */
+            /* 1ª COLUNA VISUAL: ANUNCIANTE / VEÍCULO */
             [data-testid="stDataFrame"] td:nth-child({idx_anunciante}) {{
                 text-align: left !important;
                 font-weight: bold;
@@ -340,15 +391,8 @@ def render(df_crowley, cookies, data_atualizacao):
                 text-overflow: ellipsis;
             }}
             
-            /* 2ª COLUNA VISUAL: TIPO DE VEICULAÇÃO (Apenas se visível) */
-            {"" if should_hide_tipo else """
-            [data-testid="stDataFrame"] td:nth-child(2) {
-                text-align: center !important;
-                font-weight: normal;
-                color: #444;
-                min-width: 140px !important;
-            }
-            """}
+            /* 2ª COLUNA VISUAL: TIPO DE VEICULAÇÃO / ANUNCIANTE (Apenas se visível) */
+            {css_tipo}
             </style>
         """
         st.markdown(css_table_dynamic, unsafe_allow_html=True)
@@ -356,20 +400,20 @@ def render(df_crowley, cookies, data_atualizacao):
         # --- STYLER ---
         col_config = {}
         col_config["TOTAL"] = st.column_config.TextColumn("Total", width="small")
-        col_config["Anunciante"] = st.column_config.TextColumn("Anunciante", width="large")
-        if not should_hide_tipo:
-            col_config["Tipo de Veiculação"] = st.column_config.TextColumn("Tipo", width="medium")
+        col_config[label_cols_view[0]] = st.column_config.TextColumn(label_cols_view[0], width="large")
+        for c in label_cols_view[1:]:
+            col_config[c] = st.column_config.TextColumn("Tipo" if c == "Tipo de Veiculação" else c, width="medium")
             
-        for c in cols_days: col_config[c] = st.column_config.TextColumn(c, width="small")
+        for c in cols_visible: col_config[c] = st.column_config.TextColumn(c, width="small")
 
-        max_val = pivot[cols_days].max().max() if not pivot[cols_days].empty else 1
+        max_val = grid.max_cell or 1
 
         styler = df_page_view.style\
-            .background_gradient(cmap="YlOrRd", subset=cols_days, vmin=0, vmax=max_val)\
-            .format({c: "{:.0f}" for c in cols_days + ["TOTAL"]})\
-            .map(lambda x: "color: transparent" if (isinstance(x, (int, float)) and x == 0) else "color: black; font-weight: bold", subset=cols_days)\
+            .background_gradient(cmap="YlOrRd", subset=cols_visible, vmin=0, vmax=max_val)\
+            .format({c: "{:.0f}" for c in cols_visible + ["TOTAL"]})\
+            .map(lambda x: "color: transparent" if (isinstance(x, (int, float)) and x == 0) else "color: black; font-weight: bold", subset=cols_visible)\
             .map(lambda x: "background-color: #e6f3ff; font-weight: bold; border-left: 2px solid #ccc", subset=["TOTAL"])\
-            .apply(lambda x: ["background-color: #d1e7dd; font-weight: bold" if x['Anunciante'] == "TOTAL DIÁRIO" else "" for i in x], axis=1)
+            .apply(lambda x: ["background-color: #d1e7dd; font-weight: bold" if x[label_cols_view[0]] == "TOTAL DIÁRIO" else "" for i in x], axis=1)
         
         styler = styler.set_properties(**{'text-align': 'center'})
 
@@ -401,41 +445,64 @@ def render(df_crowley, cookies, data_atualizacao):
         st.markdown("---")
 
         # --- DETALHAMENTO (CORRIGIDO) ---
-        with st.expander("Fonte de Dados Completa (Detalhamento)", expanded=False):
+        def build_detail():
+            """Detalhamento da base de fatos: (numérico para exportação, texto com total para a tela)."""
             rename_map = {
                 "Praca": "Praça", "Anuncio": "Anúncio", "Duracao": "Duração",
                 "Emissora": "Veículo", "Volume de Insercoes": "Inserções", 
                 "Tipo": "Tipo de Veiculação", "DayPart": "DayPart"
             }
-            df_detalhe = df_final.copy()
+            ts_ini = pidx.date_of(day_start)
+            ts_fim = pidx.date_of(day_end)
+            mask = (
+                (df_crowley["Praca"] == sel_praca) &
+                (df_crowley["Data_Dt"] >= ts_ini) &
+                (df_crowley["Data_Dt"] < ts_fim)
+            )
+            if sel_veiculos: mask = mask & (df_crowley["Emissora"].isin(sel_veiculos))
+            if sel_anunciantes: mask = mask & (df_crowley["Anunciante"].isin(sel_anunciantes))
+            if sel_tipos: mask = mask & (df_crowley["Tipo"].isin(sel_tipos))
+            df_detalhe = df_crowley[mask].copy()
             if "Data_Dt" in df_detalhe.columns:
                 df_detalhe["Data"] = df_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
-            
+        
             cols_originais = ["Data", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
             cols_existentes = [c for c in cols_originais if c in df_detalhe.columns]
-            
+        
             # 1. DF para Exportação (Numérico, sem total, limpo)
             df_exib_detalhe = df_detalhe[cols_existentes].rename(columns=rename_map)
             df_exib_detalhe.sort_values(by=["Anunciante", "Data"], inplace=True)
-            
+        
             # 2. DF para Visualização (Com Total, String)
             df_exib_view = df_exib_detalhe.copy()
-            
+        
             if not df_exib_view.empty and "Inserções" in df_exib_view.columns:
                 total_ins = df_exib_view["Inserções"].sum()
-                
+            
                 # Linha de total com espaços vazios " " para evitar bugs visuais
                 row_total = {col: " " for col in df_exib_view.columns}
                 row_total["Anunciante"] = "TOTAL GERAL"
                 row_total["Inserções"] = total_ins
-                
+            
                 # Concatenação
                 df_exib_view = pd.concat([df_exib_view, pd.DataFrame([row_total])], ignore_index=True)
-                
+            
                 # Conversão para Texto (Blindagem contra ArrowInvalid ao misturar int com string " ")
                 df_exib_view = df_exib_view.astype(str)
 
-            st.dataframe(df_exib_view, width="stretch", hide_index=True)
+            return df_exib_detalhe, df_exib_view
+
+        def get_detail():
+            # Uma vez por assinatura do mapa e só quando pedido (detalhamento exibido ou exportação):
+            # trocar de página ou de janela de colunas não repete a varredura da base
+            if cached_grid["detail"] is None:
+                cached_grid["detail"] = build_detail()
+            return cached_grid["detail"]
+
+        with st.expander("Fonte de Dados Completa (Detalhamento)", expanded=False):
+            # O corpo do expander roda mesmo fechado: a varredura da base só acontece com o checkbox marcado
+            if st.checkbox("Exibir detalhamento", key="pres_chk_detail"):
+                st.dataframe(get_detail()[1], width="stretch", hide_index=True)
 
         # --- Exportação (NOVA LÓGICA COM POP-UP) ---
         st.markdown("<br>", unsafe_allow_html=True)
@@ -446,75 +513,56 @@ def render(df_crowley, cookies, data_atualizacao):
 
         # --- DEFINIÇÃO DO DIALOG ---
         if st.session_state.get("show_pres_export", False):
-            @st.dialog("Exportação")
+            @st.dialog("Exportação", on_dismiss=lambda: st.session_state.update(show_pres_export=False))
             def export_dialog_presence():
-                st.write("Gerando arquivo Excel...")
-                
                 tipos_str = ", ".join(sel_tipos) if sel_tipos else "Todos"
-                dias_str = ", ".join(map(str, sel_dias)) if sel_dias else "Todo o mês"
                 anunciantes_str = ", ".join(sel_anunciantes) if sel_anunciantes else "Todos"
                 
                 filters_info = {
-                    "Ano": sel_ano,
-                    "Mês": nome_mes_display,
-                    "Dias": dias_str,
+                    "Período": periodo_display,
+                    "Granularidade": sel_gran,
+                    "Visão": sel_modo,
                     "Praça": sel_praca,
                     "Veículo": sel_veiculo,
                     "Anunciantes": anunciantes_str,
                     "Tipos": tipos_str
                 }
                 
-                # Prepara DF Completo do Mapa (Com Total)
-                df_export = df_display_flat.copy()
-                row_total_export = row_total_dict.copy()
-                df_export = pd.concat([df_export, pd.DataFrame([row_total_export])], ignore_index=True)
-                
-                if should_hide_tipo:
-                    cols_final_exp = ["Anunciante"] + cols_days + ["TOTAL"]
-                else:
-                    cols_final_exp = ["Anunciante", "Tipo de Veiculação"] + cols_days + ["TOTAL"]
+                # Prepara DF Completo do Mapa (Com Total) — única etapa que materializa todas as linhas
+                df_export = build_map_frame(0, len(grid))
+                df_export = pd.concat([df_export, pd.DataFrame([row_total_dict])], ignore_index=True)
                 
-                df_export = df_export[cols_final_exp]
+                df_export = df_export[label_cols_view + cols_days + ["TOTAL"]]
+                df_exib_detalhe = get_detail()[0]
 
                 dfs_dict = {
                     'map': df_export,
                     'detail': df_exib_detalhe
                 }
                 
-                with st.spinner("Processando dados..."):
-                    excel_buffer = generate_presence_map_excel(dfs_dict, filters_info)
-                
-                st.success("Arquivo pronto!")
-                
-                # INJEÇÃO CSS PARA BOTÃO DE DOWNLOAD (AZUL/BRANCO)
-                st.markdown("""
-                    <style>
-                    div[data-testid="stDialog"] button[kind="primary"] {
-                        background-color: #007bff !important;
-                        border-color: #007bff !important;
-                        color: white !important;
-                    }
-                    div[data-testid="stDialog"] button[kind="primary"]:hover {
-                        background-color: #0056b3 !important;
-                        border-color: #0056b3 !important;
-                        color: white !important;
-                    }
-                    div[data-testid="stDialog"] button[kind="primary"] * {
-                        color: white !important;
-                    }
-                    </style>
-                """, unsafe_allow_html=True)
-                
-                st.download_button(
-                    label="Baixar Arquivo", 
-                    data=excel_buffer, 
-                    file_name=f"Presence_Map_{sel_veiculo}_{nome_mes_display}_{sel_ano}.xlsx", 
-                    mime="application/vnd.ms-excel", 
-                    type="primary", 
-                    use_container_width=True,
-                    on_click=lambda: st.session_state.update(show_pres_export=False)
+                signature = export_signature("presence_map", filters_info)
+                formato = export_format_radio("pres_export_formato")
+                if formato != FORMATO_EXCEL:
+                    columnar_export(
+                        {"Detalhamento": df_exib_detalhe, "Mapa de Presença": df_export},
+                        filters_info, f"Presence_Map_{sel_praca if modo_cruzado else sel_veiculo}_{dt_ini.strftime('%d%m%Y')}_{dt_fim.strftime('%d%m%Y')}", formato,
+                        on_click=lambda: st.session_state.update(show_pres_export=False), key="pres_export",
+                        df_base=df_crowley, signature=signature
+                    )
+                    return
+
+                background_excel_export(
+                    df_crowley, signature, lambda: generate_presence_map_excel(dfs_dict, filters_info),
+                    file_name=f"Presence_Map_{sel_praca if modo_cruzado else sel_veiculo}_{dt_ini.strftime('%d%m%Y')}_{dt_fim.strftime('%d%m%Y')}.xlsx",
+                    mime="application/vnd.ms-excel", key="pres_export",
+                    on_done=lambda: st.session_state.update(show_pres_export=False)
                 )
 
             export_dialog_presence()
+        elif st.session_state.get("pres_export_job"):
+            # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+            _, c_job, _ = st.columns([1, 2, 1])
+            with c_job:
+                export_job_panel("pres_export")
         
         st.markdown(f"<div style='text-align:center;color:#666;font-size:0.8rem;margin-top:5px;'>Última atualização da base de dados: {data_atualizacao}</div>", unsafe_allow_html=True)
\ No newline at end of file
@@ -4,7 +4,7 @@ import pandas as pd
 from utils.loaders import load_crowley_base
 
 # ==================== IMPORTAÇÃO DOS MÓDULOS (NOVOS NOMES) ====================
-from pages import opportunity_radar, campaign_flow, presence_map, performance_index, relatorio_personalizado
+from pages import opportunity_radar, campaign_flow, presence_map, performance_index, overlap_matrix, yoy_comparison, relatorio_personalizado
 
 def render(cookies):
     
@@ -105,6 +105,14 @@ def render(cookies):
                 Performance Index
                 <span>Quem é mais forte<br>e consistente?</span>
             </a>
+            <a href="?view=overlap" target="_self" class="nb-card">
+                Overlap Matrix
+                <span>Quais anunciantes as<br>emissoras compartilham?</span>
+            </a>
+            <a href="?view=yoy" target="_self" class="nb-card">
+                YoY Comparison
+                <span>Como este mês se compara<br>ao mesmo mês do ano passado?</span>
+            </a>
             <a href="?view=custom" target="_self" class="nb-card">
                 Relatório Personalizado
                 <span>Crie sua própria visão<br>dinâmica dos dados</span>
@@ -132,6 +140,12 @@ def render(cookies):
     elif current_view == "presence":
         presence_map.render(df_crowley, cookies, data_atualizacao)
         
+    elif current_view == "overlap":
+        overlap_matrix.render(df_crowley, cookies, data_atualizacao)
+
+    elif current_view == "yoy":
+        yoy_comparison.render(df_crowley, cookies, data_atualizacao)
+
     elif current_view == "custom":
         relatorio_personalizado.render(df_crowley, cookies, data_atualizacao)
     
@@ -3,10 +3,18 @@ import time
 import warnings
 from datetime import date, datetime, timedelta
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from utils.export_crowley import generate_custom_report_excel
+from utils.analytics import count_distinct
+from utils.cube import get_rollups, plan_rollup, rollup_period_mask
+from utils.export_crowley import EXCEL_MAX_COLS, EXCEL_MAX_ROWS, INDEX_SHEET, generate_custom_report_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.loaders import dataset_version, shared_derived
+from utils.offload import run_aggregation, snapshot_id
+from utils.pivot import AIRTIME_COL, PIVOT_METRICS, add_airtime, metric_columns, report_pivot
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 
@@ -16,52 +24,97 @@ MAX_PREVIEW_ROWS = 500
 MAX_PREVIEW_COLS = 50
 MAX_PREVIEW_SIZE = 100_000
 MAX_EXCEL_CELLS = 500_000
-MAX_EXCEL_COLUMNS = 16_384
+# Estimativas de memória (bytes): célula numérica do pivot, rótulo de linha/coluna e célula no Excel
+# (a exportação grava em modo constant_memory num arquivo temporário; em memória fica o .xlsx compactado)
+PIVOT_BYTES_PER_CELL = 8
+PIVOT_BYTES_PER_LABEL = 64
+EXCEL_BYTES_PER_CELL = 8
+MAX_ESTIMATED_BYTES = 1_000_000_000
+# Top N: membros mantidos por dimensão; o restante vira OUTROS_LABEL (utils.pivot)
+DEFAULT_TOP_N = 20
+# Exportação: divisão em abas só quando passa dos limites do Excel, ou uma aba por valor de uma dimensão
+SPLIT_AUTO = "Automático (só se passar do limite do Excel)"
 FILTER_HELP_TEXT = (
     "Os filtros abaixo respeitam primeiro o período selecionado e depois funcionam em cascata: "
     "Praça → Veículo → Anunciante → Anúncio."
 )
 
 
-@st.cache_data(show_spinner="Indexando dados para o relatório...", ttl=3600)
-def prepare_custom_data(df_raw: pd.DataFrame):
-    """Pré-processa a base uma única vez para a página customizada."""
-    df = df_raw.copy()
-
-    if "Data_Dt" in df.columns:
-        df["Data_Dt"] = pd.to_datetime(df["Data_Dt"], errors="coerce")
-    elif "Data" in df.columns:
-        df["Data_Dt"] = pd.to_datetime(df["Data"], dayfirst=True, errors="coerce")
+# Dimensões da página (coluna da base → rótulo exibido)
+DIM_MAP = {
+    "Ano": "Ano",
+    "Mes": "Mês",
+    "Dia": "Dia",
+    "Praca": "Praça",
+    "Emissora": "Veículo",
+    "Anunciante": "Anunciante",
+    "Anuncio": "Anúncio",
+    "Tipo": "Tipo de Veiculação",
+    "DayPart": "Faixa Horária",
+    "Produto": "Produto",
+    "Programa": "Programa",
+}
+
+
+def _custom_columns(df_raw):
+    """
+    Colunas que a página acrescenta ou converte sobre a base: Ano/Mês/Dia, tempo de ar, métricas
+    numéricas e dimensões como categoria (filtros avaliados sobre os códigos, ver `_field_mask`).
+    As demais colunas são usadas direto da base.
+    """
+    novas = {}
+    if "Data_Dt" in df_raw.columns:
+        datas = df_raw["Data_Dt"]
+        if not pd.api.types.is_datetime64_any_dtype(datas):
+            datas = novas["Data_Dt"] = pd.to_datetime(datas, errors="coerce")
+    elif "Data" in df_raw.columns:
+        datas = novas["Data_Dt"] = pd.to_datetime(df_raw["Data"], dayfirst=True, errors="coerce")
     else:
-        df["Data_Dt"] = pd.NaT
+        datas = novas["Data_Dt"] = pd.Series(pd.NaT, index=df_raw.index, dtype="datetime64[ns]")
 
-    if "Data_Dt" in df.columns:
-        df["Ano"] = df["Data_Dt"].dt.year.astype("Int32")
-        df["Mes"] = df["Data_Dt"].dt.month.astype("Int16")
-        df["Dia"] = df["Data_Dt"].dt.day.astype("Int16")
+    novas["Ano"] = datas.dt.year.astype("Int32").astype("category")
+    novas["Mes"] = datas.dt.month.astype("Int16").astype("category")
+    novas["Dia"] = datas.dt.day.astype("Int16").astype("category")
 
+    metricas = pd.DataFrame(index=df_raw.index)
     for metric_col in ["Volume de Insercoes", "Duracao"]:
-        if metric_col in df.columns:
-            df[metric_col] = pd.to_numeric(df[metric_col], errors="coerce").fillna(0)
-
-    dim_map = {
-        "Ano": "Ano",
-        "Mes": "Mês",
-        "Dia": "Dia",
-        "Praca": "Praça",
-        "Emissora": "Veículo",
-        "Anunciante": "Anunciante",
-        "Anuncio": "Anúncio",
-        "Tipo": "Tipo de Veiculação",
-        "DayPart": "Faixa Horária",
-        "Produto": "Produto",
-        "Programa": "Programa",
-    }
+        if metric_col in df_raw.columns:
+            serie = df_raw[metric_col]
+            if serie.dtype.kind not in "iu":
+                serie = novas[metric_col] = pd.to_numeric(serie, errors="coerce").fillna(0)
+            metricas[metric_col] = serie
+    add_airtime(metricas)
+    if AIRTIME_COL in metricas.columns:
+        novas[AIRTIME_COL] = metricas[AIRTIME_COL]
+
+    for col in DIM_MAP:
+        if col in df_raw.columns and col not in novas and not isinstance(df_raw[col].dtype, pd.CategoricalDtype):
+            novas[col] = df_raw[col].astype("category")
+    return {"colunas": pd.DataFrame(novas, index=df_raw.index)}
+
+
+@st.cache_resource(show_spinner="Indexando dados para o relatório...", ttl=3600)
+def _cached_custom_data(_df_raw, version):
+    # Só as colunas novas/convertidas são gravadas (ao lado do snapshot compartilhado, uma vez por
+    # host); o resto aponta para a própria base, sem cópia
+    novas = shared_derived(_df_raw, "personalizado", _custom_columns)["colunas"]
+    colunas = list(_df_raw.columns) + [c for c in novas.columns if c not in _df_raw.columns]
+    df = pd.DataFrame(
+        {c: novas[c] if c in novas.columns else _df_raw[c] for c in colunas}, copy=False
+    )
+    df.attrs.update(_df_raw.attrs)
 
-    raw_dims = [c for c in dim_map.keys() if c in df.columns]
-    valid_dims = sorted(raw_dims, key=lambda x: dim_map.get(x, x))
+    raw_dims = [c for c in DIM_MAP if c in df.columns]
+    valid_dims = sorted(raw_dims, key=lambda x: DIM_MAP.get(x, x))
+    return df, valid_dims, DIM_MAP
 
-    return df, valid_dims, dim_map
+
+def prepare_custom_data(df_raw: pd.DataFrame):
+    """
+    Pré-processa a base uma única vez por versão para a página customizada (compartilhado entre
+    sessões: o DataFrame devolvido não pode ser alterado).
+    """
+    return _cached_custom_data(df_raw, dataset_version(df_raw))
 
 
 def _clean_option_value(value):
@@ -82,6 +135,86 @@ def _build_display_mapping(series: pd.Series) -> dict:
     return dict(sorted(mapping.items(), key=lambda item: item[0]))
 
 
+def _present_categories(series: pd.Series, mask) -> pd.Series:
+    """Categorias com ao menos um registro em `mask` (bincount dos códigos, sem copiar a coluna)."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series[mask]
+    codes = series.cat.codes.to_numpy()
+    counts = np.bincount(codes[mask] + 1, minlength=len(series.cat.categories) + 1)
+    return pd.Series(series.cat.categories[counts[1:] > 0])
+
+
+def _field_mask(series: pd.Series, selected_actual) -> np.ndarray:
+    """
+    Máscara de `series.isin(selected_actual)` pelos códigos da categoria: tabela booleana
+    por categoria (a última posição, lida pelo código -1 dos nulos, fica False) + `np.take`.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.isin(selected_actual).to_numpy()
+    categories = series.cat.categories
+    lut = np.zeros(len(categories) + 1, dtype=bool)
+    idx = categories.get_indexer(selected_actual)
+    lut[idx[idx >= 0]] = True
+    return np.take(lut, series.cat.codes.to_numpy())
+
+
+def _mask_cache(signature):
+    """
+    Cache de máscaras da sessão para uma (versão da base, período): máscara por campo filtrado,
+    máscara combinada por prefixo da cascata e opções de cada campo. Trocar a base ou o período
+    descarta tudo; mudar um filtro recalcula só a coluna alterada e os ANDs seguintes.
+    """
+    cache = st.session_state.get("custom_mask_cache")
+    if cache is None or cache.get("signature") != signature:
+        cache = {"signature": signature, "entries": {}}
+        st.session_state["custom_mask_cache"] = cache
+    cache["used"] = set()
+    return cache
+
+
+def _cached_mask(cache, key, compute):
+    cache["used"].add(key)
+    if key not in cache["entries"]:
+        cache["entries"][key] = compute()
+    return cache["entries"][key]
+
+
+def _prune_mask_cache(cache):
+    # Mantém só o que esta execução usou (no máximo ~3 entradas por campo)
+    cache["entries"] = {k: v for k, v in cache["entries"].items() if k in cache["used"]}
+
+
+def _estimate_pivot_size(df_source, mask, rows, cols, n_metrics, margins=False, top_n=None):
+    """
+    Tamanho do pivot antes de montá-lo: linhas e colunas distintas pelos códigos das
+    dimensões (sem copiar a fatia) e a memória estimada do resultado e do Excel.
+    Com Top N, cada dimensão tem no máximo N + 1 membros (contando "Outros").
+    """
+    est_rows = count_distinct(df_source, rows, mask)
+    est_cols = count_distinct(df_source, cols, mask)
+    if top_n:
+        est_rows = min(est_rows, (top_n + 1) ** len(rows))
+        est_cols = min(est_cols, (top_n + 1) ** len(cols))
+    est_rows += 1 if margins and rows else 0
+    est_cols += 1 if margins and cols else 0
+    n_values = est_cols * max(n_metrics, 1)
+    cells = est_rows * n_values
+    labels = est_rows * max(len(rows), 1) + n_values * max(len(cols), 1)
+    return {
+        "rows": est_rows,
+        "cols": n_values,
+        "cells": cells,
+        "result_bytes": cells * PIVOT_BYTES_PER_CELL + labels * PIVOT_BYTES_PER_LABEL,
+        "excel_bytes": (cells + est_rows * max(len(rows), 1)) * EXCEL_BYTES_PER_CELL,
+    }
+
+
+def _format_size(n_bytes):
+    if n_bytes < 1024 ** 2:
+        return "menos de 1 MB"
+    return "~" + f"{n_bytes / 1024 ** 2:,.1f} MB".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
 def _coerce_selection_list(value):
     if value is None:
         return []
@@ -100,9 +233,13 @@ def _clear_custom_filters():
 
 def _reset_custom_outputs():
     st.session_state.pop("custom_pivot_cache", None)
+    st.session_state.pop("custom_pivot_source", None)
+    st.session_state.pop("custom_pivot_estimate", None)
     st.session_state.pop("pivot_is_preview", None)
     st.session_state.pop("custom_filters_info", None)
+    st.session_state.pop("custom_export_options", None)
     st.session_state.pop("show_custom_export", None)
+    st.session_state.pop("custom_export_job", None)
 
 
 def _format_selected_filters(real_filters_selected: dict) -> str:
@@ -140,6 +277,8 @@ def render(df_crowley, cookies, data_atualizacao):
         keys_to_clear = [
             "custom_step",
             "custom_filters_info",
+            "custom_export_options",
+            "custom_export_job",
             "cust_rows",
             "cust_cols",
             "cust_metrics",
@@ -147,6 +286,10 @@ def render(df_crowley, cookies, data_atualizacao):
             "custom_period_signature",
             "add_total_rows",
             "add_total_cols",
+            "custom_mask_cache",
+            "custom_topn_on",
+            "custom_topn_n",
+            "custom_topn_metric",
         ]
         _clear_custom_filters()
         for key in keys_to_clear:
@@ -166,8 +309,10 @@ def render(df_crowley, cookies, data_atualizacao):
 
     df, valid_dims, dim_map = prepare_custom_data(df_crowley)
 
-    metrics_map = {"Volume de Insercoes": "Inserções", "Duracao": "Duração"}
-    valid_metrics = [c for c in metrics_map.keys() if c in df.columns]
+    metrics_map = {key: label for key, (label, _, _) in PIVOT_METRICS.items()}
+    valid_metrics = [key for key, (_, _, sources) in PIVOT_METRICS.items() if all(c in df.columns for c in sources)]
+    # Top N só pode classificar por métricas aditivas (somas de coluna)
+    rank_metrics = [key for key in valid_metrics if PIVOT_METRICS[key][1] == "sum"]
 
     if not valid_dims:
         st.error("A base não possui dimensões suficientes para montar o relatório.")
@@ -336,7 +481,11 @@ def render(df_crowley, cookies, data_atualizacao):
 
         ts_ini = pd.Timestamp(dt_ini)
         ts_fim = pd.Timestamp(dt_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
-        mask_period = df["Data_Dt"].between(ts_ini, ts_fim, inclusive="both")
+        mask_cache = _mask_cache((dataset_version(df_crowley), period_signature))
+        mask_period = _cached_mask(
+            mask_cache, ("periodo",),
+            lambda: df["Data_Dt"].between(ts_ini, ts_fim, inclusive="both").to_numpy()
+        )
 
         priority_filters = ["Praca", "Emissora", "Anunciante", "Anuncio"]
         fields_ordered = []
@@ -359,7 +508,8 @@ def render(df_crowley, cookies, data_atualizacao):
         st.caption(f"Registros disponíveis no período: {records_in_period:,}".replace(",", "."))
 
         available_mappings = {}
-        mask_context = mask_period.copy()
+        mask_context = mask_period
+        active_prefix = ()
 
         if fields_ordered:
             with st.container(border=True):
@@ -369,7 +519,10 @@ def render(df_crowley, cookies, data_atualizacao):
                     state_key = f"custom_filter_{col_name}"
                     current_selected = _coerce_selection_list(st.session_state.get(state_key, []))
 
-                    options_map = _build_display_mapping(df.loc[mask_context, col_name])
+                    options_map = _cached_mask(
+                        mask_cache, ("opcoes", active_prefix, col_name),
+                        lambda: _build_display_mapping(_present_categories(df[col_name], mask_context))
+                    )
                     options_list = list(options_map.keys())
                     valid_selected = [x for x in current_selected if x in options_list]
                     if current_selected != valid_selected:
@@ -387,7 +540,50 @@ def render(df_crowley, cookies, data_atualizacao):
                     available_mappings[col_name] = options_map
                     selected_actual = [options_map[val] for val in selected_display if val in options_map]
                     if selected_actual:
-                        mask_context &= df[col_name].isin(selected_actual)
+                        field_key = (col_name, tuple(selected_display))
+                        field_mask = _cached_mask(
+                            mask_cache, ("campo",) + field_key,
+                            lambda: _field_mask(df[col_name], selected_actual)
+                        )
+                        prefix_mask = mask_context
+                        active_prefix += (field_key,)
+                        mask_context = _cached_mask(
+                            mask_cache, ("cascata", active_prefix),
+                            lambda: prefix_mask & field_mask
+                        )
+
+        _prune_mask_cache(mask_cache)
+
+        # Top N: limita cada dimensão de linhas/colunas aos maiores membros, com o resto em "Outros"
+        t1, t2, t3 = st.columns([1.4, 1, 1])
+        with t1:
+            st.markdown("<br>", unsafe_allow_html=True)
+            use_top_n = st.checkbox(
+                'Limitar a Top N por dimensão (demais em "Outros")',
+                key="custom_topn_on",
+                on_change=_reset_custom_outputs,
+            )
+        with t2:
+            top_n = st.number_input(
+                "Top N",
+                min_value=1,
+                max_value=1000,
+                value=DEFAULT_TOP_N,
+                step=5,
+                key="custom_topn_n",
+                disabled=not use_top_n,
+                on_change=_reset_custom_outputs,
+            )
+        with t3:
+            top_n_metric = st.selectbox(
+                "Classificar por",
+                options=rank_metrics,
+                format_func=lambda x: metrics_map.get(x, x),
+                key="custom_topn_metric",
+                disabled=not use_top_n,
+                on_change=_reset_custom_outputs,
+            )
+        top_n = int(top_n) if use_top_n and top_n_metric else None
 
         st.markdown("<br>", unsafe_allow_html=True)
         _, center_btn, _ = st.columns([1, 1, 1])
@@ -403,7 +599,7 @@ def render(df_crowley, cookies, data_atualizacao):
             with st.spinner("Processando dados..."):
                 time.sleep(0.1)
                 real_filters_selected = {}
-                mask_filtered = mask_period.copy()
+                active_filters = {}
 
                 for col in fields_ordered:
                     state_key = f"custom_filter_{col}"
@@ -411,44 +607,58 @@ def render(df_crowley, cookies, data_atualizacao):
                     options_map = available_mappings.get(col, {})
                     selected_actual = [options_map[val] for val in selected_display if val in options_map]
                     if selected_actual:
-                        mask_filtered &= df[col].isin(selected_actual)
+                        active_filters[col] = selected_actual
                         real_filters_selected[dim_map.get(col, col)] = selected_display
 
+                # Menor rollup que cobre linhas, colunas, filtros e métricas; senão, base de fatos
+                month_aligned = (dt_ini.day == 1 or dt_ini <= data_min_base) and (
+                    (dt_fim + timedelta(days=1)).day == 1 or dt_fim >= data_max_base
+                )
+                rollups = get_rollups(df_crowley) if "Data_Dt" in df_crowley.columns else {}
+                source_columns = metric_columns(s_metrics)
+                if top_n and top_n_metric not in source_columns:
+                    source_columns.append(top_n_metric)
+                source_name = plan_rollup(rollups, s_rows + s_cols + list(active_filters) + source_columns, month_aligned)
+                if source_name is None:
+                    # Base de fatos: a máscara da cascata já combina período e todos os filtros
+                    df_source = df
+                    mask_filtered = mask_context
+                else:
+                    df_source = rollups[source_name]
+                    mask_filtered = rollup_period_mask(df_source, ts_ini, ts_fim)
+                    for col, selected_actual in active_filters.items():
+                        mask_filtered &= _field_mask(df_source[col], selected_actual)
+
                 if not bool(mask_filtered.any()):
                     _reset_custom_outputs()
                     st.warning("Nenhum dado encontrado para o período/filtros.")
                 else:
                     try:
-                        needed_columns = list(dict.fromkeys(s_rows + s_cols + s_metrics))
-                        df_filtered = df.loc[mask_filtered, needed_columns]
+                        use_margins = bool(
+                            st.session_state.get("add_total_rows", False)
+                            or st.session_state.get("add_total_cols", False)
+                        )
 
-                        est_rows = df_filtered[s_rows].drop_duplicates().shape[0] if s_rows else 1
-                        est_cols = df_filtered[s_cols].drop_duplicates().shape[0] if s_cols else 1
-                        total_cells = est_rows * est_cols * max(len(s_metrics), 1)
+                        # Estimativa antes de qualquer alocação grande (nada é copiado até aqui)
+                        estimate = _estimate_pivot_size(
+                            df_source, mask_filtered, s_rows, s_cols, len(s_metrics), use_margins, top_n
+                        )
+                        total_cells = estimate["cells"]
 
-                        if total_cells > MAX_ESTIMATED_CELLS:
+                        if total_cells > MAX_ESTIMATED_CELLS or estimate["result_bytes"] > MAX_ESTIMATED_BYTES:
                             _reset_custom_outputs()
                             st.error(
-                                f"Relatório muito grande (~{total_cells:,.0f} células). "
-                                "Aplique mais filtros antes de gerar."
+                                f"Relatório muito grande (~{total_cells:,.0f} células, "
+                                f"{_format_size(estimate['result_bytes'])} em memória). "
+                                "Aplique mais filtros ou limite a Top N antes de gerar."
                             )
                         else:
-                            use_margins = bool(
-                                st.session_state.get("add_total_rows", False)
-                                or st.session_state.get("add_total_cols", False)
-                            )
-
-                            pivot = pd.pivot_table(
-                                df_filtered,
-                                index=s_rows or None,
-                                columns=s_cols or None,
-                                values=s_metrics,
-                                aggfunc="sum",
-                                fill_value=0,
-                                margins=use_margins,
-                                margins_name="TOTAL",
-                                observed=True,
-                                sort=False,
+                            needed_columns = list(dict.fromkeys(s_rows + s_cols + source_columns))
+                            # Pool de processos quando configurado (utils.offload); senão, aqui mesmo
+                            pivot = run_aggregation(
+                                report_pivot, df_source, s_rows, s_cols, s_metrics, use_margins, top_n, top_n_metric,
+                                snapshot=snapshot_id(f"custom-{source_name or 'fatos'}", dataset_version(df_crowley)),
+                                mask=mask_filtered, columns=needed_columns,
                             )
 
                             if use_margins:
@@ -487,14 +697,27 @@ def render(df_crowley, cookies, data_atualizacao):
                                 pivot.size > MAX_PREVIEW_SIZE or pivot.shape[1] > MAX_PREVIEW_COLS
                             )
                             st.session_state.custom_pivot_cache = pivot
+                            st.session_state.custom_pivot_estimate = estimate
+                            st.session_state.custom_pivot_source = (
+                                f"agregado {source_name.lower()}" if source_name else "base completa"
+                            )
                             st.session_state.custom_filters_info = {
                                 "Período": f"{dt_ini.strftime('%d/%m/%Y')} a {dt_fim.strftime('%d/%m/%Y')}",
                                 "Linhas": ", ".join([dim_map.get(x, x) for x in s_rows]) or "Nenhuma",
                                 "Colunas": ", ".join([dim_map.get(x, x) for x in s_cols]) or "Nenhuma",
                                 "Filtros Aplicados": _format_selected_filters(real_filters_selected),
+                                "Top N": (
+                                    f"{top_n} por dimensão, por {metrics_map.get(top_n_metric, top_n_metric)} (demais em Outros)"
+                                    if top_n else "Não"
+                                ),
+                            }
+                            # O que muda o arquivo sem constar nos filtros (assinatura do cache de exportação)
+                            st.session_state.custom_export_options = {
+                                "metricas": s_metrics,
+                                "total_linhas": bool(st.session_state.get("add_total_rows", False)),
+                                "total_colunas": bool(st.session_state.get("add_total_cols", False)),
                             }
 
-                            del df_filtered
                             gc.collect()
                             st.rerun()
 
@@ -547,6 +770,13 @@ def render(df_crowley, cookies, data_atualizacao):
             st.success("Relatório gerado com sucesso!")
             st.dataframe(full_pivot, height=600, width="stretch")
 
+        if st.session_state.get("custom_pivot_source"):
+            caption = f"Fonte dos dados: {st.session_state.custom_pivot_source}"
+            estimate = st.session_state.get("custom_pivot_estimate")
+            if estimate:
+                caption += f" · Excel estimado: {_format_size(estimate['excel_bytes'])}"
+            st.caption(caption)
+
         st.markdown("<br>", unsafe_allow_html=True)
         _, export_col, _ = st.columns([1, 1, 1])
         with export_col:
@@ -556,9 +786,8 @@ def render(df_crowley, cookies, data_atualizacao):
 
     if st.session_state.get("show_custom_export", False):
 
-        @st.dialog("Exportação Personalizada")
+        @st.dialog("Exportação Personalizada", on_dismiss=lambda: st.session_state.update(show_custom_export=False))
         def export_dialog_custom():
-            st.write("Preparando arquivo Excel...")
             df_to_export = st.session_state.get("custom_pivot_cache")
             filters_info = st.session_state.get("custom_filters_info", {})
 
@@ -569,66 +798,70 @@ def render(df_crowley, cookies, data_atualizacao):
                     st.rerun()
                 return
 
-            if df_to_export.shape[1] > MAX_EXCEL_COLUMNS:
-                st.error(
-                    f"Não foi possível exportar porque o relatório possui {df_to_export.shape[1]} colunas "
-                    f"(o limite do Excel é {MAX_EXCEL_COLUMNS}). Ajuste os filtros para gerar um relatório menor."
+            export_options = st.session_state.get("custom_export_options", {})
+            signature = export_signature("relatorio_personalizado", filters_info, **export_options)
+            formato = export_format_radio("custom_export_formato")
+            if formato != FORMATO_EXCEL:
+                # Parquet / CSV.gz não têm limite de colunas nem formatação por célula
+                columnar_export(
+                    {"Relatório": df_to_export},
+                    filters_info, f"Relatorio_Personalizado_{datetime.now().strftime('%d%m_%H%M')}", formato,
+                    on_click=lambda: st.session_state.update(show_custom_export=False), key="custom_export",
+                    df_base=df_crowley, signature=signature
                 )
-                if st.button("Fechar", key="btn_close_export_error"):
-                    st.session_state.show_custom_export = False
-                    st.rerun()
                 return
 
-            if df_to_export.size > MAX_EXCEL_CELLS:
-                st.info("O arquivo é grande, isso pode levar alguns segundos...")
-
-            try:
-                with st.spinner("Gerando arquivo..."):
-                    export_df = df_to_export.copy()
-                    if (
-                        not isinstance(export_df.index, pd.MultiIndex)
-                        and isinstance(export_df.index.dtype, pd.CategoricalDtype)
-                    ):
-                        export_df.index = export_df.index.astype(str)
-                    excel_buffer = generate_custom_report_excel(export_df, filters_info)
-            except MemoryError:
-                st.error("A exportação excedeu a memória disponível. Reduza o tamanho do relatório.")
-                if st.button("Fechar", key="btn_close_export_memory"):
-                    st.session_state.show_custom_export = False
-                    st.rerun()
-                return
-            except Exception as exc:
-                st.error(f"Falha ao gerar o Excel: {exc}")
-                if st.button("Fechar", key="btn_close_export_exception"):
+            st.write("Preparando arquivo Excel...")
+            row_dims = [n for n in df_to_export.index.names if n is not None]
+            split_sel = st.selectbox(
+                "Dividir em abas",
+                options=[SPLIT_AUTO] + row_dims,
+                format_func=lambda x: x if x == SPLIT_AUTO else f"Uma aba por {x}",
+                key="custom_export_split",
+            )
+            split_by = None if split_sel == SPLIT_AUTO else split_sel
+            signature = export_signature("relatorio_personalizado", filters_info, dividir_por=split_by, **export_options)
+
+            if df_to_export.shape[1] > EXCEL_MAX_COLS - df_to_export.index.nlevels or len(df_to_export) >= EXCEL_MAX_ROWS:
+                st.info(
+                    f"O relatório ({len(df_to_export):,} linhas × {df_to_export.shape[1]:,} colunas) passa do limite "
+                    f"de uma aba do Excel e será dividido em várias, listadas na aba '{INDEX_SHEET}'.".replace(",", ".")
+                )
+
+            excel_bytes = (df_to_export.size + df_to_export.shape[0] * df_to_export.index.nlevels) * EXCEL_BYTES_PER_CELL
+            if excel_bytes > MAX_ESTIMATED_BYTES:
+                st.error(
+                    f"A exportação precisaria de {_format_size(excel_bytes)} de memória. "
+                    "Aplique mais filtros para gerar um relatório menor."
+                )
+                if st.button("Fechar", key="btn_close_export_size"):
                     st.session_state.show_custom_export = False
                     st.rerun()
                 return
 
-            st.success("Pronto!")
-            st.markdown(
-                """
-                <style>
-                div[data-testid="stDialog"] button[kind="primary"] {
-                    background-color: #007bff !important;
-                    border-color: #007bff !important;
-                    color: white !important;
-                }
-                div[data-testid="stDialog"] button[kind="primary"] * {
-                    color: white !important;
-                }
-                </style>
-                """,
-                unsafe_allow_html=True,
-            )
-
-            st.download_button(
-                label="Baixar Arquivo",
-                data=excel_buffer,
+            if df_to_export.size > MAX_EXCEL_CELLS:
+                st.info(f"O arquivo é grande ({_format_size(excel_bytes)} para montar), isso pode levar alguns segundos...")
+
+            def build_excel():
+                # Roda no worker do job (sem chamadas ao Streamlit)
+                export_df = df_to_export.copy()
+                if (
+                    not isinstance(export_df.index, pd.MultiIndex)
+                    and isinstance(export_df.index.dtype, pd.CategoricalDtype)
+                ):
+                    export_df.index = export_df.index.astype(str)
+                return generate_custom_report_excel(export_df, filters_info, split_by)
+
+            background_excel_export(
+                df_crowley, signature, build_excel,
                 file_name=f"Relatorio_Personalizado_{datetime.now().strftime('%d%m_%H%M')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                type="primary",
-                use_container_width=True,
-                on_click=lambda: st.session_state.update(show_custom_export=False),
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", key="custom_export",
+                on_done=lambda: st.session_state.update(show_custom_export=False),
             )
 
         export_dialog_custom()
+    elif st.session_state.get("custom_export_job"):
+        # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+        _, c_job, _ = st.columns([1, 2, 1])
+        with c_job:
+            export_job_panel("custom_export")
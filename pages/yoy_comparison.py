@@ -0,0 +1,314 @@
+# pages/yoy_comparison.py
+import streamlit as st
+import pandas as pd
+import json
+
+from utils.export_crowley import generate_yoy_excel
+from utils.export_ui import export_format_radio, columnar_export, background_excel_export, export_job_panel, FORMATO_EXCEL
+from utils.export_cache import export_signature
+from utils.cube import get_monthly_cube, get_rollups, compare_months, partial_month_cutoff, CUBE_MEASURES, ROLLUP_DIARIO
+from utils.presence_index import MES_ABREV
+
+# Base de comparação
+COMP_ANO_ANTERIOR = "Mesmo mês do ano anterior"
+COMP_MES_ANTERIOR = "Mês anterior"
+
+# Agrupamentos disponíveis (rótulo → colunas do cubo)
+AGRUPAMENTOS = {
+    "Anunciante": ["Anunciante"],
+    "Veículo": ["Emissora"],
+    "Anunciante × Veículo": ["Anunciante", "Emissora"],
+}
+
+
+def month_label(ano, mes):
+    return f"{MES_ABREV[mes]}/{ano}"
+
+
+def render(df_crowley, cookies, data_atualizacao):
+    # --- CSS GLOBAL E ESPECÍFICO ---
+    st.markdown("""
+        <style>
+        [data-testid="stDataFrame"] th {
+            text-align: center !important;
+            vertical-align: middle !important;
+        }
+        [data-testid="stDataFrame"] td {
+            text-align: center !important;
+            vertical-align: middle !important;
+        }
+        .page-title-centered {
+            text-align: center;
+            font-size: 2.5rem;
+            font-weight: 700;
+            color: #003366; /* Azul Novabrasil */
+            margin-bottom: 0.5rem;
+            margin-top: 1rem;
+        }
+        .page-subtitle-centered {
+            text-align: center;
+            color: #666;
+            font-size: 1rem;
+            margin-bottom: 2rem;
+        }
+        </style>
+    """, unsafe_allow_html=True)
+
+    # --- Botão Voltar ---
+    if st.button("Voltar", key="btn_voltar_yoy"):
+        st.query_params["view"] = "menu"
+        keys_to_clear = ["yoy_search_trigger", "yoy_praca_key", "yoy_veiculos_key", "yoy_tipo_key", "show_yoy_export", "yoy_export_job"]
+        for k in keys_to_clear:
+            st.session_state.pop(k, None)
+        st.rerun()
+
+    # --- TÍTULOS ---
+    st.markdown('<div class="page-title-centered">YoY Comparison</div>', unsafe_allow_html=True)
+    st.markdown('<div class="page-subtitle-centered">Mês contra o mesmo mês do ano anterior (ou contra o mês anterior)</div>', unsafe_allow_html=True)
+
+    # --- Validação da Base ---
+    if df_crowley is None or df_crowley.empty:
+        st.error("Base de dados não carregada.")
+        st.stop()
+
+    if "Data_Dt" not in df_crowley.columns:
+        st.error("Coluna de Data não encontrada na base.")
+        st.stop()
+
+    # Cubo mensal pré-calculado (uma vez por atualização da base, compartilhado entre sessões)
+    cube = get_monthly_cube(df_crowley)
+
+    # --- COOKIES ---
+    saved_filters = {}
+    cookie_val = cookies.get("crowley_filters_yoy")
+    if cookie_val:
+        try: saved_filters = json.loads(cookie_val)
+        except: pass
+
+    def get_cookie_val(key, default=None):
+        return saved_filters.get(key, default)
+
+    # --- INTERFACE DE FILTROS ---
+    st.markdown("##### Configuração da Análise")
+
+    meses = cube[["Ano", "Mes"]].drop_duplicates().sort_values(by=["Ano", "Mes"], ascending=False)
+    lista_meses = [month_label(a, m) for a, m in zip(meses["Ano"], meses["Mes"])]
+    mapa_meses = dict(zip(lista_meses, zip(meses["Ano"].astype(int), meses["Mes"].astype(int))))
+
+    lista_pracas = sorted(cube["Praca"].dropna().unique())
+    saved_praca = get_cookie_val("praca", None)
+    if saved_praca not in lista_pracas: saved_praca = lista_pracas[0] if lista_pracas else None
+    if "yoy_praca_key" not in st.session_state:
+        st.session_state.yoy_praca_key = saved_praca
+
+    def on_change_reset():
+        st.session_state["yoy_search_trigger"] = False
+
+    def idx_of(options, value, default=0):
+        return options.index(value) if value in options else default
+
+    lista_comp = [COMP_ANO_ANTERIOR, COMP_MES_ANTERIOR]
+    lista_agrup = list(AGRUPAMENTOS.keys())
+    lista_metricas = [CUBE_MEASURES[c] for c in CUBE_MEASURES if c in cube.columns]
+
+    with st.container(border=True):
+        c1, c2, c3 = st.columns([1, 1.5, 1.5])
+        with c1: sel_mes = st.selectbox("Mês", options=lista_meses, index=idx_of(lista_meses, get_cookie_val("mes")), on_change=on_change_reset)
+        with c2: sel_comp = st.selectbox("Comparar com", options=lista_comp, index=idx_of(lista_comp, get_cookie_val("comparacao")), on_change=on_change_reset)
+        with c3: sel_praca = st.selectbox("Praça", options=lista_pracas, key="yoy_praca_key", on_change=on_change_reset)
+
+        st.divider()
+
+        # --- CONTEXTO (direto no cubo) ---
+        ano, mes = mapa_meses[sel_mes]
+        if sel_comp == COMP_ANO_ANTERIOR:
+            ano_comp, mes_comp = ano - 1, mes
+        else:
+            ano_comp, mes_comp = (ano, mes - 1) if mes > 1 else (ano - 1, 12)
+
+        cube_praca = cube[cube["Praca"] == sel_praca]
+        cube_ctx = cube_praca[
+            ((cube_praca["Ano"] == ano) & (cube_praca["Mes"] == mes)) |
+            ((cube_praca["Ano"] == ano_comp) & (cube_praca["Mes"] == mes_comp))
+        ]
+        lista_veiculos_local = sorted(cube_ctx["Emissora"].dropna().unique())
+        tipos_disponiveis = sorted(cube_ctx["Tipo"].dropna().unique().tolist())
+
+        c4, c5, c6, c7 = st.columns([1.5, 1.5, 1, 1])
+
+        if "yoy_veiculos_key" not in st.session_state:
+            st.session_state.yoy_veiculos_key = [v for v in get_cookie_val("veiculos", []) if v in lista_veiculos_local]
+        else:
+            st.session_state.yoy_veiculos_key = [v for v in st.session_state.yoy_veiculos_key if v in lista_veiculos_local]
+
+        with c4:
+            sel_veiculos = st.multiselect("Veículos (Opc.)", options=lista_veiculos_local, key="yoy_veiculos_key", placeholder="Todos", on_change=on_change_reset)
+
+        saved_tipos = get_cookie_val("tipo_veiculacao", [])
+        if "Consolidado" in saved_tipos: saved_tipos = []
+        if "yoy_tipo_key" not in st.session_state:
+            st.session_state.yoy_tipo_key = [t for t in saved_tipos if t in tipos_disponiveis]
+        else:
+            st.session_state.yoy_tipo_key = [t for t in st.session_state.yoy_tipo_key if t in tipos_disponiveis]
+
+        with c5:
+            sel_tipos = st.multiselect("Tipo de Veiculação (Opc.)", options=tipos_disponiveis, key="yoy_tipo_key", placeholder="Todos", on_change=on_change_reset)
+        with c6:
+            sel_agrup = st.selectbox("Agrupar por", options=lista_agrup, index=idx_of(lista_agrup, get_cookie_val("agrupamento")), on_change=on_change_reset)
+        with c7:
+            sel_metrica = st.selectbox("Métrica", options=lista_metricas, index=idx_of(lista_metricas, get_cookie_val("metrica")), on_change=on_change_reset)
+
+        st.markdown("<br>", unsafe_allow_html=True)
+
+        _, c_btn, _ = st.columns([1, 1, 1])
+        with c_btn:
+            submitted = st.button("Gerar Comparação", type="primary", use_container_width=True)
+
+    if submitted:
+        st.session_state["yoy_search_trigger"] = True
+
+        new_filters = {
+            "mes": sel_mes,
+            "comparacao": sel_comp,
+            "praca": sel_praca,
+            "veiculos": sel_veiculos,
+            "tipo_veiculacao": sel_tipos if sel_tipos else ["Consolidado"],
+            "agrupamento": sel_agrup,
+            "metrica": sel_metrica
+        }
+        cookies["crowley_filters_yoy"] = json.dumps(new_filters)
+        cookies.save()
+
+    if st.session_state.get("yoy_search_trigger"):
+
+        measure = {v: k for k, v in CUBE_MEASURES.items()}[sel_metrica]
+        group_cols = AGRUPAMENTOS[sel_agrup]
+        label_atual = month_label(ano, mes)
+        label_comp = month_label(ano_comp, mes_comp)
+
+        # Mês ainda em carga: os dois meses vão só até o último dia carregado (pelo rollup diário);
+        # parcial contra mês completo mostraria todo mundo caindo
+        ate_dia = partial_month_cutoff(df_crowley, ano, mes)
+        if ate_dia is None:
+            df_comp = compare_months(
+                cube_praca, (ano, mes), (ano_comp, mes_comp), group_cols, measure,
+                emissoras=sel_veiculos, tipos=sel_tipos
+            )
+        else:
+            df_comp = compare_months(
+                get_rollups(df_crowley)[ROLLUP_DIARIO], (ano, mes), (ano_comp, mes_comp), group_cols, measure,
+                praca=sel_praca, emissoras=sel_veiculos, tipos=sel_tipos, ate_dia=ate_dia
+            )
+            label_atual = f"{label_atual} (1-{ate_dia})"
+            label_comp = f"{label_comp} (1-{ate_dia})"
+        if df_comp.empty:
+            st.warning("Nenhum dado encontrado para os meses selecionados (com os filtros atuais).")
+            return
+
+        if ate_dia is not None:
+            st.info(f"{month_label(ano, mes)} está parcial (dados até o dia {ate_dia}): os dois meses foram comparados do dia 1 ao dia {ate_dia}.")
+
+        # --- RESUMO ---
+        total_atual = int(df_comp["Atual"].sum())
+        total_comp = int(df_comp["Comparação"].sum())
+        var_total = (total_atual - total_comp) / total_comp if total_comp > 0 else 0.0
+        contagem = df_comp["Situação"].value_counts()
+
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric(f"{sel_metrica} {label_atual}", f"{total_atual:,.0f}".replace(",", "."), f"{var_total:+.1%}")
+        k2.metric(f"{sel_metrica} {label_comp}", f"{total_comp:,.0f}".replace(",", "."))
+        k3.metric("Novos", int(contagem.get("Novo", 0)))
+        k4.metric("Perdidos", int(contagem.get("Perdido", 0)))
+
+        # --- TABELA ---
+        key_labels = {"Emissora": "Veículo"}
+        df_view = df_comp.rename(columns={
+            **key_labels,
+            "Atual": label_atual,
+            "Comparação": label_comp
+        })
+        key_cols_view = [key_labels.get(c, c) for c in group_cols]
+
+        row_total = {c: "" for c in df_view.columns}
+        row_total[key_cols_view[0]] = "TOTAL GERAL"
+        row_total[label_atual] = total_atual
+        row_total[label_comp] = total_comp
+        row_total["Delta"] = total_atual - total_comp
+        row_total["Var %"] = var_total
+        df_export = pd.concat([df_view, pd.DataFrame([row_total])], ignore_index=True)
+
+        def highlight_var(val):
+            if isinstance(val, (float, int)):
+                if val > 0: return 'color: #16a34a; font-weight: bold'
+                if val < 0: return 'color: #dc2626; font-weight: bold'
+            return ""
+
+        def safe_fmt_int(val):
+            if val == "": return ""
+            try: return f"{float(val):,.0f}".replace(",", ".")
+            except: return str(val)
+
+        df_screen = df_export.copy()
+        for c in ("Posição", "Posição Ant."):
+            df_screen[c] = df_screen[c].astype(str).str.replace(r'\.0$', '', regex=True)
+
+        styler = df_screen.style\
+            .format({label_atual: safe_fmt_int, label_comp: safe_fmt_int, "Delta": safe_fmt_int, "Var %": "{:+.1%}"})\
+            .map(highlight_var, subset=["Delta", "Var %"])\
+            .apply(lambda x: ["background-color: #f0f2f6; font-weight: bold" if x[key_cols_view[0]] == "TOTAL GERAL" else "" for i in x], axis=1)
+        styler = styler.set_properties(**{'text-align': 'center'})
+
+        col_config = {c: st.column_config.TextColumn(c, width="large") for c in key_cols_view}
+        col_config["Posição"] = st.column_config.TextColumn("Posição", width="small")
+        col_config["Posição Ant."] = st.column_config.TextColumn("Posição Ant.", width="small")
+
+        st.markdown(f"### {label_atual} x {label_comp}")
+        st.dataframe(styler, width="stretch", height=600, hide_index=True, column_config=col_config)
+
+        st.markdown("---")
+
+        # ==================== EXPORTAÇÃO COM POP-UP ====================
+        _, _, c_btn_exp, _, _ = st.columns([1, 1, 1, 1, 1])
+        with c_btn_exp:
+            if st.button("Exportar Excel", type="secondary", use_container_width=True):
+                st.session_state.show_yoy_export = True
+
+        if st.session_state.get("show_yoy_export", False):
+            @st.dialog("Exportação", on_dismiss=lambda: st.session_state.update(show_yoy_export=False))
+            def export_dialog_yoy():
+                filters_info = {
+                    "Mês": label_atual,
+                    "Comparado com": f"{label_comp} ({sel_comp})",
+                    "Praça": sel_praca,
+                    "Veículos": ", ".join(sel_veiculos) if sel_veiculos else "Todos",
+                    "Tipo de Veiculação": ", ".join(sel_tipos) if sel_tipos else "Todos",
+                    "Agrupamento": sel_agrup,
+                    "Métrica": sel_metrica
+                }
+
+                signature = export_signature("yoy_comparison", filters_info)
+                formato = export_format_radio("yoy_export_formato")
+                if formato != FORMATO_EXCEL:
+                    columnar_export(
+                        {"Comparação": df_export},
+                        filters_info, f"YoY_{sel_praca}_{month_label(ano, mes).replace('/', '')}_{month_label(ano_comp, mes_comp).replace('/', '')}", formato,
+                        on_click=lambda: st.session_state.update(show_yoy_export=False), key="yoy_export",
+                        df_base=df_crowley, signature=signature
+                    )
+                    return
+
+                background_excel_export(
+                    df_crowley, signature, lambda: generate_yoy_excel({'comparison': df_export}, filters_info),
+                    file_name=f"YoY_{sel_praca}_{month_label(ano, mes).replace('/', '')}_{month_label(ano_comp, mes_comp).replace('/', '')}.xlsx",
+                    mime="application/vnd.ms-excel", key="yoy_export",
+                    on_done=lambda: st.session_state.update(show_yoy_export=False)
+                )
+
+            export_dialog_yoy()
+        elif st.session_state.get("yoy_export_job"):
+            # Diálogo fechado com a exportação em andamento: andamento e download ficam na página
+            _, c_job, _ = st.columns([1, 2, 1])
+            with c_job:
+                export_job_panel("yoy_export")
+
+        st.markdown(f"<div style='text-align:center;color:#666;font-size:0.8rem;margin-top:5px;'>Última atualização da base de dados: {data_atualizacao}</div>", unsafe_allow_html=True)
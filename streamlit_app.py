@@ -128,6 +128,8 @@ menu_options = [
     {"label": "Campaign Flow", "view": "campaign"},
     {"label": "Presence Map", "view": "presence"},
     {"label": "Performance Index", "view": "performance"},
+    {"label": "Overlap Matrix", "view": "overlap"},
+    {"label": "YoY Comparison", "view": "yoy"},
     {"label": "Relatório Personalizado", "view": "custom"},
 ]
 
@@ -166,6 +168,8 @@ def modal_boas_vindas():
         * **Campaign Flow:** Como o mercado se movimenta no tempo?
         * **Presence Map:** Onde cada marca ocupa o território?
         * **Performance Index:** Quem é mais forte e consistente?
+        * **Overlap Matrix:** Quais anunciantes as emissoras compartilham?
+        * **YoY Comparison:** Como este mês se compara ao mesmo mês do ano passado?
         ---
         """)
         st.markdown("**Dúvidas:** (31) 9.9274-4574 - Silvia Freitas")
@@ -0,0 +1,289 @@
+# utils/analytics.py
+import numpy as np
+import pandas as pd
+
+from utils.presence_index import MES_ABREV
+
+VAL_COL = "Volume de Insercoes"
+
+# Maior espaço de combinações contado por bitmap em `count_distinct` (1 byte por combinação possível)
+MAX_BITMAP_SIZE = 32_000_000
+
+# Colunas produzidas por `consistency_metrics`
+CONSISTENCY_COLS = ["Dias Ativos", "% Dias Ativos", "Maior Sequência", "CV Semanal", "Emissoras"]
+
+# Rótulo de cada código de período (ver `period_codes`)
+PERIOD_LABELS = np.array(["", "Atual", "Anterior", "Atual e Anterior"], dtype=object)
+
+
+def period_codes(datas, periods):
+    """
+    Código de período por linha para (atual, anterior), que podem se sobrepor:
+    0 = fora, 1 = atual, 2 = anterior, 3 = ambos. `periods` = ((ini, fim), (ref_ini, ref_fim)), limites inclusivos.
+
+    Uma máscara única `codes > 0` substitui concatenar os dois recortes (sem cópia nem hash de linhas).
+    """
+    (ini, fim), (ref_ini, ref_fim) = periods
+    datas = pd.Series(datas)
+    in_atual = ((datas >= pd.Timestamp(ini)) & (datas <= pd.Timestamp(fim))).to_numpy()
+    in_ref = ((datas >= pd.Timestamp(ref_ini)) & (datas <= pd.Timestamp(ref_fim))).to_numpy()
+    return in_atual.astype(np.int8) + 2 * in_ref.astype(np.int8)
+
+
+def count_distinct(df, cols, mask=None):
+    """
+    Combinações distintas de `cols` nas linhas de `mask` (linhas com alguma chave nula não contam,
+    como num groupby). Usa os códigos das categorias (ou `factorize`) combinados em base mista num
+    único int64; com espaço de combinações pequeno basta marcar um bitmap, senão uma tabela hash
+    (`pd.unique`) — ambos O(n), sem ordenar nem copiar as colunas.
+    """
+    if not cols:
+        return 1
+    n_rows = len(df) if mask is None else int(np.count_nonzero(mask))
+    if n_rows == 0:
+        return 0
+
+    combined = np.zeros(n_rows, dtype=np.int64)
+    valid = np.ones(n_rows, dtype=bool)
+    space = 1
+    for col in cols:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            codes = codes if mask is None else codes[mask]
+            n_cats = len(series.cat.categories)
+        else:
+            values = series.to_numpy()
+            codes, uniques = pd.factorize(values if mask is None else values[mask])
+            n_cats = len(uniques)
+        valid &= codes >= 0
+        if space * max(n_cats, 1) >= 2 ** 62:
+            # Espaço de combinações grande demais: renumera o que já existe antes de seguir
+            combined, uniques = pd.factorize(combined)
+            combined = combined.astype(np.int64)
+            space = max(len(uniques), 1)
+        combined = combined * max(n_cats, 1) + codes
+        space *= max(n_cats, 1)
+
+    combined = combined[valid]
+    if not len(combined):
+        return 0
+    if space <= MAX_BITMAP_SIZE:
+        seen = np.zeros(space, dtype=bool)
+        seen[combined] = True
+        return int(np.count_nonzero(seen))
+    return len(pd.unique(combined))
+
+
+def consistency_metrics(df_period, ts_ini, ts_fim, by="Anunciante"):
+    """
+    Métricas de consistência por `by` (anunciante) dentro de um período [ts_ini, ts_fim].
+
+    - Dias Ativos / % Dias Ativos: dias com inserção sobre os dias do período
+    - Maior Sequência: maior número de dias consecutivos com inserção
+    - CV Semanal: desvio padrão / média do volume por semana do período (semanas sem inserção contam como zero)
+    - Emissoras: emissoras distintas com inserção
+
+    Tudo sai de agregados por (chave, dia) com bincount/unique — sem laço por anunciante.
+    """
+    if df_period is None or df_period.empty:
+        return pd.DataFrame(columns=[by] + CONSISTENCY_COLS)
+
+    day0 = pd.Timestamp(ts_ini).normalize()
+    n_days = max(int((pd.Timestamp(ts_fim).normalize() - day0).days) + 1, 1)
+    n_weeks = -(-n_days // 7)
+
+    key_codes, keys = pd.factorize(df_period[by], sort=True)
+    n_keys = len(keys)
+    day = ((df_period["Data_Dt"].to_numpy() - np.datetime64(day0, "ns")) // np.timedelta64(1, "D")).astype(np.int64)
+    if VAL_COL in df_period.columns:
+        vol = df_period[VAL_COL].to_numpy(dtype=np.float64)
+    else:
+        vol = np.ones(len(df_period))
+
+    valid = (key_codes >= 0) & (day >= 0) & (day < n_days)
+    key_codes, day, vol = key_codes[valid], day[valid], vol[valid]
+
+    # Pares (chave, dia) ativos, já ordenados por chave → dia
+    pairs = np.unique(key_codes * n_days + day)
+    pair_key, pair_day = pairs // n_days, pairs % n_days
+    dias_ativos = np.bincount(pair_key, minlength=n_keys)
+
+    # Sequências: quebra quando muda a chave ou o dia não é o seguinte
+    new_run = np.ones(len(pairs), dtype=bool)
+    new_run[1:] = (pair_key[1:] != pair_key[:-1]) | (pair_day[1:] != pair_day[:-1] + 1)
+    run_id = np.cumsum(new_run) - 1
+    run_len = np.bincount(run_id)
+    maior_seq = np.zeros(n_keys, dtype=np.int64)
+    np.maximum.at(maior_seq, pair_key[new_run], run_len)
+
+    # Volume por semana do período (grade chave × semana)
+    weekly = np.bincount(key_codes * n_weeks + day // 7, weights=vol, minlength=n_keys * n_weeks).reshape(n_keys, n_weeks)
+    mean_w = weekly.mean(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cv = np.where(mean_w > 0, weekly.std(axis=1) / mean_w, np.nan)
+
+    # Emissoras distintas
+    if "Emissora" in df_period.columns:
+        em_codes = pd.factorize(df_period["Emissora"])[0][valid]
+        n_em = int(em_codes.max()) + 1 if len(em_codes) else 1
+        em_pairs = np.unique(key_codes * n_em + em_codes)
+        emissoras = np.bincount(em_pairs // n_em, minlength=n_keys)
+    else:
+        emissoras = np.zeros(n_keys, dtype=np.int64)
+
+    out = pd.DataFrame({
+        by: np.asarray(keys).astype(str),
+        "Dias Ativos": dias_ativos,
+        "% Dias Ativos": dias_ativos / n_days,
+        "Maior Sequência": maior_seq,
+        "CV Semanal": cv,
+        "Emissoras": emissoras
+    })
+    return out[out["Dias Ativos"] > 0].reset_index(drop=True)
+
+
+def consistency_index(metrics, n_days):
+    """
+    Índice composto (0–100) a partir de `consistency_metrics`: média de
+    % de dias ativos, maior sequência / dias do período, 1 / (1 + CV semanal)
+    e emissoras / maior número de emissoras do recorte.
+    """
+    if metrics.empty:
+        return pd.Series(dtype=float, index=metrics.index)
+    max_em = max(int(metrics["Emissoras"].max()), 1)
+    componentes = np.column_stack([
+        metrics["% Dias Ativos"].to_numpy(dtype=float),
+        metrics["Maior Sequência"].to_numpy(dtype=float) / max(n_days, 1),
+        1.0 / (1.0 + metrics["CV Semanal"].fillna(0).to_numpy(dtype=float)),
+        metrics["Emissoras"].to_numpy(dtype=float) / max_em
+    ])
+    return pd.Series(100.0 * componentes.mean(axis=1), index=metrics.index)
+
+
+def week_windows(ts_ini, ts_fim):
+    """Semanas (segunda a domingo) que cobrem [ts_ini, ts_fim], recortadas ao período: lista de (início, fim)."""
+    ini = pd.Timestamp(ts_ini).normalize()
+    fim = pd.Timestamp(ts_fim).normalize()
+    if fim < ini:
+        return []
+    starts = pd.date_range(ini - pd.Timedelta(days=ini.weekday()), fim, freq="7D")
+    return [(max(s, ini), min(s + pd.Timedelta(days=6), fim)) for s in starts]
+
+
+def weekly_ranks(df_slice, windows, by="Anunciante"):
+    """
+    Volume e posição por semana: um único groupby (chave, semana) e rank agrupado por semana.
+
+    `windows` = lista de (início, fim) por semana (ver `week_windows`); registros fora delas são ignorados.
+    Retorna formato longo: [by, "Semana" (posição em `windows`), "Volume", "Rank"].
+    """
+    cols_out = [by, "Semana", "Volume", "Rank"]
+    if df_slice is None or df_slice.empty or not windows:
+        return pd.DataFrame(columns=cols_out)
+
+    starts = np.array([w[0] for w in windows], dtype="datetime64[ns]")
+    ends = np.array([w[1] + pd.Timedelta(days=1) for w in windows], dtype="datetime64[ns]")
+    datas = df_slice["Data_Dt"].to_numpy()
+    semana = np.searchsorted(starts, datas, side="right") - 1
+    valid = semana >= 0
+    valid[valid] = datas[valid] < ends[semana[valid]]
+
+    vol = df_slice[VAL_COL].to_numpy() if VAL_COL in df_slice.columns else np.ones(len(df_slice))
+    long = pd.DataFrame({
+        by: df_slice[by].to_numpy()[valid],
+        "Semana": semana[valid],
+        "Volume": vol[valid]
+    })
+    long = long.groupby([by, "Semana"], observed=True, sort=False)["Volume"].sum().reset_index()
+    long = long[long["Volume"] > 0]
+    long["Rank"] = long.groupby("Semana")["Volume"].rank(ascending=False, method="min")
+    return long[cols_out].reset_index(drop=True)
+
+
+# --- Comparação de N períodos ---
+
+def month_periods(ref_date, n):
+    """Últimos `n` meses-calendário até o mês de `ref_date` (o mais recente vai só até `ref_date`)."""
+    ref = pd.Timestamp(ref_date).normalize()
+    primeiro = ref.replace(day=1)
+    periods = []
+    for k in range(n - 1, -1, -1):
+        ini = primeiro - pd.DateOffset(months=k)
+        fim = min(ini + pd.offsets.MonthEnd(0), ref)
+        periods.append((f"{MES_ABREV[ini.month]}/{ini:%y}", ini, fim))
+    return periods
+
+
+def same_month_periods(ref_date, n_years):
+    """O mês de `ref_date` (até o mesmo dia) em `n_years` anos, do mais antigo ao atual."""
+    ref = pd.Timestamp(ref_date).normalize()
+    periods = []
+    for k in range(n_years - 1, -1, -1):
+        fim = ref - pd.DateOffset(years=k)
+        ini = fim.replace(day=1)
+        periods.append((f"{MES_ABREV[ini.month]}/{ini:%y}", ini, fim))
+    return periods
+
+
+def period_matrix(df_slice, periods, by="Anunciante", val_col=VAL_COL):
+    """
+    Volume por `by` × período para N períodos rotulados, com uma única agregação.
+    Com `val_col=None` conta registros (presença), em vez de somar o volume.
+
+    `periods` = lista de (rótulo, início, fim), limites inclusivos por dia; podem se sobrepor.
+    As bordas de todos os períodos formam segmentos elementares: um `searchsorted` leva cada
+    data ao seu segmento, um bincount soma (chave, segmento) e uma matriz segmento × período
+    (pertinência) redistribui os segmentos para cada período.
+    """
+    labels = [p[0] for p in periods]
+    if df_slice is None or df_slice.empty or not periods:
+        return pd.DataFrame(columns=labels, dtype=np.int64).rename_axis(by)
+
+    ini = np.array([pd.Timestamp(p[1]).normalize() for p in periods], dtype="datetime64[ns]")
+    fim = np.array([pd.Timestamp(p[2]).normalize() + pd.Timedelta(days=1) for p in periods], dtype="datetime64[ns]")
+    edges = np.unique(np.concatenate([ini, fim]))
+    n_seg = len(edges) - 1
+    member = (ini[None, :] <= edges[:-1, None]) & (edges[1:, None] <= fim[None, :])
+
+    seg = np.searchsorted(edges, df_slice["Data_Dt"].to_numpy(), side="right") - 1
+    valid = (seg >= 0) & (seg < n_seg)
+    valid[valid] = member[seg[valid]].any(axis=1)
+
+    key_codes, keys = pd.factorize(df_slice[by], sort=True)
+    valid &= key_codes >= 0
+    vol = df_slice[val_col].to_numpy(dtype=np.float64) if val_col in df_slice.columns else np.ones(len(df_slice))
+
+    n_keys = len(keys)
+    por_segmento = np.bincount(
+        key_codes[valid] * n_seg + seg[valid], weights=vol[valid], minlength=n_keys * max(n_seg, 1)
+    ).reshape(n_keys, max(n_seg, 1))
+    matriz = (por_segmento @ member.astype(np.float64)).round().astype(np.int64)
+
+    out = pd.DataFrame(matriz, index=pd.Index(np.asarray(keys).astype(str), name=by), columns=labels)
+    return out[out.to_numpy().sum(axis=1) > 0]
+
+
+def compare_periods(matriz, atual, anterior):
+    """
+    Compara dois períodos de `period_matrix`: volumes, posição (rank 'min') em cada um,
+    Delta, Var % e situação (Novo / Perdido / Mantido). Só entram chaves ativas em algum dos dois.
+    """
+    vol_a = matriz[atual]
+    vol_b = matriz[anterior]
+    out = pd.DataFrame({"Vol_Atual": vol_a, "Vol_Ref": vol_b})
+    out = out[(out["Vol_Atual"] > 0) | (out["Vol_Ref"] > 0)]
+
+    out["Rank_Atual"] = out["Vol_Atual"].rank(ascending=False, method='min')
+    out["Rank_Anterior"] = out["Vol_Ref"].rank(ascending=False, method='min')
+    out["Delta"] = out["Vol_Atual"] - out["Vol_Ref"]
+    out["Var %"] = np.where(
+        out["Vol_Ref"] > 0,
+        out["Delta"] / out["Vol_Ref"].where(out["Vol_Ref"] > 0, 1),
+        np.where(out["Vol_Atual"] > 0, 1.0, 0.0)
+    )
+    out["Status"] = np.select(
+        [(out["Vol_Atual"] > 0) & (out["Vol_Ref"] == 0), (out["Vol_Atual"] == 0) & (out["Vol_Ref"] > 0)],
+        ["Novo", "Perdido"], "Mantido"
+    )
+    return out
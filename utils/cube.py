@@ -0,0 +1,166 @@
+# utils/cube.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.loaders import dataset_version, shared_derived
+from utils.analytics import compare_periods
+from utils.pivot import AIRTIME_COL, add_airtime
+
+# Dimensões e medidas dos rollups
+CUBE_DIMS = ["Praca", "Emissora", "Anunciante", "Tipo"]
+CUBE_MEASURES = {"Volume de Insercoes": "Inserções", "Duracao": "Duração"}
+
+
+# Rollups materializados, do mais fino ao mais grosso: nome -> (pai, dimensões).
+# Os diários guardam o dia em Data_Dt (recorte por período exato); os mensais só servem
+# quando o período cobre meses inteiros. Cada rollup é derivado do pai, não da base de fatos.
+ROLLUP_DIARIO = "Diário por Anunciante"
+ROLLUP_MENSAL = "Mensal por Anunciante"
+ROLLUPS = {
+    ROLLUP_DIARIO: (None, ["Data_Dt", "Ano", "Mes", "Dia"] + CUBE_DIMS),
+    "Diário por Veículo": (ROLLUP_DIARIO, ["Data_Dt", "Ano", "Mes", "Dia", "Praca", "Emissora", "Tipo"]),
+    ROLLUP_MENSAL: (ROLLUP_DIARIO, ["Ano", "Mes"] + CUBE_DIMS),
+    "Mensal por Veículo": (ROLLUP_MENSAL, ["Ano", "Mes", "Praca", "Emissora", "Tipo"]),
+    "Mensal por Praça": ("Mensal por Veículo", ["Ano", "Mes", "Praca", "Tipo"]),
+}
+
+
+def build_rollups(df):
+    """
+    Agregados de inserções, duração e tempo de ar nas grades de `ROLLUPS`.
+
+    O diário por anunciante sai de um único groupby sobre a base de fatos (registros sem data
+    ficam de fora, como em qualquer recorte por período); os demais são reagregados do pai.
+    Chaves nulas são mantidas (dropna=False) para que filtros e somas batam com a base de fatos,
+    e `sort=False` preserva a ordem de primeira ocorrência dos grupos.
+    """
+    dims = [c for c in CUBE_DIMS if c in df.columns]
+    measures = [c for c in CUBE_MEASURES if c in df.columns]
+
+    datas = df["Data_Dt"]
+    validas = datas.notna().to_numpy()
+    base = df.loc[validas, dims]
+    base = base.assign(
+        Data_Dt=datas[validas].dt.normalize().to_numpy(),
+        **{m: pd.to_numeric(df.loc[validas, m], errors="coerce").fillna(0).to_numpy() for m in measures}
+    )
+    add_airtime(base)
+    if AIRTIME_COL in base.columns:
+        measures = measures + [AIRTIME_COL]
+
+    rollups = {}
+    for nome, (pai, grade) in ROLLUPS.items():
+        keys = [c for c in grade if c in dims or c == "Data_Dt" or (pai is not None and c in rollups[pai].columns)]
+        origem = base if pai is None else rollups[pai]
+        r = origem.groupby(keys, observed=True, sort=False, dropna=False)[measures].sum().reset_index()
+        if pai is None:
+            r.insert(1, "Ano", r["Data_Dt"].dt.year.astype(np.int16))
+            r.insert(2, "Mes", r["Data_Dt"].dt.month.astype(np.int8))
+            r.insert(3, "Dia", r["Data_Dt"].dt.day.astype(np.int8))
+        for col in dims:
+            if col in r.columns:
+                r[col] = r[col].astype("category")
+        rollups[nome] = r
+    return rollups
+
+
+@st.cache_resource(show_spinner="Montando agregados...", max_entries=2)
+def _cached_rollups(_df, version):
+    # Um conjunto de rollups por versão da base, gravado ao lado do snapshot compartilhado:
+    # só o primeiro processo do host agrega, os demais mapeiam os mesmos arquivos
+    rollups = shared_derived(_df, "rollups", build_rollups)
+    return {nome: rollups[nome] for nome in ROLLUPS}
+
+
+def get_rollups(df):
+    """Rollups compartilhados entre sessões, invalidados pela versão da base."""
+    return _cached_rollups(df, dataset_version(df))
+
+
+@st.cache_resource(max_entries=2)
+def _cached_last_day(_df, version):
+    datas = get_rollups(_df)[ROLLUP_DIARIO]["Data_Dt"]
+    return datas.max() if len(datas) else None
+
+
+def last_loaded_day(df):
+    """Último dia com dados na base (Timestamp), ou None se não houver datas."""
+    return _cached_last_day(df, dataset_version(df))
+
+
+def partial_month_cutoff(df, ano, mes):
+    """
+    Dia de corte quando (ano, mes) é o mês ainda em carga (último dia carregado antes do fim do
+    mês); None se o mês está completo. Comparações com esse mês devem parar no mesmo dia.
+    """
+    ultimo = last_loaded_day(df)
+    if ultimo is None or (ultimo.year, ultimo.month) != (ano, mes) or ultimo.day == ultimo.days_in_month:
+        return None
+    return ultimo.day
+
+
+def get_monthly_cube(df):
+    """Cubo mensal (Praca, Emissora, Anunciante, Tipo, Ano, Mes): o rollup mensal por anunciante."""
+    return get_rollups(df)[ROLLUP_MENSAL]
+
+
+def plan_rollup(rollups, dims, month_aligned):
+    """
+    Nome do menor rollup que cobre `dims` (linhas + colunas + filtros ativos), ou None
+    quando alguma dimensão só existe na base de fatos (Anúncio, Faixa Horária, Produto...).
+    Rollups mensais só entram se o período cobre meses inteiros (`month_aligned`).
+    """
+    candidatos = [
+        (len(r), nome) for nome, r in rollups.items()
+        if set(dims) <= set(r.columns) and (month_aligned or "Data_Dt" in r.columns)
+    ]
+    return min(candidatos)[1] if candidatos else None
+
+
+def rollup_period_mask(rollup, ts_ini, ts_fim):
+    """Máscara do período [ts_ini, ts_fim] num rollup: por dia nos diários, por (ano, mês) nos mensais."""
+    if "Data_Dt" in rollup.columns:
+        return rollup["Data_Dt"].between(pd.Timestamp(ts_ini).normalize(), pd.Timestamp(ts_fim)).to_numpy()
+    ts_ini, ts_fim = pd.Timestamp(ts_ini), pd.Timestamp(ts_fim)
+    mes = rollup["Ano"].to_numpy(dtype=np.int32) * 12 + rollup["Mes"].to_numpy(dtype=np.int32)
+    return (mes >= ts_ini.year * 12 + ts_ini.month) & (mes <= ts_fim.year * 12 + ts_fim.month)
+
+
+def cube_slice(cube, ano, mes, praca=None, emissoras=None, tipos=None, ate_dia=None):
+    """
+    Linhas do cubo de um mês, com filtros opcionais de praça / emissoras / tipos.
+    `ate_dia` corta o mês no dia informado (só em rollups diários, que têm a coluna Dia).
+    """
+    mask = (cube["Ano"].to_numpy() == ano) & (cube["Mes"].to_numpy() == mes)
+    if ate_dia is not None: mask &= cube["Dia"].to_numpy() <= ate_dia
+    if praca is not None: mask &= (cube["Praca"] == praca).to_numpy()
+    if emissoras: mask &= cube["Emissora"].isin(emissoras).to_numpy()
+    if tipos: mask &= cube["Tipo"].isin(tipos).to_numpy()
+    return cube[mask]
+
+
+def compare_months(cube, atual, comparacao, group_cols, measure="Volume de Insercoes", praca=None, emissoras=None, tipos=None,
+                   ate_dia=None):
+    """
+    Compara dois meses (`atual` e `comparacao` como (ano, mes)) agrupando por `group_cols`.
+    Com `ate_dia` (mês atual parcial), os dois meses são cortados no mesmo dia: requer um
+    rollup diário em `cube`.
+
+    Retorna [group_cols..., "Atual", "Comparação", "Posição", "Posição Ant.", "Delta", "Var %", "Situação"],
+    ordenado pelo volume atual.
+    """
+    partes = []
+    for rotulo, (ano, mes) in (("Atual", atual), ("Comparação", comparacao)):
+        fatia = cube_slice(cube, ano, mes, praca, emissoras, tipos, ate_dia)
+        partes.append(fatia.groupby(group_cols, observed=True)[measure].sum().rename(rotulo))
+
+    comp = compare_periods(pd.concat(partes, axis=1).fillna(0), "Atual", "Comparação")
+    out = comp.rename(columns={
+        "Vol_Atual": "Atual", "Vol_Ref": "Comparação",
+        "Rank_Atual": "Posição", "Rank_Anterior": "Posição Ant.", "Status": "Situação"
+    }).reset_index()
+    for col in group_cols:
+        out[col] = out[col].astype(str)
+    out[["Atual", "Comparação", "Delta"]] = out[["Atual", "Comparação", "Delta"]].round().astype(np.int64)
+    return out.sort_values(by=["Atual", "Comparação"], ascending=[False, False]).reset_index(drop=True)
@@ -0,0 +1,110 @@
+# utils/export_cache.py
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+
+from utils.loaders import DATA_FOLDER, dataset_version
+
+# Arquivos de exportação já gerados, compartilhados entre sessões (um arquivo por assinatura)
+EXPORT_CACHE_FOLDER = os.path.join(DATA_FOLDER, "export_cache")
+EXPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+EXPORT_CACHE_SUFFIX = ".bin"
+
+# Gravação + despejo de uma sessão por vez (a leitura não precisa: os arquivos são trocados atomicamente)
+_cache_lock = threading.Lock()
+
+
+def export_signature(page, filters_info, **options):
+    """
+    Assinatura de uma exportação: página, filtros (os mesmos da aba 'Filtros') e opções da
+    página que mudam o conteúdo do arquivo sem aparecer nos filtros (checkboxes, métricas...).
+    """
+    return {"pagina": page, "filtros": filters_info, "opcoes": options}
+
+
+def export_cache_key(df, signature, fmt, table=None):
+    """Hash da exportação: versão da base + assinatura + formato (+ tabela). Também identifica jobs."""
+    raw = json.dumps([dataset_version(df), signature, fmt, table], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key):
+    return os.path.join(EXPORT_CACHE_FOLDER, key + EXPORT_CACHE_SUFFIX)
+
+
+def _read_entry(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)  # mtime = último acesso (ordem do LRU)
+        return io.BytesIO(data)
+    except OSError:
+        return None
+
+
+def _evict(max_bytes):
+    # Remove os arquivos menos usados até o total caber em `max_bytes`
+    entries = []
+    for entry in os.scandir(EXPORT_CACHE_FOLDER):
+        if entry.is_file() and entry.name.endswith(EXPORT_CACHE_SUFFIX):
+            info = entry.stat()
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def _write_entry(path, data):
+    with _cache_lock:
+        os.makedirs(EXPORT_CACHE_FOLDER, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_FOLDER, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        _evict(EXPORT_CACHE_MAX_BYTES)
+
+
+def has_cached_export(key):
+    """True se o arquivo da exportação `key` (export_cache_key) está no cache em disco."""
+    return os.path.exists(_cache_path(key))
+
+
+def read_cached_export(key):
+    """Arquivo da exportação `key` (export_cache_key) lido do cache em disco, ou None."""
+    return _read_entry(_cache_path(key))
+
+
+def cached_export(df, signature, fmt, build, table=None):
+    """
+    Arquivo da exportação `signature` no formato `fmt` (e `table`, nas exportações de uma tabela só).
+
+    Procura primeiro no cache em disco, chaveado também pela versão da base (uma atualização
+    invalida tudo; os arquivos antigos saem pelo LRU). Se não houver, chama `build()` — que
+    devolve um BytesIO, como os geradores de utils.export_crowley — e guarda o resultado.
+    Qualquer falha de disco só faz o arquivo ser gerado de novo.
+    """
+    path = _cache_path(export_cache_key(df, signature, fmt, table))
+    cached = _read_entry(path)
+    if cached is not None:
+        return cached
+
+    buffer = build()
+    data = buffer.getvalue()
+    if len(data) <= EXPORT_CACHE_MAX_BYTES:
+        _write_entry(path, data)
+    buffer.seek(0)
+    return buffer
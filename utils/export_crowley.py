@@ -1,166 +1,512 @@
 # utils/export_crowley.py
-import pandas as pd
+import gzip
 import io
+import itertools
+import json
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import xlsxwriter
 
-def _save_tab(writer, df, name, include_index=True):
-    """Função auxiliar para salvar abas com formatação padrão."""
-    if df is not None and not df.empty:
-        safe_name = name[:31]  # Limite do Excel
-        workbook = writer.book
-        fmt_center = workbook.add_format({'align': 'center', 'valign': 'vcenter'})
-        fmt_left = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
-        
-        df.to_excel(writer, sheet_name=safe_name, index=include_index)
-        worksheet = writer.sheets[safe_name]
-        
-        # Formatação básica
-        if include_index:
-            worksheet.set_column('A:A', 40, fmt_left) # Index column
-            worksheet.set_column('B:Z', 15, fmt_center)
+# Colunas de texto (largas, alinhadas à esquerda) nas abas sem índice
+TEXT_COLUMNS = ["Anunciante", "Anúncio", "Tipo de Veiculação", "Veículo", "Praça", "Linha"]
+
+# Exportação colunar: chave dos metadados no Parquet e linhas por bloco no CSV.gz
+PARQUET_METADATA_KEY = b"crowley"
+CSV_CHUNK_ROWS = 100_000
+
+# Limites do Excel por aba: tabelas maiores são divididas em várias abas, listadas na aba INDEX_SHEET
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_MAX_COLS = 16_384
+INDEX_SHEET = "Índice"
+# Linhas convertidas por vez ao gravar (a matriz de objetos nunca tem a tabela inteira)
+WRITE_CHUNK_ROWS = 50_000
+
+# Acompanhamento opcional da geração (jobs em segundo plano): callback(aba, linhas_gravadas, total_linhas)
+PROGRESS_EVERY_ROWS = 5_000
+_progress_callback = ContextVar("export_progress", default=None)
+
+
+@contextmanager
+def export_progress(callback):
+    """Durante o bloco, `_write_frame` informa o andamento de cada aba a `callback` (só nesta thread)."""
+    token = _progress_callback.set(callback)
+    try:
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+
+class _Workbook(xlsxwriter.Workbook):
+    """Workbook que registra as tabelas divididas em mais de uma aba (para a aba de índice)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.split_parts = []  # (aba, tabela, conteúdo, linhas)
+
+
+class _SheetParts(list):
+    """Abas de uma tabela (uma, ou várias se foi dividida); a formatação de colunas vale para todas."""
+
+    def set_column(self, *args, **kwargs):
+        for worksheet in self:
+            worksheet.set_column(*args, **kwargs)
+
+
+@contextmanager
+def _streaming_workbook(output):
+    """
+    Workbook xlsxwriter em modo `constant_memory` sobre um arquivo temporário em disco:
+    cada linha é descarregada assim que a seguinte começa, em vez de a planilha inteira
+    ficar em memória. Ao final o arquivo (já compactado) é copiado para `output`.
+    Os formatos são criados uma única vez por workbook e entregues junto. Se alguma tabela
+    foi dividida em várias abas, a aba de índice é acrescentada no fim (e aberta primeiro).
+    """
+    with tempfile.TemporaryFile() as tmp:
+        workbook = _Workbook(tmp, {
+            'constant_memory': True,
+            'nan_inf_to_errors': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        })
+        fmts = {
+            'center': workbook.add_format({'align': 'center', 'valign': 'vcenter'}),
+            'left': workbook.add_format({'align': 'left', 'valign': 'vcenter'}),
+            'header': workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+        }
+        yield workbook, fmts
+        if workbook.split_parts:
+            _write_index(workbook, fmts)
+        workbook.close()
+        tmp.seek(0)
+        shutil.copyfileobj(tmp, output)
+    output.seek(0)
+
+
+def _cell_values(values):
+    # Matriz de objetos pronta para write_row: nulos viram None (célula vazia, como no to_excel)
+    block = np.asarray(values, dtype=object)
+    if block.size:
+        block[pd.isna(block)] = None
+    return block
+
+
+def _sparse_labels(index):
+    """Níveis do índice como listas; rótulos repetidos dos níveis externos ficam vazios (como as células mescladas do to_excel)."""
+    if not isinstance(index, pd.MultiIndex):
+        return [_cell_values(index).tolist()]
+    arrays = [_cell_values(index.get_level_values(level)) for level in range(index.nlevels)]
+    changed = np.zeros(len(index), dtype=bool)
+    if len(index):
+        changed[0] = True
+    out = []
+    for level, values in enumerate(arrays):
+        if level < index.nlevels - 1:
+            changed[1:] |= values[1:] != values[:-1]
+            out.append(np.where(changed, values, None).tolist())
         else:
-            # Tenta adivinhar colunas de texto vs numero
-            for idx, col_name in enumerate(df.columns):
-                if col_name in ["Anunciante", "Anúncio", "Tipo de Veiculação", "Veículo", "Praça", "Linha"]:
-                    worksheet.set_column(idx, idx, 35, fmt_left)
+            out.append(values.tolist())
+    return out
+
+
+def _header_rows(df, n_idx):
+    # Linhas de cabeçalho que _write_sheet grava antes dos dados
+    if not isinstance(df.columns, pd.MultiIndex):
+        return 1
+    return df.columns.nlevels + (1 if n_idx and any(n is not None for n in df.index.names) else 0)
+
+
+def _write_sheet(workbook, fmts, sheet_name, df, n_idx):
+    """
+    Grava `df` numa nova aba no layout do `DataFrame.to_excel` (cabeçalho em negrito, níveis de
+    colunas em linhas próprias, índice à esquerda) com `write_row` linha a linha, convertendo
+    WRITE_CHUNK_ROWS linhas por vez para uma matriz NumPy.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    header = fmts['header']
+    row = 0
+
+    if isinstance(df.columns, pd.MultiIndex):
+        # Uma linha por nível das colunas; rótulos repetidos em sequência (dentro do mesmo pai) são mesclados
+        n_levels = df.columns.nlevels
+        changed = np.zeros(len(df.columns), dtype=bool)
+        changed[:1] = True
+        for level in range(n_levels):
+            if n_idx and df.columns.names[level] is not None:
+                worksheet.write(row, n_idx - 1, df.columns.names[level], header)
+            labels = _cell_values(df.columns.get_level_values(level))
+            if level < n_levels - 1:
+                changed[1:] |= labels[1:] != labels[:-1]
+            else:
+                changed[:] = True
+            starts = np.flatnonzero(changed)
+            ends = np.append(starts[1:], len(labels)) - 1
+            for first, last in zip(starts.tolist(), ends.tolist()):
+                if last > first:
+                    worksheet.merge_range(row, n_idx + first, row, n_idx + last, labels[first], header)
                 else:
-                    worksheet.set_column(idx, idx, 15, fmt_center)
+                    worksheet.write(row, n_idx + first, labels[first], header)
+            row += 1
+        if n_idx and any(n is not None for n in df.index.names):
+            worksheet.write_row(row, 0, [n if n is not None else None for n in df.index.names], header)
+            row += 1
+    else:
+        names = list(df.index.names) if n_idx else []
+        worksheet.write_row(row, 0, names + _cell_values(df.columns).tolist(), header)
+        row += 1
+
+    index_labels = _sparse_labels(df.index) if n_idx else []
+    report = _progress_callback.get()
+    n_rows = len(df)
+    for start in range(0, n_rows, WRITE_CHUNK_ROWS):
+        block = _cell_values(df.iloc[start:start + WRITE_CHUNK_ROWS].to_numpy()).tolist()
+        for i, values in enumerate(block, start):
+            if report is not None and i % PROGRESS_EVERY_ROWS == 0:
+                report(worksheet.name, i, n_rows)
+            for level, labels in enumerate(index_labels):
+                if labels[i] is not None:
+                    worksheet.write(row + i, level, labels[i], header)
+            worksheet.write_row(row + i, n_idx, values)
+    if report is not None:
+        report(worksheet.name, n_rows, n_rows)
+    return worksheet
+
+
+def _sheet_name(workbook, name):
+    """Nome de aba válido (sem []:*?/\\, até 31 caracteres) e ainda não usado no workbook."""
+    base = re.sub(r'[\[\]:*?/\\]', '-', str(name)).strip("'")[:31] or "Aba"
+    candidate, k = base, 2
+    while workbook.get_worksheet_by_name(candidate) is not None:
+        suffix = f" ({k})"
+        candidate, k = base[:31 - len(suffix)] + suffix, k + 1
+    return candidate
+
+
+def _dimension_groups(df, split_by):
+    """(valor, linhas de `df` com esse valor) para a coluna ou nível de índice `split_by`, na ordem de aparição."""
+    if split_by in df.index.names:
+        values = df.index.get_level_values(split_by)
+    else:
+        values = df[split_by]
+    codes, uniques = pd.factorize(np.asarray(values), use_na_sentinel=False)
+    order = np.argsort(codes, kind="stable")
+    ends = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+    for value, start, end in zip(uniques, np.append(0, ends[:-1]), ends):
+        yield value, df.iloc[order[start:end]]
+
+
+def _write_frame(workbook, fmts, name, df, include_index=False, keep_empty=False, split_by=None):
+    """
+    Grava `df` em uma aba (`_write_sheet`) ou, se passar dos limites do Excel, em várias: faixas
+    de linhas e/ou de colunas (o índice e o cabeçalho se repetem em cada parte). Com `split_by`
+    (coluna ou nível do índice), uma aba por valor, cada uma dividida de novo se ainda for grande.
+    Cada parte é recortada e gravada por vez; as divisões entram na aba de índice.
+    Retorna as abas (`_SheetParts`), ou None se `df` estiver vazio (a menos de `keep_empty`).
+    """
+    if df is None or (df.empty and not keep_empty):
+        return None
+    n_idx = df.index.nlevels if include_index else 0
+    row_step = EXCEL_MAX_ROWS - _header_rows(df, n_idx)
+    col_step = EXCEL_MAX_COLS - n_idx
+    groups = _dimension_groups(df, split_by) if split_by is not None else [(None, df)]
+
+    parts = _SheetParts()
+    for value, frame in groups:
+        row_ranges = [(r, min(r + row_step, len(frame))) for r in range(0, max(len(frame), 1), row_step)]
+        col_ranges = [(c, min(c + col_step, frame.shape[1])) for c in range(0, max(frame.shape[1], 1), col_step)]
+        whole = len(row_ranges) == 1 and len(col_ranges) == 1
+        for k, ((r0, r1), (c0, c1)) in enumerate(itertools.product(row_ranges, col_ranges), 1):
+            part = frame if whole else frame.iloc[r0:r1, c0:c1]
+            conteudo = []
+            if split_by is not None:
+                conteudo.append(f"{split_by} = {value}")
+            if len(row_ranges) > 1:
+                conteudo.append(f"linhas {r0 + 1:,} a {r1:,}".replace(",", "."))
+            if len(col_ranges) > 1:
+                conteudo.append(f"colunas {c0 + 1:,} a {c1:,}".replace(",", "."))
+
+            if not conteudo:
+                sheet = name[:31]  # Limite do Excel
+            elif split_by is not None and whole:
+                sheet = _sheet_name(workbook, value)
+            else:
+                label = value if split_by is not None else name
+                sheet = _sheet_name(workbook, f"{str(label)[:25]} ({k})")
+            parts.append(_write_sheet(workbook, fmts, sheet, part, n_idx))
+            if conteudo:
+                workbook.split_parts.append((sheet, name, ", ".join(conteudo), len(part)))
+    return parts
+
+
+def _write_index(workbook, fmts):
+    """Aba de índice: uma linha por parte das tabelas divididas, com link para a aba."""
+    worksheet = workbook.add_worksheet(_sheet_name(workbook, INDEX_SHEET))
+    worksheet.write_row(0, 0, ["Aba", "Tabela", "Conteúdo", "Linhas"], fmts['header'])
+    for i, (sheet, table, conteudo, n_rows) in enumerate(workbook.split_parts, 1):
+        sheet_ref = sheet.replace("'", "''")
+        worksheet.write_url(i, 0, f"internal:'{sheet_ref}'!A1", string=sheet)
+        worksheet.write_row(i, 1, [table, conteudo, n_rows])
+    worksheet.set_column('A:B', 30)
+    worksheet.set_column('C:C', 45)
+    worksheet.set_column('D:D', 12, fmts['center'])
+    worksheet.activate()
+
+
+def _write_filters(workbook, fmts, filters_info):
+    """Aba 'Filtros' com os parâmetros da exportação."""
+    return _write_frame(workbook, fmts, 'Filtros', pd.DataFrame({
+        "Parâmetro": list(filters_info.keys()),
+        "Valor": list(filters_info.values())
+    }), keep_empty=True)
+
+
+def _save_tab(workbook, fmts, df, name, include_index=True):
+    """Função auxiliar para salvar abas com formatação padrão."""
+    worksheet = _write_frame(workbook, fmts, name, df, include_index)
+    if worksheet is None:
+        return
+
+    # Formatação básica
+    if include_index:
+        worksheet.set_column('A:A', 40, fmts['left']) # Index column
+        worksheet.set_column('B:Z', 15, fmts['center'])
+    else:
+        # Tenta adivinhar colunas de texto vs numero
+        for idx, col_name in enumerate(df.columns):
+            if col_name in TEXT_COLUMNS:
+                worksheet.set_column(idx, idx, 35, fmts['left'])
+            else:
+                worksheet.set_column(idx, idx, 15, fmts['center'])
+
+
+def _format_detail(worksheet, fmts, df):
+    # Aba de detalhamento: textos largos, anunciante/anúncio à esquerda
+    for idx, col in enumerate(df.columns):
+        width = 35 if col in ["Anunciante", "Anúncio", "Tipo de Veiculação"] else 15
+        align = fmts['left'] if col in ["Anunciante", "Anúncio"] else fmts['center']
+        worksheet.set_column(idx, idx, width, align)
+
 
 def generate_campaign_flow_excel(dfs_dict, filters_info):
     """Gera Excel para Campaign Flow"""
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        pd.DataFrame({
-            "Parâmetro": list(filters_info.keys()),
-            "Valor": list(filters_info.values())
-        }).to_excel(writer, sheet_name='Filtros', index=False)
-        writer.sheets['Filtros'].set_column('A:B', 40)
-
-        _save_tab(writer, dfs_dict.get('exclusivos'), 'Exclusivos')
-        _save_tab(writer, dfs_dict.get('comp_vol'), 'Comp. (Volume)')
-        _save_tab(writer, dfs_dict.get('comp_share'), 'Comp. (Share)')
-        _save_tab(writer, dfs_dict.get('ausentes_vol'), 'Ausentes (Volume)')
-        _save_tab(writer, dfs_dict.get('ausentes_share'), 'Ausentes (Share)')
-        _save_tab(writer, dfs_dict.get('detalhe'), 'Detalhamento', include_index=False)
+    with _streaming_workbook(output) as (workbook, fmts):
+        _write_filters(workbook, fmts, filters_info).set_column('A:B', 40)
+
+        _save_tab(workbook, fmts, dfs_dict.get('exclusivos'), 'Exclusivos')
+        _save_tab(workbook, fmts, dfs_dict.get('comp_vol'), 'Comp. (Volume)')
+        _save_tab(workbook, fmts, dfs_dict.get('comp_share'), 'Comp. (Share)')
+        _save_tab(workbook, fmts, dfs_dict.get('ausentes_vol'), 'Ausentes (Volume)')
+        _save_tab(workbook, fmts, dfs_dict.get('ausentes_share'), 'Ausentes (Share)')
+        _save_tab(workbook, fmts, dfs_dict.get('detalhe'), 'Detalhamento', include_index=False)
+
+    return output
+
+def generate_overlap_matrix_excel(dfs_dict, filters_info):
+    """Gera Excel para Overlap Matrix"""
+    output = io.BytesIO()
+    with _streaming_workbook(output) as (workbook, fmts):
+        _write_filters(workbook, fmts, filters_info).set_column('A:B', 40)
+
+        _save_tab(workbook, fmts, dfs_dict.get('anunciantes'), 'Anunciantes Compartilhados')
+        _save_tab(workbook, fmts, dfs_dict.get('insercoes'), 'Inserções Compartilhadas')
+        _save_tab(workbook, fmts, dfs_dict.get('jaccard'), 'Jaccard')
+        _save_tab(workbook, fmts, dfs_dict.get('par'), 'Detalhe do Par', include_index=False)
 
-    output.seek(0)
     return output
 
 def generate_opportunity_radar_excel(dfs_dict, filters_info):
     """Gera Excel para Opportunity Radar"""
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        pd.DataFrame({
-            "Parâmetro": list(filters_info.keys()),
-            "Valor": list(filters_info.values())
-        }).to_excel(writer, sheet_name='Filtros', index=False)
-        writer.sheets['Filtros'].set_column('A:B', 40)
+    with _streaming_workbook(output) as (workbook, fmts):
+        _write_filters(workbook, fmts, filters_info).set_column('A:B', 40)
 
-        _save_tab(writer, dfs_dict.get('overview'), 'Visão Geral', include_index=True)
-        _save_tab(writer, dfs_dict.get('detail'), 'Detalhamento', include_index=False)
+        _save_tab(workbook, fmts, dfs_dict.get('overview'), 'Visão Geral', include_index=True)
+        _save_tab(workbook, fmts, dfs_dict.get('detail'), 'Detalhamento', include_index=False)
 
-    output.seek(0)
     return output
 
 def generate_presence_map_excel(dfs_dict, filters_info):
     """Gera Excel para Presence Map"""
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        workbook = writer.book
-        fmt_center = workbook.add_format({'align': 'center', 'valign': 'vcenter'})
-        fmt_left = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
-
-        pd.DataFrame({
-            "Parâmetro": list(filters_info.keys()),
-            "Valor": list(filters_info.values())
-        }).to_excel(writer, sheet_name='Filtros', index=False)
-        writer.sheets['Filtros'].set_column('A:B', 40)
-        
+    with _streaming_workbook(output) as (workbook, fmts):
+        _write_filters(workbook, fmts, filters_info).set_column('A:B', 40)
+
         df_map = dfs_dict.get('map')
-        if df_map is not None and not df_map.empty:
-            df_map.to_excel(writer, sheet_name='Presence Map', index=False)
-            ws_mapa = writer.sheets['Presence Map']
-            
-            has_tipo = "Tipo de Veiculação" in df_map.columns
-            if not has_tipo:
-                ws_mapa.set_column('A:A', 40, fmt_left)
-                ws_mapa.set_column('B:Z', 8, fmt_center)
-            else:
-                ws_mapa.set_column('A:A', 40, fmt_left)   
-                ws_mapa.set_column('B:B', 20, fmt_center) 
-                ws_mapa.set_column('C:Z', 8, fmt_center)
+        ws_mapa = _write_frame(workbook, fmts, 'Presence Map', df_map)
+        if ws_mapa is not None:
+            # Colunas de rótulo (Anunciante/Veículo + Tipo/Anunciante) antes das colunas do período
+            n_labels = sum(1 for c in df_map.columns if c in ("Anunciante", "Veículo", "Tipo de Veiculação"))
+            ws_mapa.set_column(0, 0, 40, fmts['left'])
+            if n_labels > 1:
+                ws_mapa.set_column(1, n_labels - 1, 20, fmts['center'])
+            ws_mapa.set_column(n_labels, len(df_map.columns) - 1, 8, fmts['center'])
 
         df_det = dfs_dict.get('detail')
-        if df_det is not None and not df_det.empty:
-            df_det.to_excel(writer, sheet_name='Detalhamento', index=False)
-            ws_det = writer.sheets['Detalhamento']
-            for idx, col in enumerate(df_det.columns):
-                width = 35 if col in ["Anunciante", "Anúncio", "Tipo de Veiculação"] else 15
-                align = fmt_left if col in ["Anunciante", "Anúncio"] else fmt_center
-                ws_det.set_column(idx, idx, width, align)
+        ws_det = _write_frame(workbook, fmts, 'Detalhamento', df_det)
+        if ws_det is not None:
+            _format_detail(ws_det, fmts, df_det)
 
-    output.seek(0)
     return output
 
 def generate_performance_index_excel(dfs_dict, filters_info):
     """Gera Excel para Performance Index"""
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        workbook = writer.book
-        fmt_center = workbook.add_format({'align': 'center', 'valign': 'vcenter'})
-        fmt_left = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
-
-        pd.DataFrame({
-            "Parâmetro": list(filters_info.keys()),
-            "Valor": list(filters_info.values())
-        }).to_excel(writer, sheet_name='Filtros', index=False)
-        writer.sheets['Filtros'].set_column('A:A', 30)
-        writer.sheets['Filtros'].set_column('B:B', 50)
+    with _streaming_workbook(output) as (workbook, fmts):
+        ws_filtros = _write_filters(workbook, fmts, filters_info)
+        ws_filtros.set_column('A:A', 30)
+        ws_filtros.set_column('B:B', 50)
 
         df_rank = dfs_dict.get('ranking')
-        if df_rank is not None and not df_rank.empty:
-            df_rank.to_excel(writer, sheet_name='Ranking', index=False)
-            ws_rank = writer.sheets['Ranking']
-            ws_rank.set_column('A:B', 10, fmt_center)
-            ws_rank.set_column('C:C', 40, fmt_left)
-            ws_rank.set_column('D:G', 15, fmt_center)
+        ws_rank = _write_frame(workbook, fmts, 'Ranking', df_rank)
+        if ws_rank is not None:
+            ws_rank.set_column('A:B', 10, fmts['center'])
+            ws_rank.set_column('C:C', 40, fmts['left'])
+            ws_rank.set_column(3, max(len(df_rank.columns) - 1, 3), 15, fmts['center'])
+
+        # Ranking nacional: uma aba por praça (a primeira é o total nacional)
+        for name, df_praca in (dfs_dict.get('rankings') or {}).items():
+            if df_praca is None or df_praca.empty: continue
+            # Nomes que colidem (mesmos 31 caracteres, "Ranking", "Filtros"...) ganham sufixo: nenhuma praça some
+            ws_praca = _write_frame(workbook, fmts, _sheet_name(workbook, name), df_praca)
+            ws_praca.set_column('A:B', 10, fmts['center'])
+            ws_praca.set_column('C:C', 40, fmts['left'])
+            ws_praca.set_column(3, max(len(df_praca.columns) - 1, 3), 15, fmts['center'])
+
+        # Trajetória: posição por semana (linhas = anunciantes na ordem do ranking)
+        df_traj = dfs_dict.get('trajectory')
+        ws_traj = _write_frame(workbook, fmts, 'Trajetória Semanal', df_traj)
+        if ws_traj is not None:
+            ws_traj.set_column('A:A', 40, fmts['left'])
+            ws_traj.set_column(1, max(len(df_traj.columns) - 1, 1), 8, fmts['center'])
+
+        # Comparação multi-período: volumes por período + posições e situação do par escolhido
+        df_multi = dfs_dict.get('multi_period')
+        ws_multi = _write_frame(workbook, fmts, 'Multi-Período', df_multi)
+        if ws_multi is not None:
+            ws_multi.set_column('A:A', 40, fmts['left'])
+            ws_multi.set_column(1, len(df_multi.columns) - 1, 14, fmts['center'])
 
         df_det = dfs_dict.get('detail')
-        if df_det is not None and not df_det.empty:
-            df_det.to_excel(writer, sheet_name='Detalhamento', index=False)
-            ws_det = writer.sheets['Detalhamento']
-            for idx, col in enumerate(df_det.columns):
-                width = 35 if col in ["Anunciante", "Anúncio", "Tipo de Veiculação"] else 15
-                align = fmt_left if col in ["Anunciante", "Anúncio"] else fmt_center
-                ws_det.set_column(idx, idx, width, align)
+        ws_det = _write_frame(workbook, fmts, 'Detalhamento', df_det)
+        if ws_det is not None:
+            _format_detail(ws_det, fmts, df_det)
 
-    output.seek(0)
     return output
 
-def generate_custom_report_excel(df, filters_info):
-    """Gera Excel para Relatório Personalizado"""
+def generate_yoy_excel(dfs_dict, filters_info):
+    """Gera Excel para YoY Comparison"""
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        workbook = writer.book
-        fmt_center = workbook.add_format({'align': 'center', 'valign': 'vcenter'})
-        fmt_left = workbook.add_format({'align': 'left', 'valign': 'vcenter'})
+    with _streaming_workbook(output) as (workbook, fmts):
+        ws_filtros = _write_filters(workbook, fmts, filters_info)
+        ws_filtros.set_column('A:A', 30)
+        ws_filtros.set_column('B:B', 50)
 
+        df_comp = dfs_dict.get('comparison')
+        ws_comp = _write_frame(workbook, fmts, 'Comparação', df_comp)
+        if ws_comp is not None:
+            for idx, col in enumerate(df_comp.columns):
+                if col in ["Anunciante", "Veículo"]:
+                    ws_comp.set_column(idx, idx, 40, fmts['left'])
+                else:
+                    ws_comp.set_column(idx, idx, 15, fmts['center'])
+
+    return output
+
+def generate_custom_report_excel(df, filters_info, split_by=None):
+    """Gera Excel para Relatório Personalizado (`split_by`: nível das linhas com uma aba por valor)"""
+    output = io.BytesIO()
+    with _streaming_workbook(output) as (workbook, fmts):
         # 1. Filtros
-        pd.DataFrame({
-            "Parâmetro": list(filters_info.keys()),
-            "Valor": list(filters_info.values())
-        }).to_excel(writer, sheet_name='Filtros', index=False)
-        writer.sheets['Filtros'].set_column('A:A', 30)
-        writer.sheets['Filtros'].set_column('B:B', 50)
+        ws_filtros = _write_filters(workbook, fmts, filters_info)
+        ws_filtros.set_column('A:A', 30)
+        ws_filtros.set_column('B:B', 50)
 
         # 2. Relatório
-        if df is not None and not df.empty:
-            df.to_excel(writer, sheet_name='Relatório Personalizado')
-            ws = writer.sheets['Relatório Personalizado']
-            
+        ws = _write_frame(workbook, fmts, 'Relatório Personalizado', df, include_index=True, split_by=split_by)
+        if ws is not None:
             # Formatação Automática Básica (Index em negrito à esquerda, Dados centralizados)
-            ws.set_column('A:A', 30, fmt_left) # Index principal
-            ws.set_column('B:Z', 15, fmt_center)
+            ws.set_column('A:A', 30, fmts['left']) # Index principal
+            ws.set_column('B:Z', 15, fmts['center'])
+
+    return output
+
+
+# --- Formatos colunares (Parquet / CSV.gz) ---
+
+def _flat_table(df):
+    """Tabela plana: índice nomeado vira coluna(s) e colunas multinível viram 'nível 1 | nível 2'."""
+    out = df
+    if not isinstance(df.index, pd.RangeIndex) or any(n is not None for n in df.index.names):
+        out = out.reset_index()
+    if isinstance(out.columns, pd.MultiIndex):
+        out = out.copy(deep=False)
+        out.columns = [" | ".join(str(p) for p in col if str(p) != "") for col in out.columns]
+    else:
+        out = out.rename(columns=str)
+    return out
+
+
+def export_metadata(filters_info, table_name, df):
+    """Mesmos parâmetros da aba 'Filtros', mais tabela, data de geração e colunas."""
+    return {
+        "tabela": table_name,
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "filtros": {str(k): str(v) for k, v in filters_info.items()},
+        "linhas": int(len(df)),
+        "colunas": [str(c) for c in _flat_table(df).columns],
+    }
+
+
+def generate_metadata_json(filters_info, table_name, df):
+    """Arquivo JSON com os metadados da exportação (acompanha o CSV.gz)."""
+    meta = export_metadata(filters_info, table_name, df)
+    return io.BytesIO(json.dumps(meta, ensure_ascii=False, indent=2).encode("utf-8"))
 
+
+def _arrow_table(df):
+    # Colunas de objeto com tipos misturados (ex.: linha TOTAL com texto) viram texto
+    flat = _flat_table(df)
+    for col in flat.columns[flat.dtypes == object]:
+        try:
+            pa.array(flat[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            flat = flat.assign(**{col: flat[col].map(lambda v: None if pd.isna(v) else str(v))})
+    return pa.Table.from_pandas(flat, preserve_index=False)
+
+
+def generate_parquet(df, filters_info, table_name):
+    """Parquet (zstd) direto da tabela Arrow, com os filtros nos metadados do arquivo."""
+    table = _arrow_table(df)
+    meta = json.dumps(export_metadata(filters_info, table_name, df), ensure_ascii=False).encode("utf-8")
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), PARQUET_METADATA_KEY: meta})
+    output = io.BytesIO()
+    pq.write_table(table, output, compression="zstd")
     output.seek(0)
-    return output
\ No newline at end of file
+    return output
+
+
+def generate_csv_gz(df, filters_info, table_name):
+    """
+    CSV (UTF-8, separador vírgula) compactado em gzip, escrito em blocos de CSV_CHUNK_ROWS linhas
+    direto no compressor — o CSV inteiro nunca existe como texto em memória. Os filtros vão no
+    JSON que acompanha o arquivo (`generate_metadata_json`).
+    """
+    flat = _flat_table(df)
+    output = io.BytesIO()
+    with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=6) as gz:
+        text = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        for start in range(0, max(len(flat), 1), CSV_CHUNK_ROWS):
+            flat.iloc[start:start + CSV_CHUNK_ROWS].to_csv(text, index=False, header=start == 0)
+        text.flush()
+        text.detach()
+    output.seek(0)
+    return output
+
@@ -0,0 +1,134 @@
+# utils/export_jobs.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils.export_cache import cached_export, export_cache_key, has_cached_export, read_cached_export
+from utils.export_crowley import export_progress
+
+# Geração de arquivos fora da thread da sessão: poucos workers (cada Excel grande já é pesado)
+EXPORT_WORKERS = 2
+# Jobs concluídos ficam disponíveis por este tempo (depois disso o arquivo ainda está no cache em disco)
+JOB_TTL_SECONDS = 15 * 60
+
+STATUS_FILA = "Na fila"
+STATUS_GERANDO = "Gerando"
+STATUS_PRONTO = "Pronto"
+STATUS_ERRO = "Erro"
+
+
+class ExportJob:
+    """
+    Uma exportação em andamento: estado, aba/linha atual e, ao final, o erro. O arquivo pronto
+    fica no cache em disco (utils.export_cache); `data` só guarda o que não coube lá.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.status = STATUS_FILA
+        self.sheet = None
+        self.rows = 0
+        self.total_rows = 0
+        self.sheets_done = 0
+        self.data = None
+        self.error = None
+        self.finished_at = None
+
+    def report(self, sheet, rows, total_rows):
+        # Chamado pela thread do worker (export_progress); a sessão só lê estes campos
+        if sheet != self.sheet:
+            if self.sheet is not None:
+                self.sheets_done += 1
+            self.sheet = sheet
+        self.rows, self.total_rows = rows, total_rows
+
+    @property
+    def done(self):
+        return self.status in (STATUS_PRONTO, STATUS_ERRO)
+
+    def file(self):
+        """Bytes do arquivo pronto (lidos do cache em disco), ou None se já saiu do cache."""
+        if self.data is not None:
+            return self.data
+        cached = read_cached_export(self.key)
+        return cached.getvalue() if cached is not None else None
+
+    @property
+    def fraction(self):
+        if self.status == STATUS_PRONTO:
+            return 1.0
+        return self.rows / self.total_rows if self.total_rows else 0.0
+
+    def describe(self):
+        if self.status != STATUS_GERANDO or self.sheet is None:
+            return f"{self.status}..."
+        return (
+            f"Aba '{self.sheet}': {self.rows:,} de {self.total_rows:,} linhas "
+            f"({self.sheets_done} aba(s) concluída(s))".replace(",", ".")
+        )
+
+
+class _JobRegistry:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def prune(self):
+        limite = time.time() - JOB_TTL_SECONDS
+        for key in [k for k, job in self.jobs.items()
+                    if job.done and job.finished_at is not None and job.finished_at < limite]:
+            del self.jobs[key]
+
+
+@st.cache_resource
+def _registry():
+    # Um registro por processo: jobs iguais de sessões diferentes são o mesmo job
+    return _JobRegistry()
+
+
+def _run(job, df, signature, fmt, build, table):
+    job.status = STATUS_GERANDO
+    status = STATUS_ERRO
+    try:
+        with export_progress(job.report):
+            buffer = cached_export(df, signature, fmt, build, table)
+        # Os bytes ficam no cache em disco; só o que não foi gravado lá (grande demais, falha de disco) fica no job
+        if not has_cached_export(job.key):
+            job.data = buffer.getvalue()
+        status = STATUS_PRONTO
+    except MemoryError:
+        job.error = "a exportação excedeu a memória disponível. Reduza o tamanho do relatório."
+    except Exception as exc:
+        job.error = str(exc) or exc.__class__.__name__
+    finally:
+        # Horário antes do status: um job concluído (job.done) sempre tem finished_at para o prune
+        job.finished_at = time.time()
+        job.status = status
+
+
+def submit_export(df, signature, fmt, build, table=None):
+    """
+    Job da exportação (mesma chave do cache em disco). Se já existe um job para ela — na fila,
+    gerando ou pronto — devolve esse; um job com erro, ou pronto cujo arquivo já saiu do cache
+    em disco, é substituído por uma nova tentativa.
+    `build` roda num worker: não pode chamar funções do Streamlit.
+    """
+    key = export_cache_key(df, signature, fmt, table)
+    registry = _registry()
+    with registry.lock:
+        registry.prune()
+        job = registry.jobs.get(key)
+        expirado = job is not None and job.status == STATUS_PRONTO and job.data is None and not has_cached_export(key)
+        if job is None or job.status == STATUS_ERRO or expirado:
+            job = ExportJob(key)
+            registry.jobs[key] = job
+            registry.executor.submit(_run, job, df, signature, fmt, build, table)
+    return job
+
+
+def get_job(key):
+    """Job pela chave, ou None se expirou."""
+    return _registry().jobs.get(key)
@@ -0,0 +1,158 @@
+# utils/export_ui.py
+import re
+
+import streamlit as st
+
+from utils.export_cache import cached_export
+from utils.export_crowley import generate_csv_gz, generate_metadata_json, generate_parquet
+from utils.export_jobs import STATUS_ERRO, get_job, submit_export
+
+FORMATO_EXCEL = "Excel (.xlsx)"
+FORMATO_PARQUET = "Parquet (.parquet)"
+FORMATO_CSV = "CSV compactado (.csv.gz)"
+EXPORT_FORMATS = [FORMATO_EXCEL, FORMATO_PARQUET, FORMATO_CSV]
+
+# Intervalo de atualização do andamento de um job de exportação (segundos)
+JOB_POLL_SECONDS = 1
+
+# Botão de download azul/branco dentro do diálogo (mesmo estilo das páginas)
+DOWNLOAD_BUTTON_CSS = """
+    <style>
+    div[data-testid="stDialog"] button[kind="primary"] {
+        background-color: #007bff !important;
+        border-color: #007bff !important;
+        color: white !important;
+    }
+    div[data-testid="stDialog"] button[kind="primary"]:hover {
+        background-color: #0056b3 !important;
+        border-color: #0056b3 !important;
+        color: white !important;
+    }
+    div[data-testid="stDialog"] button[kind="primary"] * {
+        color: white !important;
+    }
+    </style>
+"""
+
+
+def export_format_radio(key):
+    """Escolha do formato no diálogo de exportação (Excel é o padrão)."""
+    return st.radio("Formato", EXPORT_FORMATS, horizontal=True, key=key)
+
+
+def columnar_export(tables, filters_info, file_stem, fmt, on_click, key, df_base=None, signature=None):
+    """
+    Exportação em Parquet ou CSV.gz de uma das tabelas do diálogo, sem formatação por célula.
+
+    `tables` = {rótulo: DataFrame}, na ordem de preferência (o detalhamento primeiro).
+    O Parquet leva os filtros nos metadados do arquivo; o CSV.gz, num JSON à parte.
+    Com `df_base` e `signature` (export_signature), o arquivo passa pelo cache de exportações.
+    """
+    disponiveis = {nome: df for nome, df in tables.items() if df is not None and not df.empty}
+    if not disponiveis:
+        st.info("Não há dados para exportar.")
+        return
+
+    nome = st.selectbox("Tabela", list(disponiveis.keys()), key=f"{key}_tabela")
+    df = disponiveis[nome]
+    sufixo = re.sub(r"[^0-9A-Za-z]+", "_", nome).strip("_")
+
+    if fmt == FORMATO_PARQUET:
+        generate, extensao, mime = generate_parquet, "parquet", "application/vnd.apache.parquet"
+    else:
+        generate, extensao, mime = generate_csv_gz, "csv.gz", "application/gzip"
+
+    with st.spinner("Processando dados..."):
+        if signature is not None:
+            buffer = cached_export(df_base, signature, fmt, lambda: generate(df, filters_info, nome), table=nome)
+        else:
+            buffer = generate(df, filters_info, nome)
+
+    st.success("Arquivo pronto!")
+    st.markdown(DOWNLOAD_BUTTON_CSS, unsafe_allow_html=True)
+
+    if fmt == FORMATO_CSV:
+        # Não fecha o diálogo: o arquivo principal ainda pode ser baixado em seguida
+        st.download_button(
+            label="Baixar Filtros (.json)",
+            data=generate_metadata_json(filters_info, nome, df),
+            file_name=f"{file_stem}_{sufixo}.json",
+            mime="application/json",
+            use_container_width=True,
+            on_click="ignore",
+            key=f"{key}_json",
+        )
+
+    st.download_button(
+        label="Baixar Arquivo",
+        data=buffer,
+        file_name=f"{file_stem}_{sufixo}.{extensao}",
+        mime=mime,
+        type="primary",
+        use_container_width=True,
+        on_click=on_click,
+        key=f"{key}_download",
+    )
+
+
+def background_excel_export(df_base, signature, build, file_name, mime, key, on_done=None):
+    """
+    Excel gerado num worker (utils.export_jobs) em vez de travar a sessão dentro do diálogo.
+    O job fica em `st.session_state[f"{key}_job"]`: fechado o diálogo, a página segue usável
+    e `export_job_panel(key)` mostra o andamento e, ao final, o download.
+    """
+    job = submit_export(df_base, signature, FORMATO_EXCEL, build)
+    st.session_state[f"{key}_job"] = {"job": job.key, "file_name": file_name, "mime": mime}
+    export_job_panel(key, on_done, hint="Você pode fechar esta janela: a geração continua e o download aparece na página.")
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def _job_progress(job_key, hint):
+    # Só este trecho reroda enquanto o job anda; ao terminar, a página inteira reroda e mostra o download
+    job = get_job(job_key)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.fraction, text=job.describe())
+    if hint:
+        st.caption(hint)
+
+
+def export_job_panel(key, on_done=None, hint=None):
+    """Andamento / resultado do job de exportação da sessão guardado em `f"{key}_job"` (nada se não houver)."""
+    info = st.session_state.get(f"{key}_job")
+    if not info:
+        return
+    job = get_job(info["job"])
+    if job is None:
+        st.session_state.pop(f"{key}_job", None)
+        st.info("A exportação expirou. Gere o arquivo novamente.")
+        return
+    if not job.done:
+        _job_progress(info["job"], hint)
+        return
+    if job.status == STATUS_ERRO:
+        st.error(f"Falha ao gerar o Excel: {job.error}")
+        return
+    data = job.file()
+    if data is None:
+        st.session_state.pop(f"{key}_job", None)
+        st.info("A exportação expirou. Gere o arquivo novamente.")
+        return
+
+    def _baixado():
+        st.session_state.pop(f"{key}_job", None)
+        if on_done is not None:
+            on_done()
+
+    st.success("Arquivo pronto!")
+    st.markdown(DOWNLOAD_BUTTON_CSS, unsafe_allow_html=True)
+    st.download_button(
+        label="Baixar Arquivo",
+        data=data,
+        file_name=info["file_name"],
+        mime=info["mime"],
+        type="primary",
+        use_container_width=True,
+        on_click=_baixado,
+        key=f"{key}_job_download",
+    )
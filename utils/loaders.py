@@ -1,16 +1,27 @@
 # utils/loaders.py
 import os
 import gc
+import json
 import time
+import weakref
 import pandas as pd
 import streamlit as st
 import pyarrow.parquet as pq
 import pyarrow as pa
+from contextlib import contextmanager
 from datetime import datetime
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
+from utils.shared_frame import write_frame, map_frame
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 # --- CONFIGURAÇÃO ---
 DATA_FOLDER = "data"
 if not os.path.exists(DATA_FOLDER):
@@ -63,8 +74,163 @@ def download_file(service, file_id, dest_path):
 # LOADER CROWLEY
 # ==========================================
 
+# Base compartilhada entre processos: o primeiro processo que precisa da base baixa, tipa e
+# publica um snapshot Arrow (utils/shared_frame); os demais — outras réplicas do app no mesmo
+# host, workers do offload — só mapeiam o arquivo. As colunas são páginas do mesmo arquivo,
+# então a RAM da base não se multiplica pelo número de processos.
+SHARED_FOLDER = os.path.join(DATA_FOLDER, "shared")
+SHARED_POINTER = os.path.join(SHARED_FOLDER, "current.json")
+SHARED_LOCK = os.path.join(SHARED_FOLDER, ".lock")
+# Idade máxima do snapshot publicado (mesmo ttl do cache da base)
+SHARED_MAX_AGE_SECONDS = 3600
+
+# Frames mapeados por este processo (base e derivados): id(df) -> (weakref do df, caminho do arquivo)
+_mapped_bases = {}
+
+@contextmanager
+def _file_lock(path):
+    """Lock exclusivo entre processos (um só processo baixa/publica a base por vez)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK desiste depois de ~10s; o download pode levar mais
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    # Troca atômica (os.replace): quem lê vê o arquivo anterior ou o novo, nunca um pela metade
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _read_shared_pointer():
+    atual = _read_json(SHARED_POINTER)
+    if atual is None or not os.path.exists(os.path.join(SHARED_FOLDER, atual.get("arquivo", ""))):
+        return None
+    return atual
+
+def publish_shared_base(df, ultima):
+    """
+    Grava `df` como novo snapshot compartilhado e troca o ponteiro (os.replace, atômico).
+    Snapshots anteriores e seus derivados são apagados: quem ainda os mapeia segue lendo até recarregar.
+    """
+    arquivo = f"crowley-{int(time.time() * 1000)}-{os.getpid()}.arrow"
+    write_frame(df, os.path.join(SHARED_FOLDER, arquivo))
+
+    atual = {"versao": df.attrs.get("dataset_version"), "arquivo": arquivo, "ultima": ultima, "publicado_em": time.time()}
+    _write_json(SHARED_POINTER, atual)
+
+    derivados = os.path.splitext(arquivo)[0] + "--"
+    for entry in os.scandir(SHARED_FOLDER):
+        if entry.name.startswith("crowley-") and entry.name != arquivo and not entry.name.startswith(derivados):
+            try: os.remove(entry.path)
+            except OSError: pass  # Windows: ainda mapeado por outro processo; sai na próxima troca
+    return atual
+
+def map_shared_base(atual):
+    """Base mapeada do snapshot `atual` (colunas somente leitura, compartilhadas entre processos)."""
+    path = os.path.join(SHARED_FOLDER, atual["arquivo"])
+    df = map_frame(path)
+    # Mesma versão em todos os processos: chaves de cache derivadas batem entre réplicas
+    df.attrs["dataset_version"] = atual["versao"]
+    _register_mapped(df, path)
+    return df, atual["ultima"]
+
+def _register_mapped(df, path):
+    for key in [k for k, (ref, _) in _mapped_bases.items() if ref() is None]:
+        del _mapped_bases[key]
+    _mapped_bases[id(df)] = (weakref.ref(df), path)
+
+def shared_base_path(df):
+    """Caminho do arquivo compartilhado se `df` é a base (ou um derivado) mapeada, não uma cópia/recorte."""
+    entry = _mapped_bases.get(id(df))
+    if entry is not None and entry[0]() is df:
+        return entry[1]
+    return None
+
+def shared_derived(df, name, build):
+    """
+    Frames derivados da base (`build(df)` → dict nome → DataFrame: rollups, índices...) publicados
+    ao lado do snapshot de `df`, com o mesmo prefixo: o primeiro processo calcula e grava, os demais
+    só mapeiam. Saem do diretório junto com o snapshot quando a base é trocada. Se `df` não é a
+    base mapeada (cópia própria deste processo), calcula só para este processo.
+    Os frames mapeados são somente leitura, como a base.
+    """
+    base_path = shared_base_path(df)
+    if base_path is None:
+        return build(df)
+    prefix = f"{os.path.splitext(base_path)[0]}--{name}"
+    try:
+        # Lock por derivado: montar rollups não segura a carga da base em outros processos
+        with _file_lock(prefix + ".lock"):
+            if not os.path.exists(base_path):
+                return build(df)  # base já trocada por outro processo: não deixa derivados órfãos
+            manifesto = _read_json(prefix + ".json")
+            if manifesto is None:
+                frames = build(df)
+                manifesto = {}
+                for i, (key, frame) in enumerate(frames.items()):
+                    arquivo = f"{os.path.basename(prefix)}-{i}.arrow"
+                    write_frame(frame, os.path.join(SHARED_FOLDER, arquivo))
+                    manifesto[key] = arquivo
+                # Manifesto por último: se existe, todos os arquivos estão completos
+                _write_json(prefix + ".json", manifesto)
+                del frames
+                gc.collect()
+        mapped = {}
+        for key, arquivo in manifesto.items():
+            path = os.path.join(SHARED_FOLDER, arquivo)
+            mapped[key] = map_frame(path)
+            mapped[key].attrs["dataset_version"] = dataset_version(df)
+            _register_mapped(mapped[key], path)
+        return mapped
+    except (OSError, ValueError, KeyError, pa.ArrowException):
+        return build(df)
+
 @st.cache_resource(ttl=3600, show_spinner="Atualizando Base Crowley...")
 def load_crowley_base():
+    # Só um processo por vez baixa; quem chega depois encontra o snapshot pronto e só mapeia
+    with _file_lock(SHARED_LOCK):
+        atual = _read_shared_pointer()
+        if atual is None or time.time() - atual["publicado_em"] > SHARED_MAX_AGE_SECONDS:
+            df, ultima = _download_crowley_base()
+            if df is None:
+                return df, ultima
+            try:
+                atual = publish_shared_base(df, ultima)
+            except (OSError, pa.ArrowException):
+                # Sem disco para o snapshot: segue com a cópia própria deste processo
+                return df, ultima
+            del df
+            gc.collect()
+    try:
+        return map_shared_base(atual)
+    except (OSError, ValueError, KeyError, pa.ArrowException):
+        return None, "Erro Leitura"
+
+def _download_crowley_base():
     # 1. Limpeza Prévia
     nuke_and_prepare([PATH_CROWLEY])
     
@@ -80,45 +246,61 @@ def load_crowley_base():
 
     # 3. Leitura Otimizada (Self Destruct)
     try:
-        gc.collect()
-        # Lê usando memory map
-        arrow_table = pq.read_table(PATH_CROWLEY, memory_map=True)
-        # Converte para Pandas limpando o PyArrow da memória
-        df = arrow_table.to_pandas(self_destruct=True, split_blocks=True)
-        
-        del arrow_table
-        gc.collect()
-        
-        # 4. Otimização de Tipos (Redução de RAM)
-        cat_cols = ["Praca", "Emissora", "Anunciante", "Anuncio", "Tipo", "DayPart"]
-        for col in cat_cols:
-            if col in df.columns:
-                df[col] = df[col].astype("category")
-
-        num_cols = ["Volume de Insercoes", "Duracao"]
-        for col in num_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype("int32")
-
-        # Tratamento de Data
-        ultima = "N/A"
-        if "Data" in df.columns:
-            df["Data_Dt"] = pd.to_datetime(df["Data"], dayfirst=True, errors="coerce")
-            try:
-                m = df["Data_Dt"].max()
-                if pd.notna(m): ultima = m.strftime("%d/%m/%Y")
-            except: pass
-            
-            # Remove coluna original de texto para economizar memória
-            df.drop(columns=["Data"], inplace=True) 
+        return read_crowley_file(PATH_CROWLEY)
+    except Exception:
+        if os.path.exists(PATH_CROWLEY): os.remove(PATH_CROWLEY)
+        return None, "Erro Leitura"
 
-        # Se não achou data na coluna, tenta data do arquivo
-        if ultima == "N/A" and os.path.exists(PATH_CROWLEY):
-             ts = os.path.getmtime(PATH_CROWLEY)
-             ultima = datetime.fromtimestamp(ts).strftime("%d/%m/%Y")
+def read_crowley_file(path, columns=None):
+    """
+    Lê um parquet da base Crowley (o snapshot baixado em PATH_CROWLEY ou um arquivo local) com a
+    mesma otimização de tipos do app. Sem Streamlit: usado também pelo batch_reports.py.
+    Devolve (df, data da última atualização); exceções de leitura sobem para quem chamou.
+    """
+    gc.collect()
+    # Lê usando memory map
+    arrow_table = pq.read_table(path, columns=columns, memory_map=True)
+    # Converte para Pandas limpando o PyArrow da memória
+    df = arrow_table.to_pandas(self_destruct=True, split_blocks=True)
 
-        return df, ultima
+    del arrow_table
+    gc.collect()
 
-    except Exception:
-        if os.path.exists(PATH_CROWLEY): os.remove(PATH_CROWLEY)
-        return None, "Erro Leitura"
\ No newline at end of file
+    # 4. Otimização de Tipos (Redução de RAM)
+    cat_cols = ["Praca", "Emissora", "Anunciante", "Anuncio", "Tipo", "DayPart"]
+    for col in cat_cols:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    num_cols = ["Volume de Insercoes", "Duracao"]
+    for col in num_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype("int32")
+
+    # Tratamento de Data
+    ultima = "N/A"
+    if "Data" in df.columns:
+        df["Data_Dt"] = pd.to_datetime(df["Data"], dayfirst=True, errors="coerce")
+        try:
+            m = df["Data_Dt"].max()
+            if pd.notna(m): ultima = m.strftime("%d/%m/%Y")
+        except: pass
+
+        # Remove coluna original de texto para economizar memória
+        df.drop(columns=["Data"], inplace=True)
+
+    # Se não achou data na coluna, tenta data do arquivo
+    if ultima == "N/A" and os.path.exists(path):
+         ts = os.path.getmtime(path)
+         ultima = datetime.fromtimestamp(ts).strftime("%d/%m/%Y")
+
+    # Identificador da carga (usado como chave pelos caches derivados da base)
+    df.attrs["dataset_version"] = f"{ultima}-{len(df)}-{int(time.time())}"
+
+    return df, ultima
+
+def dataset_version(df):
+    """Versão da base carregada; caches derivados usam isso para invalidar a cada atualização."""
+    version = df.attrs.get("dataset_version") if df is not None else None
+    if version: return version
+    return f"{len(df) if df is not None else 0}-{id(df)}"
\ No newline at end of file
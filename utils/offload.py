@@ -0,0 +1,207 @@
+# utils/offload.py
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+from utils.loaders import DATA_FOLDER, shared_base_path
+from utils.shared_frame import write_frame, map_frame
+
+# Agregações pesadas (pivots do relatório personalizado, Campaign Flow) num pool de processos,
+# fora da thread do script: o GIL fica livre para as outras sessões.
+#
+# Desligado por padrão. Para ligar, no .streamlit/secrets.toml:
+#
+#     [offload]
+#     workers = 2          # processos do pool (0 = desligado)
+#     min_rows = 200000    # abaixo disso roda na própria sessão (o vai-e-volta custa mais)
+#
+# Os workers não recebem a base por pickle: ela é gravada uma vez por versão num arquivo
+# Arrow IPC (snapshot, utils/shared_frame) que cada worker mapeia em memória; a tarefa leva só
+# a máscara de linhas (1 bit por linha) e as colunas. A base Crowley já publicada pelo loader
+# é usada direto, sem segundo snapshot. O resultado volta como buffer Arrow IPC.
+
+OFFLOAD_FOLDER = os.path.join(DATA_FOLDER, "offload")
+OFFLOAD_MIN_ROWS = 200_000
+# Snapshots que um worker mantém mapeados (versões antigas saem primeiro)
+WORKER_MAX_SNAPSHOTS = 4
+# Snapshots sem uso há mais que isso são apagados (sobras de processos anteriores)
+SNAPSHOT_MAX_AGE_SECONDS = 24 * 3600
+
+# Snapshots gravados por este processo: nome -> (id, caminho)
+_published = {}
+_publish_lock = threading.Lock()
+
+# Lado do worker: caminho -> DataFrame mapeado
+_worker_frames = {}
+
+
+def _offload_config():
+    try:
+        cfg = st.secrets.get("offload", {})
+        return max(0, int(cfg.get("workers", 0))), int(cfg.get("min_rows", OFFLOAD_MIN_ROWS))
+    except Exception:
+        # Sem secrets.toml (ou valor inválido): desligado
+        return 0, OFFLOAD_MIN_ROWS
+
+
+@st.cache_resource
+def _pool(workers):
+    # spawn: o processo do Streamlit tem threads (fork copiaria locks em estado indefinido)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def snapshot_id(name, version):
+    """Identidade do snapshot de um DataFrame: nome da fonte + versão da base."""
+    return f"{name}:{version}"
+
+
+def _snapshot_path(sid):
+    return os.path.join(OFFLOAD_FOLDER, hashlib.sha256(sid.encode("utf-8")).hexdigest()[:32] + ".arrow")
+
+
+def _prune_snapshots(keep):
+    limite = time.time() - SNAPSHOT_MAX_AGE_SECONDS
+    for entry in os.scandir(OFFLOAD_FOLDER):
+        if entry.path in keep or not entry.name.endswith(".arrow"):
+            continue
+        try:
+            if entry.stat().st_mtime < limite:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _publish(frame, sid):
+    """Caminho do snapshot `sid`, gravando-o na primeira vez (uma versão por nome)."""
+    shared = shared_base_path(frame)
+    if shared is not None and os.path.exists(shared):
+        return shared  # apagado quando outro processo publica uma base nova: aí grava o próprio
+    name = sid.split(":", 1)[0]
+    with _publish_lock:
+        current = _published.get(name)
+        if current is not None and current[0] == sid and os.path.exists(current[1]):
+            return current[1]
+        path = _snapshot_path(sid)
+        if not os.path.exists(path):
+            write_frame(frame, path)
+        if current is not None and current[1] != path:
+            # Versão anterior: os workers que ainda a mapeiam seguem lendo (o arquivo só some do diretório)
+            try:
+                os.remove(current[1])
+            except OSError:
+                pass
+        _published[name] = (sid, path)
+        _prune_snapshots({p for _, p in _published.values()})
+        return path
+
+
+def _arrow_safe(df):
+    # Só vai por Arrow o que volta idêntico: rótulos sem tipos misturados e colunas object só de texto
+    labels = [df.columns.get_level_values(i) for i in range(df.columns.nlevels)]
+    if any(isinstance(lbl.dtype, pd.CategoricalDtype) for lbl in labels):
+        return False  # o pyarrow não reconstrói cabeçalhos categóricos
+    labels += [df.index.get_level_values(i) for i in range(df.index.nlevels)]
+    if any(pd.api.types.infer_dtype(lbl, skipna=True).startswith("mixed") for lbl in labels):
+        return False
+    if df.columns.has_duplicates:
+        return False
+    for i, dtype in enumerate(df.dtypes):
+        if dtype == object and pd.api.types.infer_dtype(df.iloc[:, i], skipna=True) != "string":
+            return False
+    return True
+
+
+class _ArrowFrame:
+    """DataFrame serializado como stream Arrow IPC (o pickle leva só o buffer)."""
+
+    def __init__(self, df):
+        table = pa.Table.from_pandas(df)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        self.buffer = sink.getvalue()
+
+    def to_pandas(self):
+        return pa.ipc.open_stream(self.buffer).read_all().to_pandas()
+
+
+def _encode(result):
+    if isinstance(result, pd.DataFrame) and _arrow_safe(result):
+        try:
+            return _ArrowFrame(result)
+        except (pa.ArrowException, TypeError, ValueError):
+            return result
+    if isinstance(result, dict):
+        return {k: _encode(v) for k, v in result.items()}
+    if isinstance(result, (list, tuple)):
+        return type(result)(_encode(v) for v in result)
+    return result
+
+
+def _decode(result):
+    if isinstance(result, _ArrowFrame):
+        return result.to_pandas()
+    if isinstance(result, dict):
+        return {k: _decode(v) for k, v in result.items()}
+    if isinstance(result, (list, tuple)):
+        return type(result)(_decode(v) for v in result)
+    return result
+
+
+def _attach(path):
+    frame = _worker_frames.get(path)
+    if frame is None:
+        if len(_worker_frames) >= WORKER_MAX_SNAPSHOTS:
+            _worker_frames.pop(next(iter(_worker_frames)))
+        # Leitura zero-copy: as colunas apontam para o arquivo mapeado (páginas compartilhadas pelo SO)
+        frame = map_frame(path)
+        _worker_frames[path] = frame
+    return frame
+
+
+def _worker_run(path, task, args, mask_bits, n_rows, columns):
+    mask = None if mask_bits is None else np.unpackbits(mask_bits, count=n_rows).view(bool)
+    return _encode(_run_inline(task, _attach(path), args, mask, columns))
+
+
+def _run_inline(task, frame, args, mask, columns):
+    if mask is None:
+        return task(frame if columns is None else frame[columns], *args)
+    # Linhas e colunas num único recorte: a seleção é a única cópia
+    mask = np.asarray(mask)
+    return task(frame.loc[mask] if columns is None else frame.loc[mask, columns], *args)
+
+
+def run_aggregation(task, frame, *args, snapshot, mask=None, columns=None):
+    """
+    `task(frame.loc[mask, columns], *args)` — no pool de processos quando ligado e a seleção é
+    grande; senão, aqui mesmo. `task` precisa ser uma função pura de módulo (importável pelo
+    worker, sem Streamlit) que não dependa do índice das linhas. `snapshot` = snapshot_id(...)
+    do `frame`: o mesmo id precisa sempre corresponder ao mesmo conteúdo.
+    """
+    workers, min_rows = _offload_config()
+    n_sel = len(frame) if mask is None else int(np.count_nonzero(mask))
+    if workers == 0 or n_sel < min_rows:
+        return _run_inline(task, frame, args, mask, columns)
+
+    path = _publish(frame, snapshot)
+    mask_bits = None if mask is None else np.packbits(np.asarray(mask, dtype=bool))
+    try:
+        result = _pool(workers).submit(_worker_run, path, task, args, mask_bits, len(frame), columns).result()
+    except BrokenProcessPool:
+        # Worker morto (memória, sinal): recria o pool na próxima vez e calcula aqui
+        _pool.clear()
+        return _run_inline(task, frame, args, mask, columns)
+    except FileNotFoundError:
+        # Snapshot apagado entre a publicação e a leitura no worker (base trocada por outro processo)
+        return _run_inline(task, frame, args, mask, columns)
+    return _decode(result)
@@ -0,0 +1,257 @@
+# utils/pivot.py
+import numpy as np
+import pandas as pd
+
+from utils.analytics import MAX_BITMAP_SIZE
+
+VOL_COL = "Volume de Insercoes"
+DUR_COL = "Duracao"
+# Tempo de ar de cada registro: inserções × duração da peça (materializado na base e nos rollups)
+AIRTIME_COL = "Tempo de Ar"
+# Top N: membros mantidos por dimensão; o restante vira OUTROS_LABEL
+OUTROS_LABEL = "Outros"
+TIME_DIMS = ["Ano", "Mes", "Dia"]
+
+# Métricas do relatório personalizado: chave -> (rótulo, tipo, colunas de origem)
+# - sum: soma da coluna (aditiva; é o que o pivot_table já fazia)
+# - ratio: soma(numerador) / soma(denominador), recalculada também nos totais
+# - distinct: valores distintos da coluna, contados de novo em cada total (não é aditiva)
+PIVOT_METRICS = {
+    VOL_COL: ("Inserções", "sum", [VOL_COL]),
+    DUR_COL: ("Duração", "sum", [DUR_COL]),
+    AIRTIME_COL: ("Tempo de Ar", "sum", [AIRTIME_COL]),
+    "Duracao Media": ("Duração Média", "ratio", [AIRTIME_COL, VOL_COL]),
+    "Anunciantes Distintos": ("Anunciantes Distintos", "distinct", ["Anunciante"]),
+    "Anuncios Distintos": ("Anúncios Distintos", "distinct", ["Anuncio"]),
+    "Veiculos Distintos": ("Veículos Distintos", "distinct", ["Emissora"]),
+}
+
+
+def add_airtime(df):
+    """Acrescenta AIRTIME_COL (inserções × duração) quando as duas colunas existem."""
+    if VOL_COL in df.columns and DUR_COL in df.columns:
+        vol = pd.to_numeric(df[VOL_COL], errors="coerce").fillna(0).to_numpy()
+        dur = pd.to_numeric(df[DUR_COL], errors="coerce").fillna(0).to_numpy()
+        df[AIRTIME_COL] = vol * dur
+    return df
+
+
+def metric_columns(metrics):
+    """Colunas de origem necessárias para `metrics`, sem repetição."""
+    return list(dict.fromkeys(c for m in metrics for c in PIVOT_METRICS[m][2]))
+
+
+def needs_engine(metrics):
+    """True quando alguma métrica não é uma soma direta de coluna (pivot_table não atende)."""
+    return any(PIVOT_METRICS[m][1] != "sum" or PIVOT_METRICS[m][2] != [m] for m in metrics)
+
+
+def _codes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy().astype(np.int64), len(series.cat.categories)
+    codes, uniques = pd.factorize(series.to_numpy())
+    return codes.astype(np.int64), len(uniques)
+
+
+def _group_ids(codes_list, n_rows, sort):
+    """
+    Id (0..n-1) por linha para a combinação de códigos. `sort=False` numera na ordem de primeira
+    ocorrência (como groupby sort=False); `sort=True`, na ordem das categorias.
+    """
+    combined = np.zeros(n_rows, dtype=np.int64)
+    space = 1
+    for codes, n_cats in codes_list:
+        n_cats = max(n_cats, 1)
+        if space * n_cats >= 2 ** 62:
+            combined, uniques = pd.factorize(combined, sort=True)
+            combined = combined.astype(np.int64)
+            space = max(len(uniques), 1)
+        combined = combined * n_cats + codes
+        space *= n_cats
+    ids, uniques = pd.factorize(combined, sort=sort)
+    return ids.astype(np.int64), len(uniques)
+
+
+def _first_positions(ids, n_groups):
+    # Posição da primeira linha de cada grupo (atribuição de trás para frente: vence a primeira)
+    first = np.zeros(n_groups, dtype=np.int64)
+    first[ids[::-1]] = np.arange(len(ids) - 1, -1, -1)
+    return first
+
+
+def _distinct_per_group(group_ids, n_groups, x_codes, n_x):
+    """Valores distintos de `x_codes` por grupo: bitmap grupo × valor, ou tabela hash se for grande."""
+    ok = x_codes >= 0
+    n_x = max(n_x, 1)
+    key = group_ids[ok] * n_x + x_codes[ok]
+    if n_groups * n_x <= MAX_BITMAP_SIZE:
+        seen = np.zeros(n_groups * n_x, dtype=bool)
+        seen[key] = True
+        return seen.reshape(n_groups, n_x).sum(axis=1)
+    return np.bincount(pd.unique(key) // n_x, minlength=n_groups)
+
+
+def _labels(df, cols, positions, extra=None):
+    # Rótulos de cada grupo (valores da primeira linha) + rótulo opcional do total
+    arrays = []
+    for i, col in enumerate(cols):
+        values = df[col].to_numpy()[positions].tolist()
+        if extra is not None:
+            values.append(extra if i == 0 else "")
+        arrays.append(values)
+    return arrays
+
+
+def pivot_metrics(df, rows, cols, metrics, margins=False, margins_name="TOTAL", sort=False):
+    """
+    Pivot de `df` (já filtrado) com as métricas de PIVOT_METRICS, no mesmo formato do
+    `pd.pivot_table(..., fill_value=0, observed=True)`: colunas (métrica, *cols) e, com
+    `margins`, linha e colunas `margins_name` por métrica.
+
+    Linhas e colunas viram ids de grupo pelos códigos das dimensões; somas são bincounts por
+    célula, razões são recalculadas a partir das somas e contagens distintas saem de pares
+    (grupo, código) únicos — em cada célula e de novo em cada total, pois não são aditivas.
+    Linhas com dimensão nula ficam de fora, como no groupby.
+    """
+    dim_codes = {c: _codes(df[c]) for c in dict.fromkeys(rows + cols)}
+    valid = np.ones(len(df), dtype=bool)
+    for codes, _ in dim_codes.values():
+        valid &= codes >= 0
+    positions = np.flatnonzero(valid)
+
+    row_ids, n_r = _group_ids([(dim_codes[c][0][valid], dim_codes[c][1]) for c in rows], len(positions), sort)
+    col_ids, n_c = _group_ids([(dim_codes[c][0][valid], dim_codes[c][1]) for c in cols], len(positions), sort)
+    cell = row_ids * n_c + col_ids
+
+    sums = {}
+
+    def grid_sum(col):
+        if col not in sums:
+            w = pd.to_numeric(df[col], errors="coerce").fillna(0).to_numpy(dtype=np.float64)[valid]
+            g = np.bincount(cell, weights=w, minlength=n_r * n_c).reshape(n_r, n_c)
+            sums[col] = (g, g.sum(axis=1), g.sum(axis=0), g.sum())
+        return sums[col]
+
+    blocks = []
+    for m in metrics:
+        _, kind, sources = PIVOT_METRICS[m]
+        if kind == "sum":
+            grid, row_tot, col_tot, total = grid_sum(sources[0])
+            if pd.api.types.is_integer_dtype(df[sources[0]].dtype):
+                grid, row_tot, col_tot, total = (np.rint(x).astype(np.int64) for x in (grid, row_tot, col_tot, total))
+        elif kind == "ratio":
+            parts = list(zip(grid_sum(sources[0]), grid_sum(sources[1])))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                grid, row_tot, col_tot, total = (
+                    np.round(np.where(den > 0, num / np.where(den > 0, den, 1), 0.0), 2) for num, den in parts
+                )
+        else:
+            x_codes, n_x = _codes(df[sources[0]])
+            x_codes = x_codes[valid]
+            grid = _distinct_per_group(cell, n_r * n_c, x_codes, n_x).reshape(n_r, n_c)
+            row_tot = _distinct_per_group(row_ids, n_r, x_codes, n_x)
+            col_tot = _distinct_per_group(col_ids, n_c, x_codes, n_x)
+            total = _distinct_per_group(np.zeros(len(x_codes), dtype=np.int64), 1, x_codes, n_x)[0]
+        blocks.append((m, grid, row_tot, col_tot, total))
+
+    add_row_total = margins and bool(rows)
+    add_col_total = margins and bool(cols)
+
+    data = {}
+    col_positions = positions[_first_positions(col_ids, n_c)] if cols else None
+    for m, grid, row_tot, col_tot, total in blocks:
+        mat = np.vstack([grid, col_tot[None, :]]) if add_row_total else grid
+        if cols:
+            col_labels = list(zip(*_labels(df, cols, col_positions)))
+            for j, label in enumerate(col_labels):
+                data[(m,) + label] = mat[:, j]
+            if add_col_total:
+                data[(m, margins_name) + ("",) * (len(cols) - 1)] = np.append(row_tot, total) if add_row_total else row_tot
+        else:
+            data[m] = mat[:, 0]
+
+    if rows:
+        arrays = _labels(df, rows, positions[_first_positions(row_ids, n_r)], margins_name if add_row_total else None)
+        index = pd.Index(arrays[0], name=rows[0]) if len(rows) == 1 else pd.MultiIndex.from_arrays(arrays, names=rows)
+    else:
+        index = pd.Index(["Total"])
+
+    out = pd.DataFrame(data, index=index)
+    if cols:
+        out.columns = pd.MultiIndex.from_tuples(list(data.keys()), names=[None] + cols)
+    return out
+
+
+def fold_top_n(df_slice, dims, metric, n):
+    """
+    Mantém os `n` maiores membros de cada dimensão de `dims` pela soma de `metric` e junta o
+    restante em "Outros". Cada coluna vira categoria na ordem do ranking (dimensões de tempo
+    na ordem natural), com "Outros" por último; a troca é uma tabela de códigos + np.take.
+    """
+    out = df_slice.copy(deep=False)
+    weights = out[metric].to_numpy(dtype=float)
+    for col in dims:
+        series = out[col]
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype("category")
+        categories = series.cat.categories
+        codes = series.cat.codes.to_numpy()
+        valid = codes >= 0
+
+        totals = np.bincount(codes[valid], weights=weights[valid], minlength=len(categories))
+        present = np.flatnonzero(np.bincount(codes[valid], minlength=len(categories)))
+        ranked = present[np.argsort(-totals[present], kind="stable")]
+        keep, folded = ranked[:n], ranked[n:]
+        if col in TIME_DIMS:
+            keep = np.sort(keep)
+
+        new_categories = list(categories[keep])
+        lut = np.full(len(categories) + 1, -1, dtype=np.int32)
+        lut[keep] = np.arange(len(keep))
+        if len(folded):
+            outros = OUTROS_LABEL if OUTROS_LABEL not in new_categories else f"{OUTROS_LABEL} (demais)"
+            lut[folded] = len(keep)
+            new_categories.append(outros)
+        out[col] = pd.Categorical.from_codes(np.take(lut, codes), categories=new_categories)
+    return out
+
+
+def report_pivot(df_filtered, rows, cols, metrics, margins=False, top_n=None, top_n_metric=None):
+    """
+    Pivot do relatório personalizado sobre as linhas já filtradas (só as colunas necessárias):
+    Top N opcional, motor próprio quando há métricas não aditivas e métricas na ordem escolhida.
+    Função pura — pode rodar num worker de utils.offload.
+    """
+    if top_n:
+        df_filtered = fold_top_n(df_filtered, rows + cols, top_n_metric, top_n)
+
+    if needs_engine(metrics):
+        # Distintos e razões não são somas: motor próprio, com totais recalculados
+        pivot = pivot_metrics(
+            df_filtered,
+            rows,
+            cols,
+            metrics,
+            margins=margins,
+            margins_name="TOTAL",
+            sort=bool(top_n),
+        )
+    else:
+        pivot = pd.pivot_table(
+            df_filtered,
+            index=rows or None,
+            columns=cols or None,
+            values=metrics,
+            aggfunc="sum",
+            fill_value=0,
+            margins=margins,
+            margins_name="TOTAL",
+            observed=True,
+            sort=bool(top_n),
+        )
+    if top_n and isinstance(pivot.columns, pd.MultiIndex):
+        # sort=True também ordena as métricas; volta à ordem escolhida
+        pivot = pivot.reindex(columns=metrics, level=0)
+    elif top_n and set(pivot.columns) == set(metrics):
+        pivot = pivot[metrics]
+    return pivot
@@ -0,0 +1,336 @@
+# utils/presence_index.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.loaders import dataset_version, shared_derived
+
+# Chave de cada linha do índice (uma série diária por combinação)
+KEY_COLS = ["Praca", "Emissora", "Anunciante", "Tipo"]
+VAL_COL = "Volume de Insercoes"
+
+
+class PresenceIndex:
+    """
+    Presença diária pré-calculada por (Praca, Emissora, Anunciante, Tipo) em todo o histórico.
+
+    - `codes`: códigos categóricos de cada chave (linhas ordenadas por Praca → Emissora → Anunciante → Tipo)
+    - `bits`: bitmap de presença chave × dia, compactado em uint8 (ordem do np.packbits)
+    - `indptr` / `days` / `volumes`: volume diário esparso em formato CSR (uma linha por chave)
+
+    Qualquer recorte de dias vira grade fatiando esses arrays, sem voltar à base de fatos.
+    """
+
+    def __init__(self, categories, codes, day0, n_days, bits, indptr, days, volumes):
+        self.categories = categories
+        self.codes = codes
+        self.day0 = day0
+        self.n_days = n_days
+        self.bits = bits
+        self.indptr = indptr
+        self.days = days
+        self.volumes = volumes
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    # --- Publicação entre processos (utils.loaders.shared_derived) ---
+    def to_frames(self):
+        """Arrays do índice como DataFrames de colunas planas (gravados por utils/shared_frame)."""
+        chaves = pd.DataFrame({
+            col: pd.Categorical.from_codes(self.codes[col], categories=self.categories[col]) for col in KEY_COLS
+        })
+        chaves.attrs.update(day0=self.day0.isoformat(), n_days=self.n_days, n_bytes=self.bits.shape[1])
+        return {
+            "chaves": chaves,
+            "indptr": pd.DataFrame({"indptr": self.indptr}),
+            "bits": pd.DataFrame({"bits": self.bits.ravel()}),
+            "registros": pd.DataFrame({"days": self.days, "volumes": self.volumes}),
+        }
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Índice sobre os arrays de `to_frames` (sem cópia quando os frames vêm mapeados)."""
+        chaves = frames["chaves"]
+        return cls(
+            categories={col: chaves[col].cat.categories for col in KEY_COLS},
+            codes={col: chaves[col].cat.codes.to_numpy() for col in KEY_COLS},
+            day0=pd.Timestamp(chaves.attrs["day0"]),
+            n_days=int(chaves.attrs["n_days"]),
+            bits=frames["bits"]["bits"].to_numpy().reshape(len(chaves), int(chaves.attrs["n_bytes"])),
+            indptr=frames["indptr"]["indptr"].to_numpy(),
+            days=frames["registros"]["days"].to_numpy(),
+            volumes=frames["registros"]["volumes"].to_numpy(),
+        )
+
+    # --- Calendário ---
+    def day_of(self, ts):
+        """Converte uma data no deslocamento (em dias) do índice, sem limitar ao intervalo."""
+        return int((pd.Timestamp(ts).normalize() - self.day0).days)
+
+    def date_of(self, day):
+        return self.day0 + pd.Timedelta(days=int(day))
+
+    # --- Seleção de chaves ---
+    def _lookup(self, col, values):
+        """Tabela booleana por código categórico (última posição cobre o código -1)."""
+        cats = self.categories[col]
+        lut = np.zeros(len(cats) + 1, dtype=bool)
+        wanted = cats.get_indexer(pd.Index(list(values)))
+        lut[wanted[wanted >= 0]] = True
+        return lut
+
+    def select(self, praca=None, emissoras=None, anunciantes=None, tipos=None):
+        """Retorna os ids (ordenados) das chaves que atendem aos filtros informados."""
+        mask = np.ones(len(self), dtype=bool)
+        for col, values in (("Praca", [praca] if praca is not None else None),
+                            ("Emissora", emissoras), ("Anunciante", anunciantes), ("Tipo", tipos)):
+            if values:
+                mask &= np.take(self._lookup(col, values), self.codes[col])
+        return np.flatnonzero(mask)
+
+    def values(self, col, rows=None):
+        """Valores distintos (ordenados) de uma coluna da chave entre as linhas informadas."""
+        codes = self.codes[col] if rows is None else self.codes[col][rows]
+        return [str(v) for v in self.categories[col][np.unique(codes)]]
+
+    def labels(self, rows, cols=KEY_COLS):
+        """Rótulos das chaves selecionadas (uma linha por id)."""
+        return pd.DataFrame({
+            col: np.asarray(self.categories[col], dtype=object)[self.codes[col][rows]] for col in cols
+        })
+
+    # --- Acesso às séries diárias ---
+    def _entries(self, rows, start, end):
+        """Posição da linha (em `rows`), dia relativo e volume de cada registro dentro de [start, end)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        lo, hi = self.indptr[rows], self.indptr[rows + 1]
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if total == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        row_pos = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        flat = np.repeat(lo, lengths) + offsets
+
+        day = self.days[flat]
+        keep = (day >= start) & (day < end)
+        return row_pos[keep], day[keep].astype(np.int64) - start, self.volumes[flat[keep]]
+
+    def volume_grid(self, rows, start, end):
+        """Matriz densa (len(rows) × dias) de volume no intervalo [start, end)."""
+        width = max(end - start, 0)
+        row_pos, day, vol = self._entries(rows, start, end)
+        flat = row_pos * width + day
+        grid = np.bincount(flat, weights=vol, minlength=len(rows) * width)
+        return grid.astype(np.int64).reshape(len(rows), width)
+
+    def totals(self, rows, start, end):
+        """Volume total de cada chave no intervalo, sem materializar a grade."""
+        row_pos, _, vol = self._entries(rows, start, end)
+        return np.bincount(row_pos, weights=vol, minlength=len(rows)).astype(np.int64)
+
+    def daily_totals(self, rows, start, end):
+        """Volume somado por dia do intervalo para o conjunto de chaves."""
+        _, day, vol = self._entries(rows, start, end)
+        return np.bincount(day, weights=vol, minlength=max(end - start, 0)).astype(np.int64)
+
+    def presence_grid(self, rows, start, end):
+        """Matriz booleana (len(rows) × dias) lida diretamente do bitmap."""
+        out = np.zeros((len(rows), max(end - start, 0)), dtype=bool)
+        lo, hi = max(0, start), min(self.n_days, end)
+        if hi <= lo:
+            return out
+        byte_lo, byte_hi = lo // 8, (hi + 7) // 8
+        unpacked = np.unpackbits(self.bits[rows, byte_lo:byte_hi], axis=1)
+        shift = lo - byte_lo * 8
+        out[:, lo - start:hi - start] = unpacked[:, shift:shift + (hi - lo)]
+        return out
+
+    def active_days(self, rows, start, end):
+        """Quantidade de dias com presença de cada chave no intervalo."""
+        return self.presence_grid(rows, start, end).sum(axis=1)
+
+    def days_with_data(self):
+        """Vetor booleano por dia do histórico indicando se houve qualquer registro."""
+        flags = np.zeros(self.n_days, dtype=bool)
+        flags[self.days] = True
+        return flags
+
+
+class PresenceGrid:
+    """
+    Grade paginada sobre o índice: ordenação, totais por linha/coluna e escala de cor
+    são calculados uma única vez (por assinatura de filtro). Cada página materializa
+    apenas as linhas visíveis.
+
+    As linhas da grade são as chaves do índice agrupadas por `group_cols`
+    (ex.: Anunciante × Tipo na visão por veículo, Emissora na visão cruzada).
+    """
+
+    def __init__(self, index, rows, day_start, day_end, bucket_starts, group_cols=("Anunciante", "Tipo")):
+        self.index = index
+        self.day_start = day_start
+        self.day_end = day_end
+        self.bucket_starts = np.asarray(bucket_starts, dtype=np.int64)
+        self.group_cols = list(group_cols)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        n_buckets = len(self.bucket_starts)
+
+        # Grupo de cada chave selecionada (códigos combinados das colunas de agrupamento)
+        gkey = np.zeros(len(rows), dtype=np.int64)
+        for col in self.group_cols:
+            gkey = gkey * (len(index.categories[col]) + 1) + index.codes[col][rows]
+        _, group_of_row = np.unique(gkey, return_inverse=True)
+        n_groups = int(group_of_row.max()) + 1 if len(rows) else 0
+
+        row_pos, day, vol = index._entries(rows, day_start, day_end)
+        grp = group_of_row[row_pos]
+        bucket = np.searchsorted(self.bucket_starts, day, side="right") - 1
+
+        totals = np.bincount(grp, weights=vol, minlength=n_groups).astype(np.int64)
+        order = np.flatnonzero(totals > 0)
+        order = order[np.argsort(-totals[order], kind="stable")]
+
+        # Chaves de cada grupo, contíguas e na ordem da grade (CSR grupo → chaves)
+        rank = np.full(n_groups, -1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        row_rank = rank[group_of_row]
+        keep = np.flatnonzero(row_rank >= 0)
+        keep = keep[np.argsort(row_rank[keep], kind="stable")]
+
+        self.rows = rows[keep]
+        self.group_ptr = np.searchsorted(row_rank[keep], np.arange(len(order) + 1))
+        self.group_first_row = self.rows[self.group_ptr[:-1]]
+        self.totals = totals[order]
+        self.col_totals = np.bincount(bucket, weights=vol, minlength=n_buckets).astype(np.int64)
+
+        # Maior célula da grade agregada, sem materializá-la
+        if len(vol):
+            _, cell_inv = np.unique(grp * n_buckets + bucket, return_inverse=True)
+            self.max_cell = int(np.bincount(cell_inv, weights=vol).max())
+        else:
+            self.max_cell = 0
+
+    def __len__(self):
+        return len(self.totals)
+
+    def page(self, start, stop):
+        """Volumes agregados (linhas × colunas) apenas para as linhas [start, stop) da ordenação."""
+        stop = min(stop, len(self))
+        lo, hi = self.group_ptr[start], self.group_ptr[stop]
+        daily = self.index.volume_grid(self.rows[lo:hi], self.day_start, self.day_end)
+        per_key = bucket_grid(daily, self.bucket_starts)
+
+        pos = np.repeat(np.arange(stop - start), np.diff(self.group_ptr[start:stop + 1]))
+        out = np.zeros((stop - start, per_key.shape[1]), dtype=np.int64)
+        np.add.at(out, pos, per_key)
+        return out
+
+    def labels(self, start, stop, cols=None):
+        return self.index.labels(self.group_first_row[start:stop], cols or self.group_cols)
+
+
+# Granularidades aceitas pela grade (rótulo exibido → código interno)
+GRANULARITIES = {"Dia": "D", "Semana": "W", "Mês": "M"}
+MES_ABREV = {1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr", 5: "Mai", 6: "Jun",
+             7: "Jul", 8: "Ago", 9: "Set", 10: "Out", 11: "Nov", 12: "Dez"}
+
+
+def period_buckets(ts_ini, ts_fim, granularity="D"):
+    """
+    Divide o intervalo [ts_ini, ts_fim] (datas inclusivas) em colunas.
+    Retorna os deslocamentos iniciais de cada coluna (em dias, relativos a ts_ini) e os rótulos.
+    Semanas começam na segunda-feira; a primeira e a última podem ser parciais.
+    """
+    days = pd.date_range(pd.Timestamp(ts_ini).normalize(), pd.Timestamp(ts_fim).normalize(), freq="D")
+    if len(days) == 0:
+        return np.empty(0, dtype=np.int64), []
+
+    multi_year = days[0].year != days[-1].year
+    day_fmt = "%d/%m/%y" if multi_year else "%d/%m"
+
+    if granularity == "W":
+        starts = np.flatnonzero((days.dayofweek == 0) | (np.arange(len(days)) == 0))
+        labels = [f"Sem {days[i].strftime(day_fmt)}" for i in starts]
+    elif granularity == "M":
+        starts = np.flatnonzero((days.day == 1) | (np.arange(len(days)) == 0))
+        labels = [f"{MES_ABREV[days[i].month]}/{days[i]:%y}" for i in starts]
+    else:
+        starts = np.arange(len(days))
+        same_month = days[0].month == days[-1].month and not multi_year
+        labels = [d.strftime("%d" if same_month else day_fmt) for d in days]
+    return starts.astype(np.int64), labels
+
+
+def bucket_grid(grid, starts):
+    """Agrega as colunas diárias de `grid` nas colunas definidas por `starts` (np.add.reduceat)."""
+    if grid.shape[1] == 0 or len(starts) == 0:
+        return np.zeros((grid.shape[0], len(starts)), dtype=grid.dtype)
+    return np.add.reduceat(grid, starts, axis=1)
+
+
+def build_presence_index(df, val_col=VAL_COL):
+    """Monta o `PresenceIndex` a partir da base de fatos (uma única passada de agrupamento)."""
+    dates = df["Data_Dt"].to_numpy(dtype="datetime64[ns]")
+    valid = ~np.isnat(dates)
+
+    categories, codes = {}, {}
+    for col in KEY_COLS:
+        series = df[col] if isinstance(df[col].dtype, pd.CategoricalDtype) else df[col].astype("category")
+        categories[col] = series.cat.categories
+        codes[col] = series.cat.codes.to_numpy()
+        valid &= codes[col] >= 0
+
+    day0 = pd.Timestamp(dates[valid].min()).normalize()
+    day = ((dates[valid] - np.datetime64(day0, "ns")) // np.timedelta64(1, "D")).astype(np.int64)
+    n_days = int(day.max()) + 1
+
+    # Combina os códigos das chaves em um inteiro (base mista), preservando a ordem Praca → Tipo
+    key = np.zeros(int(valid.sum()), dtype=np.int64)
+    for col in KEY_COLS:
+        key = key * (len(categories[col]) + 1) + codes[col][valid]
+    uniq_keys, key_id = np.unique(key, return_inverse=True)
+
+    weights = df[val_col].to_numpy()[valid] if val_col in df.columns else np.ones(len(key))
+    pair = key_id.astype(np.int64) * n_days + day
+    uniq_pair, pair_inv = np.unique(pair, return_inverse=True)
+    volumes = np.bincount(pair_inv, weights=weights).astype(np.int64)
+
+    pair_key = uniq_pair // n_days
+    pair_day = (uniq_pair % n_days).astype(np.int32)
+    indptr = np.searchsorted(pair_key, np.arange(len(uniq_keys) + 1))
+
+    # Bitmap: pares já estão ordenados por (chave, dia), logo o byte destino é não decrescente
+    n_bytes = (n_days + 7) // 8
+    byte_flat = pair_key * n_bytes + (pair_day >> 3)
+    bit_val = (np.uint8(0x80) >> (pair_day & 7).astype(np.uint8)).astype(np.uint8)
+    starts = np.flatnonzero(np.r_[True, byte_flat[1:] != byte_flat[:-1]])
+    bits = np.zeros(len(uniq_keys) * n_bytes, dtype=np.uint8)
+    bits[byte_flat[starts]] = np.bitwise_or.reduceat(bit_val, starts)
+    bits = bits.reshape(len(uniq_keys), n_bytes)
+
+    # Decompõe a chave combinada de volta nos códigos de cada coluna
+    key_codes = {}
+    rest = uniq_keys
+    for col in reversed(KEY_COLS):
+        base = len(categories[col]) + 1
+        key_codes[col] = (rest % base).astype(np.int32)
+        rest = rest // base
+
+    return PresenceIndex(categories, key_codes, day0, n_days, bits, indptr, pair_day, volumes)
+
+
+@st.cache_resource(ttl=3600, show_spinner="Indexando presença diária...")
+def _cached_presence_index(_df, version):
+    # Arrays gravados ao lado do snapshot compartilhado: um índice por host, não por processo
+    frames = shared_derived(_df, "presenca", lambda df: build_presence_index(df).to_frames())
+    return PresenceIndex.from_frames(frames)
+
+
+def get_presence_index(df):
+    """Índice de presença compartilhado entre sessões, reconstruído apenas quando a base muda."""
+    return _cached_presence_index(df, dataset_version(df))
@@ -0,0 +1,131 @@
+# utils/query_cache.py
+import json
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import pandas as pd
+import streamlit as st
+
+from utils.loaders import dataset_version
+
+# Resultados de consultas das páginas compartilhados entre sessões do processo.
+#
+# Chave = (versão da base, consulta, filtros normalizados): quando a base é atualizada as
+# entradas antigas deixam de ser pedidas e saem pelo LRU. Consultas iguais em andamento são
+# coalescidas: a primeira sessão calcula e as demais esperam o mesmo resultado, em vez de
+# repetir a agregação N vezes (caso típico: todos abrindo a visão padrão logo após a carga).
+#
+# O valor devolvido é o mesmo objeto para todas as sessões: quem usa não pode alterá-lo
+# (operações do pandas que devolvem um novo DataFrame não têm problema).
+
+QUERY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def normalize_spec(spec):
+    """Filtros → texto estável: chaves ordenadas, sets ordenados (seleções múltiplas sem ordem), datas em ISO."""
+    def _default(value):
+        if isinstance(value, (set, frozenset)):
+            return sorted(value, key=str)
+        return str(value)
+    return json.dumps(spec, sort_keys=True, default=_default, ensure_ascii=False)
+
+
+def _nbytes(value):
+    # Estimativa do tamanho em memória (DataFrames pelo memory_usage; coleções somando os itens)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(_nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class _QueryCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # chave -> (valor, bytes); o fim é o mais recente
+        self.total_bytes = 0
+        self.inflight = {}  # chave -> Future do cálculo em andamento
+        self.lock = threading.Lock()
+
+    def _store(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return  # maior que o cache inteiro: só quem pediu usa
+        self.entries[key] = (value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.total_bytes -= old_size
+
+    def get_or_compute(self, key, compute):
+        return self.get_or_compute_many([key], lambda pending: {0: compute()})[0]
+
+    def get_or_compute_many(self, keys, compute):
+        values, owned, waiting = {}, [], {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    values[i] = entry[0]
+                elif key in self.inflight:
+                    waiting[i] = self.inflight[key]
+                else:
+                    self.inflight[key] = Future()
+                    owned.append(i)
+
+        if owned:
+            try:
+                computed = compute(owned)
+            except BaseException as exc:
+                with self.lock:
+                    futures = [self.inflight.pop(keys[i]) for i in owned]
+                for future in futures:
+                    future.set_exception(exc)
+                raise
+            with self.lock:
+                futures = [self.inflight.pop(keys[i]) for i in owned]
+                for i in owned:
+                    self._store(keys[i], computed[i])
+            for i, future in zip(owned, futures):
+                future.set_result(computed[i])
+                values[i] = computed[i]
+
+        # Mesmas consultas já sendo calculadas por outra sessão: espera o resultado (ou o erro)
+        for i, future in waiting.items():
+            values[i] = future.result()
+        return [values[i] for i in range(len(keys))]
+
+
+@st.cache_resource
+def _query_cache():
+    # Um cache por processo: todas as sessões consultam o mesmo
+    return _QueryCache(QUERY_CACHE_MAX_BYTES)
+
+
+def cached_query(df, name, spec, compute):
+    """
+    Resultado de `compute()` para a consulta `name` com os filtros `spec` sobre a base `df`,
+    compartilhado entre sessões. `spec` precisa conter tudo de que o resultado depende (além
+    da base); `compute` não pode chamar funções do Streamlit (o resultado serve a outras sessões).
+    """
+    key = (dataset_version(df), name, normalize_spec(spec))
+    return _query_cache().get_or_compute(key, compute)
+
+
+def cached_query_batch(df, name, specs, compute):
+    """
+    `cached_query` para uma série de consultas do mesmo tipo (ex.: uma por semana), cada uma com
+    sua própria entrada no cache. `compute(pendentes)` recebe só as posições de `specs` que ainda
+    não estão no cache (nem em cálculo por outra sessão) e devolve {posição: resultado}, para que
+    as pendentes saiam de uma única passada. Retorna a lista de resultados na ordem de `specs`.
+    """
+    version = dataset_version(df)
+    keys = [(version, name, normalize_spec(spec)) for spec in specs]
+    return _query_cache().get_or_compute_many(keys, compute)
@@ -0,0 +1,432 @@
+# utils/reports.py
+import numpy as np
+import pandas as pd
+
+from utils.analytics import period_codes, period_matrix, compare_periods, PERIOD_LABELS
+
+# Tabelas das páginas Campaign Flow, Performance Index e Opportunity Radar sem Streamlit: as
+# páginas montam os filtros na tela e chamam estas funções; o batch_reports.py chama as mesmas
+# a partir de um spec.
+
+# Escopo do ranking (Performance Index)
+MODO_PRACA = "Por Praça"
+MODO_NACIONAL = "Nacional (todas as praças)"
+TOTAL_NACIONAL = "NACIONAL"
+VEICULO_CONSOLIDADO = "Consolidado (Todas as emissoras)"
+
+RENAME_DETALHE = {
+    "Praca": "Praça", "Anuncio": "Anúncio", "Duracao": "Duração",
+    "Emissora": "Veículo", "Volume de Insercoes": "Inserções",
+    "Tipo": "Tipo de Veiculação", "DayPart": "DayPart"
+}
+
+
+def day_bounds(dt_ini, dt_fim):
+    """Período [dt_ini 00:00:00, dt_fim 23:59:59] como Timestamps."""
+    return pd.Timestamp(dt_ini), pd.Timestamp(dt_fim) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+
+
+def context_mask(df, dt_ini, dt_fim, praca=None):
+    """Registros do período (e da praça, se informada) — o contexto das listas dos filtros."""
+    ts_ini, ts_fim = day_bounds(dt_ini, dt_fim)
+    mask = (df["Data_Dt"] >= ts_ini) & (df["Data_Dt"] <= ts_fim)
+    if praca is not None:
+        mask = mask & (df["Praca"] == praca)
+    return mask
+
+
+def _fmt_lista(valores):
+    return ", ".join(valores) if valores else "Todos"
+
+
+# ==========================================
+# CAMPAIGN FLOW
+# ==========================================
+
+def _summary_table(df_src, lista_anunciantes, is_exclusive=False, calc_share=True):
+    """Anunciante x Emissora (inserções), com Share % por emissora e linha TOTAL GERAL."""
+    if not lista_anunciantes: return pd.DataFrame()
+
+    df_final = df_src[df_src["Anunciante"].isin(lista_anunciantes)].copy()
+    col_val = "Volume de Insercoes" if "Volume de Insercoes" in df_final.columns else "Contagem"
+    if col_val == "Contagem": df_final["Contagem"] = 1
+
+    pivot_qty = pd.pivot_table(
+        df_final, index="Anunciante", columns="Emissora", values=col_val,
+        aggfunc="sum", fill_value=0, observed=True
+    )
+
+    total_por_anunciante = pivot_qty.sum(axis=1)
+    pivot_qty = pivot_qty.loc[total_por_anunciante.sort_values(ascending=False).index]
+
+    # Se for exclusivo, Share é sempre 100%, retorna simples
+    if is_exclusive:
+        total_row = pivot_qty.sum(numeric_only=True)
+        pivot_qty.loc["TOTAL GERAL"] = total_row
+        return pivot_qty
+
+    # Versão SEM Share
+    if not calc_share:
+        pivot_simple = pivot_qty.copy()
+        pivot_simple["TOTAL"] = total_por_anunciante
+
+        total_row = pivot_simple.sum(numeric_only=True)
+        pivot_simple.loc["TOTAL GERAL"] = total_row
+        return pivot_simple
+
+    # Versão COM Share (Complexa: Coluna Dupla)
+    pivot_share = pivot_qty.div(total_por_anunciante.replace(0, 1), axis=0) * 100
+
+    cols = []
+    for col in pivot_qty.columns:
+        cols.append((col, "Share %"))
+        cols.append((col, "Inserções"))
+    cols.append(("TOTAL", "Inserções"))
+
+    df_multi = pd.DataFrame(index=pivot_qty.index, columns=pd.MultiIndex.from_tuples(cols))
+
+    for col in pivot_qty.columns:
+        df_multi[(col, "Inserções")] = pivot_qty[col]
+        df_multi[(col, "Share %")] = pivot_share[col]
+
+    df_multi[("TOTAL", "Inserções")] = total_por_anunciante
+
+    # Totais
+    totals_qty = pivot_qty.sum(numeric_only=True)
+    grand_total = totals_qty.sum()
+
+    total_geral_row = []
+    for col_tuple in df_multi.columns:
+        emissora, tipo = col_tuple
+        if tipo == "Inserções":
+            if emissora == "TOTAL": val = grand_total
+            else: val = totals_qty.get(emissora, 0)
+            total_geral_row.append(val)
+        else:
+            total_geral_row.append(np.nan)
+
+    df_multi.loc["TOTAL GERAL"] = total_geral_row
+    return df_multi
+
+
+def campaign_flow_tables(df, dt_ini, dt_fim, praca, veiculo, concorrentes=(), tipos=()):
+    """
+    Tabelas do Campaign Flow no formato de `generate_campaign_flow_excel` + contagem de
+    (exclusivos, compartilhados, ausentes). Concorrentes vazio = todas as outras emissoras.
+    Devolve None se não houver registro do veículo nem da concorrência.
+    """
+    df_base = df[context_mask(df, dt_ini, dt_fim, praca)]
+
+    if tipos:
+        df_base = df_base[df_base["Tipo"].isin(tipos)]
+
+    df_target = df_base[df_base["Emissora"] == veiculo]
+
+    if concorrentes: df_comp = df_base[df_base["Emissora"].isin(concorrentes)]
+    else: df_comp = df_base[df_base["Emissora"] != veiculo]
+
+    if df_target.empty and df_comp.empty:
+        return None
+
+    anunciantes_target = set(df_target["Anunciante"].unique()) if not df_target.empty else set()
+    anunciantes_comp = set(df_comp["Anunciante"].unique()) if not df_comp.empty else set()
+
+    exclusivos = anunciantes_target - anunciantes_comp
+    compartilhados = anunciantes_target & anunciantes_comp
+    ausentes = anunciantes_comp - anunciantes_target
+
+    df_full_shared = pd.concat([df_target[df_target["Anunciante"].isin(compartilhados)], df_comp[df_comp["Anunciante"].isin(compartilhados)]])
+
+    # Detalhamento (numérico, sem linha de total)
+    df_detalhe = pd.concat([df_target, df_comp])
+    if "Data_Dt" in df_detalhe.columns:
+        df_detalhe["Data"] = df_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
+
+    cols_originais = ["Data", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
+    cols_existentes = [c for c in cols_originais if c in df_detalhe.columns]
+
+    df_exib = df_detalhe[cols_existentes].rename(columns=RENAME_DETALHE)
+    df_exib.sort_values(by=["Anunciante", "Data"], inplace=True)
+
+    dfs_dict = {
+        'exclusivos': _summary_table(df_target, exclusivos, is_exclusive=True),
+        'comp_vol': _summary_table(df_full_shared, compartilhados, is_exclusive=False, calc_share=False),
+        'comp_share': _summary_table(df_full_shared, compartilhados, is_exclusive=False, calc_share=True),
+        'ausentes_vol': _summary_table(df_comp, ausentes, is_exclusive=False, calc_share=False),
+        'ausentes_share': _summary_table(df_comp, ausentes, is_exclusive=False, calc_share=True),
+        'detalhe': df_exib
+    }
+    return dfs_dict, (len(exclusivos), len(compartilhados), len(ausentes))
+
+
+def campaign_flow_filters(dt_ini, dt_fim, praca, veiculo, concorrentes=(), tipos=()):
+    """Aba 'Filtros' do Excel do Campaign Flow."""
+    return {
+        "Início": dt_ini.strftime("%d/%m/%Y"),
+        "Fim": dt_fim.strftime("%d/%m/%Y"),
+        "Praça": praca,
+        "Veículo": veiculo,
+        "Concorrentes": _fmt_lista(concorrentes),
+        "Tipo de Veiculação": _fmt_lista(tipos)
+    }
+
+
+# ==========================================
+# PERFORMANCE INDEX
+# ==========================================
+
+def build_national_leaderboard(df, periods, tipos=(), anunciantes=()):
+    """
+    Ranking de todas as praças e do total nacional com uma única agregação.
+
+    Cada registro recebe um código de período (1 = atual, 2 = anterior, 3 = ambos, quando
+    os períodos se sobrepõem) e a soma é feita uma vez por (Praça, Anunciante, período).
+    Posições, Var % e Share % saem de operações agrupadas por praça.
+    """
+    fim_dia = pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    periodo = period_codes(df["Data_Dt"], tuple((pd.Timestamp(a), pd.Timestamp(b) + fim_dia) for a, b in periods))
+
+    mask = periodo > 0
+    if tipos: mask &= df["Tipo"].isin(tipos).to_numpy()
+    if anunciantes: mask &= df["Anunciante"].isin(anunciantes).to_numpy()
+
+    val_col = "Volume de Insercoes" if "Volume de Insercoes" in df.columns else None
+    df_sel = df.loc[mask, ["Praca", "Anunciante"]]
+    df_sel = df_sel.assign(
+        Periodo=periodo[mask],
+        Valor=df.loc[mask, val_col].to_numpy() if val_col else 1
+    )
+
+    cols_out = ["Praca", "Anunciante", "Ins_Atual", "Ins_Ref", "Rank_Atual", "Rank_Anterior", "Var %", "Share %", "Posição"]
+    if df_sel.empty:
+        return pd.DataFrame(columns=cols_out)
+
+    por_periodo = df_sel.groupby(["Praca", "Anunciante", "Periodo"], observed=True)["Valor"].sum()
+    por_periodo = por_periodo.unstack("Periodo", fill_value=0).reindex(columns=[1, 2, 3], fill_value=0)
+    por_praca = pd.DataFrame({
+        "Ins_Atual": por_periodo[1] + por_periodo[3],
+        "Ins_Ref": por_periodo[2] + por_periodo[3]
+    }).reset_index()
+    por_praca["Praca"] = por_praca["Praca"].astype(str)
+    por_praca["Anunciante"] = por_praca["Anunciante"].astype(str)
+
+    # Total nacional: soma das praças por anunciante (tabela já agregada)
+    nacional = por_praca.groupby("Anunciante", sort=False)[["Ins_Atual", "Ins_Ref"]].sum().reset_index()
+    nacional.insert(0, "Praca", TOTAL_NACIONAL)
+
+    board = pd.concat([nacional, por_praca], ignore_index=True)
+    grp = board.groupby("Praca", sort=False)
+    board["Rank_Atual"] = grp["Ins_Atual"].rank(ascending=False, method='min')
+    board["Rank_Anterior"] = grp["Ins_Ref"].rank(ascending=False, method='min')
+
+    board["Var %"] = np.where(
+        board["Ins_Ref"] > 0,
+        (board["Ins_Atual"] - board["Ins_Ref"]) / board["Ins_Ref"].where(board["Ins_Ref"] > 0, 1),
+        np.where(board["Ins_Atual"] > 0, 1.0, 0.0)
+    )
+    total_praca = grp["Ins_Atual"].transform("sum")
+    board["Share %"] = np.where(total_praca > 0, board["Ins_Atual"] / total_praca.where(total_praca > 0, 1), 0.0)
+
+    # Ordenação dentro de cada praça (nacional primeiro)
+    board["_ordem"] = (board["Praca"] != TOTAL_NACIONAL).astype(int)
+    board = board.sort_values(by=["_ordem", "Praca", "Ins_Atual", "Ins_Ref"], ascending=[True, True, False, False])
+    board["Posição"] = board.groupby("Praca", sort=False).cumcount() + 1
+    return board[cols_out].reset_index(drop=True)
+
+
+def leaderboard_table(df_rank):
+    """Ranking já calculado → tabela de exibição/exportação com a linha TOTAL GERAL."""
+    df_rank = df_rank.rename(columns={
+        "Posição": "Ranking",
+        "Rank_Anterior": "Posição Anterior",
+        "Ins_Atual": "Inserções (Atual)",
+        "Ins_Ref": "Inserções (Anterior)"
+    })
+
+    total_ins_atual = df_rank["Inserções (Atual)"].sum()
+    total_ins_ref = df_rank["Inserções (Anterior)"].sum()
+    var_total = (total_ins_atual - total_ins_ref) / total_ins_ref if total_ins_ref > 0 else 0.0
+
+    row_total = {
+        "Ranking": "",
+        "Posição Anterior": "",
+        "Anunciante": "TOTAL GERAL",
+        "Inserções (Atual)": total_ins_atual,
+        "Share %": "",
+        "Var %": var_total,
+        "Inserções (Anterior)": total_ins_ref
+    }
+
+    cols_show = ["Ranking", "Posição Anterior", "Anunciante", "Inserções (Atual)", "Share %", "Var %", "Inserções (Anterior)"]
+    df_final_data = df_rank[cols_show].copy()
+
+    # DF Numérico (com total row) para Styler e Exportação (Ranking)
+    return pd.concat([df_final_data, pd.DataFrame([row_total])], ignore_index=True)
+
+
+def performance_mask(df, praca, veiculo=VEICULO_CONSOLIDADO, anunciantes=(), tipos=()):
+    """Máscara do filtro base da praça/veículo (praça None = todas; veículo consolidado = todos)."""
+    mask_base = (df["Praca"] == praca) if praca is not None else pd.Series(True, index=df.index)
+    if anunciantes: mask_base = mask_base & (df["Anunciante"].isin(anunciantes))
+    if tipos: mask_base = mask_base & (df["Tipo"].isin(tipos))
+    if veiculo != VEICULO_CONSOLIDADO: mask_base = mask_base & (df["Emissora"] == veiculo)
+    return mask_base
+
+
+def performance_ranking(df_base, dt_ini, dt_fim, ref_ini, ref_fim):
+    """
+    Ranking de uma praça/veículo (filtro base já aplicado): agregação única por (Anunciante, período),
+    comparação atual x anterior, Share % e Posição. Entrada de `leaderboard_table`.
+    """
+    matriz = period_matrix(df_base, [("Atual", dt_ini, dt_fim), ("Anterior", ref_ini, ref_fim)])
+    df_rank = compare_periods(matriz, "Atual", "Anterior").rename(columns={"Vol_Atual": "Ins_Atual", "Vol_Ref": "Ins_Ref"})
+    df_rank = df_rank.reset_index()
+
+    total_atual = df_rank["Ins_Atual"].sum()
+    df_rank["Share %"] = (df_rank["Ins_Atual"] / total_atual) if total_atual > 0 else 0.0
+
+    # Ordenação
+    df_rank = df_rank.sort_values(by=["Ins_Atual", "Ins_Ref"], ascending=[False, False]).reset_index(drop=True)
+    df_rank["Posição"] = range(1, len(df_rank) + 1)
+    return df_rank
+
+
+def performance_leaderboard(df, dt_ini, dt_fim, ref_ini, ref_fim, praca=None, veiculo=VEICULO_CONSOLIDADO,
+                            anunciantes=(), tipos=()):
+    """
+    Ranking de uma praça/veículo (praça None = todas) já como tabela de exibição/exportação.
+    Devolve None se o filtro base não tiver dados em nenhum dos dois períodos.
+    """
+    ts_ini, ts_fim = day_bounds(dt_ini, dt_fim)
+    ts_ref_ini, ts_ref_fim = day_bounds(ref_ini, ref_fim)
+    df_base = df[performance_mask(df, praca, veiculo, anunciantes, tipos)]
+    em_atual = (df_base["Data_Dt"] >= ts_ini) & (df_base["Data_Dt"] <= ts_fim)
+    em_ref = (df_base["Data_Dt"] >= ts_ref_ini) & (df_base["Data_Dt"] <= ts_ref_fim)
+    if not em_atual.any() and not em_ref.any():
+        return None
+    return leaderboard_table(performance_ranking(df_base, dt_ini, dt_fim, ref_ini, ref_fim))
+
+
+def performance_detail(df, mask_base, periods):
+    """
+    Detalhamento dos dois períodos (numérico, sem total), com a coluna Período.
+    `periods` = ((ini, fim), (ref_ini, ref_fim)) em Timestamps, limites inclusivos.
+    """
+    # União dos dois períodos numa única máscara + coluna de período (mantém duplicatas reais)
+    codigo = period_codes(df["Data_Dt"], periods)
+    mask_detail = np.asarray(mask_base) & (codigo > 0)
+
+    cols_originais = ["Data_Dt", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
+    cols_existentes = [c for c in cols_originais if c in df.columns]
+
+    df_exib_detalhe = df.loc[mask_detail, cols_existentes].rename(columns=RENAME_DETALHE)
+    df_exib_detalhe["Período"] = PERIOD_LABELS[codigo[mask_detail]]
+
+    if "Data_Dt" in df_exib_detalhe.columns:
+        df_exib_detalhe["Data"] = df_exib_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
+        df_exib_detalhe = df_exib_detalhe.drop(columns=["Data_Dt"])
+        cols = ["Data", "Período"] + [c for c in df_exib_detalhe.columns if c not in ("Data", "Período")]
+        df_exib_detalhe = df_exib_detalhe[cols]
+
+    df_exib_detalhe.sort_values(by=["Anunciante", "Data"], inplace=True)
+    return df_exib_detalhe
+
+
+def performance_index_tables(df, dt_ini, dt_fim, ref_ini, ref_fim, modo=MODO_PRACA, praca=None,
+                             veiculo=VEICULO_CONSOLIDADO, anunciantes=(), tipos=()):
+    """
+    Tabelas do Performance Index no formato de `generate_performance_index_excel`, como a página
+    exporta sem as seções opcionais (consistência, trajetória, multi-período). No modo nacional,
+    uma aba por praça e a praça exibida é o total nacional (sem detalhamento).
+    Devolve None se não houver dados nos períodos.
+    """
+    if modo == MODO_NACIONAL:
+        board = build_national_leaderboard(df, ((str(dt_ini), str(dt_fim)), (str(ref_ini), str(ref_fim))), tuple(tipos), tuple(anunciantes))
+        if board.empty:
+            return None
+        rankings = {p: leaderboard_table(board[board["Praca"] == p]) for p in board["Praca"].drop_duplicates()}
+        return {'ranking': None, 'rankings': rankings, 'trajectory': None, 'multi_period': None, 'detail': None}
+
+    ranking = performance_leaderboard(df, dt_ini, dt_fim, ref_ini, ref_fim, praca, veiculo, anunciantes, tipos)
+    if ranking is None:
+        return None
+
+    mask_base = performance_mask(df, praca, veiculo, anunciantes, tipos)
+    return {
+        'ranking': ranking,
+        'rankings': None,
+        'trajectory': None,
+        'multi_period': None,
+        'detail': performance_detail(df, mask_base, (day_bounds(dt_ini, dt_fim), day_bounds(ref_ini, ref_fim)))
+    }
+
+
+def performance_index_filters(dt_ini, dt_fim, ref_ini, ref_fim, modo=MODO_PRACA, praca=None,
+                              veiculo=VEICULO_CONSOLIDADO, anunciantes=(), tipos=()):
+    """Aba 'Filtros' do Excel do Performance Index."""
+    return {
+        "Período Atual": f"{dt_ini.strftime('%d/%m/%Y')} a {dt_fim.strftime('%d/%m/%Y')}",
+        "Período Comparativo": f"{ref_ini.strftime('%d/%m/%Y')} a {ref_fim.strftime('%d/%m/%Y')}",
+        "Escopo": modo,
+        "Praça": "Todas (uma aba por praça)" if modo == MODO_NACIONAL else praca,
+        "Veículo": VEICULO_CONSOLIDADO if modo == MODO_NACIONAL else veiculo,
+        "Anunciantes Filtro": _fmt_lista(anunciantes),
+        "Tipo de Veiculação": _fmt_lista(tipos)
+    }
+
+
+# ==========================================
+# OPPORTUNITY RADAR
+# ==========================================
+
+def opportunity_radar_tables(df, dt_ini, dt_fim, ref_ini, ref_fim, praca, veiculo=VEICULO_CONSOLIDADO,
+                             anunciantes=(), tipos=()):
+    """
+    Anunciantes novos da praça/veículo (com inserções no período atual e nenhuma no de referência).
+    Devolve {'novos': quantidade, 'overview': pivot Anunciante x Emissora com TOTAL e TOTAL GERAL,
+    'detail': detalhamento numérico do período atual, 'erro': mensagem se o pivot falhou (overview
+    vazio)} ou None se não houver novos.
+    """
+    df_base = df[performance_mask(df, praca, veiculo, anunciantes, tipos)]
+    ts_ini, ts_fim = day_bounds(dt_ini, dt_fim)
+    df_atual = df_base[(df_base["Data_Dt"] >= ts_ini) & (df_base["Data_Dt"] <= ts_fim)]
+
+    # Identificação dos Novos (uma agregação por Anunciante × período, situação do par). Conta
+    # registros, não inserções: um registro com volume 0 na referência já tira o anunciante dos novos
+    matriz = period_matrix(df_base, [("Atual", dt_ini, dt_fim), ("Referência", ref_ini, ref_fim)], val_col=None)
+    situacao = compare_periods(matriz, "Atual", "Referência")["Status"] if not matriz.empty else pd.Series(dtype=object)
+    novos_anunciantes = set(situacao.index[situacao == "Novo"])
+    if not novos_anunciantes:
+        return None
+
+    df_resultado = df_atual[df_atual["Anunciante"].astype(str).isin(novos_anunciantes)].copy()
+
+    # --- TABELA RESUMO (PIVOT) ---
+    val_col = "Volume de Insercoes" if "Volume de Insercoes" in df_resultado.columns else "Contagem"
+    if val_col == "Contagem": df_resultado["Contagem"] = 1
+    agg_func = "sum" if val_col == "Volume de Insercoes" else "count"
+
+    pivot_table, erro = pd.DataFrame(), None
+    try:
+        pivot_table = pd.pivot_table(
+            df_resultado, index="Anunciante", columns="Emissora",
+            values=val_col, aggfunc=agg_func, fill_value=0, observed=True
+        )
+        pivot_table["TOTAL"] = pivot_table.sum(axis=1)
+        pivot_table = pivot_table.sort_values(by="TOTAL", ascending=False)
+        pivot_table.loc["TOTAL GERAL"] = pivot_table.sum(numeric_only=True)
+    except Exception as e:
+        pivot_table, erro = pd.DataFrame(), str(e)
+
+    # --- TABELA DETALHADA ---
+    df_detalhe = df_resultado
+    if "Data_Dt" in df_detalhe.columns:
+        df_detalhe["Data"] = df_detalhe["Data_Dt"].dt.strftime("%d/%m/%Y")
+
+    cols_originais = ["Data", "Anunciante", "Anuncio", "Duracao", "Praca", "Emissora", "Tipo", "DayPart", "Volume de Insercoes"]
+    cols_existentes = [c for c in cols_originais if c in df_detalhe.columns]
+
+    df_exib = df_detalhe[cols_existentes].rename(columns=RENAME_DETALHE)
+    df_exib.sort_values(by=["Anunciante", "Data"], inplace=True)
+
+    return {'novos': len(novos_anunciantes), 'overview': pivot_table, 'detail': df_exib, 'erro': erro}
@@ -0,0 +1,107 @@
+# utils/shared_frame.py
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# DataFrame gravado num arquivo Arrow IPC que vários processos mapeiam em memória (somente leitura).
+#
+# As colunas são gravadas de forma que a leitura seja zero-copy: categorias viram os próprios
+# códigos do pandas (int8/int16/int32, -1 = nulo) com as categorias (texto/números) nos metadados; datas
+# viram int64 (NaT incluso); bool vira uint8. Numéricas sem máscara vão como estão. O resto
+# (texto, tipos nullable do pandas) vai como Arrow comum e é convertido (copiado) na leitura.
+# Um único lote por arquivo: cada coluna é um buffer contíguo. O índice não é gravado.
+
+FRAME_METADATA_KEY = b"crowley_frame"
+
+KIND_CATEGORY = "category"
+KIND_DATETIME = "datetime"
+KIND_BOOL = "bool"
+KIND_NUMPY = "numpy"
+KIND_ARROW = "arrow"
+
+
+def _encode_column(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Categorias de texto ou numéricas voltam idênticas do JSON (com o dtype original, ex.: Int32);
+        # as demais vão como dicionário Arrow
+        if pd.api.types.infer_dtype(dtype.categories) in ("string", "integer", "floating"):
+            meta = {
+                "kind": KIND_CATEGORY, "categories": dtype.categories.tolist(),
+                "categories_dtype": str(dtype.categories.dtype), "ordered": bool(dtype.ordered),
+            }
+            return pa.array(series.cat.codes.to_numpy()), meta
+    elif isinstance(dtype, np.dtype):
+        if dtype.kind == "M":
+            return pa.array(series.to_numpy().view(np.int64)), {"kind": KIND_DATETIME, "dtype": dtype.str}
+        if dtype.kind == "b":
+            return pa.array(series.to_numpy().view(np.uint8)), {"kind": KIND_BOOL}
+        if dtype.kind in "iuf":
+            return pa.array(series.to_numpy()), {"kind": KIND_NUMPY}
+    return pa.Array.from_pandas(series), {"kind": KIND_ARROW, "dtype": str(dtype)}
+
+
+def write_frame(df, path):
+    """Grava `df` em `path` (troca atômica: quem já mapeou o arquivo anterior segue lendo)."""
+    arrays, columns = [], []
+    for name in df.columns:
+        array, meta = _encode_column(df[name])
+        arrays.append(array)
+        columns.append(dict(meta, name=name))
+    meta = {"columns": columns, "attrs": {k: v for k, v in df.attrs.items() if isinstance(v, (str, int, float))}}
+    schema = pa.schema(
+        [pa.field(str(c["name"]), a.type) for c, a in zip(columns, arrays)],
+        metadata={FRAME_METADATA_KEY: json.dumps(meta, ensure_ascii=False)},
+    )
+    batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    os.close(fd)
+    try:
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            writer.write_batch(batch)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _decode_column(chunked, meta):
+    kind = meta["kind"]
+    if kind == KIND_ARROW:
+        dtype = pd.api.types.pandas_dtype(meta["dtype"])
+        if hasattr(dtype, "__from_arrow__"):
+            # Tipos do pandas (Int32, string...) voltam como eram, não como float/object
+            return pd.Series(dtype.__from_arrow__(chunked), copy=False)
+        return chunked.to_pandas()
+    values = chunked.chunk(0).to_numpy(zero_copy_only=True)
+    if kind == KIND_CATEGORY:
+        categories = pd.Index(meta["categories"], dtype=meta.get("categories_dtype"))
+        dtype = pd.CategoricalDtype(categories, ordered=meta["ordered"])
+        return pd.Series(pd.Categorical.from_codes(values, dtype=dtype), copy=False)
+    if kind == KIND_DATETIME:
+        return pd.Series(values.view(meta["dtype"]), copy=False)
+    if kind == KIND_BOOL:
+        return pd.Series(values.view(bool), copy=False)
+    return pd.Series(values, copy=False)
+
+
+def map_frame(path):
+    """
+    DataFrame de `path` com as colunas apontando para o arquivo mapeado: vários processos
+    lendo o mesmo arquivo dividem as mesmas páginas de memória. Os arrays são somente leitura
+    (escrever numa coluna levanta ValueError; `df.copy()` devolve uma cópia gravável).
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    meta = json.loads(table.schema.metadata[FRAME_METADATA_KEY])
+    data = {c["name"]: _decode_column(table.column(i), c) for i, c in enumerate(meta["columns"])}
+    # Sem consolidar blocos (consolidar copiaria as colunas para a memória do processo)
+    df = pd.DataFrame(data, copy=False)
+    df.attrs.update(meta["attrs"])
+    return df